@@ -8,21 +8,19 @@ warnings.filterwarnings("ignore")
 import streamlit as st
 from dotenv import load_dotenv
 
-from services.Query_Response_Service import (
-    handle_greeting,
-    handle_bus_query,
-    handle_flight_query,
-    handle_hotel_query,
-    handle_attractions_query,
-    handle_itinerary_query,
-)
-from services.Query_Extraction_service import normalize_message
-from services.Query_Response_Service import classify_intent
-from config import MODEL_NAME
+from services.Query_Response_Service import handle_message
+from services.Dialogue_Service import DialogueState
+from services.Query_Extraction_service import normalize_message, fast_path_stats
+from services.Gemini_Service import ttft_stats
+from services.Metrics_Service import collect_spans, span_breakdown
+from services.CSV_Service import datasets
+from config import DATASET_REFRESH_SECONDS, MODEL_NAME
 
 
 st.set_page_config(page_title="AI Travel Assistant", page_icon="🧭", layout="wide")
 load_dotenv()
+# Streamlit reruns this script per interaction; the watcher thread is started once per process
+datasets.start_watcher(DATASET_REFRESH_SECONDS)
 
 
 def ensure_api_key() -> str:
@@ -55,6 +53,25 @@ with st.sidebar:
     )
     st.divider()
     st.caption("Datasets are loaded from the local dataset/ folder.")
+    fp = fast_path_stats()
+    st.caption(f"Local fast path: {fp['hits']}/{fp['attempts']} queries answered without an LLM routing call.")
+    ttft = ttft_stats()
+    if ttft["count"]:
+        st.caption(f"Time to first token: p50 {ttft['p50']:.2f}s, p95 {ttft['p95']:.2f}s over {ttft['count']} replies.")
+    show_breakdown = st.toggle("Show latency breakdown", value=False)
+    # Filled after each answer; shows the previous answer's breakdown until then
+    breakdown_slot = st.empty()
+
+
+def render_breakdown(rows) -> None:
+    if not show_breakdown or not rows:
+        breakdown_slot.empty()
+        return
+    lines = [f"{name.replace(' ', '&nbsp;')}: {ms:.1f} ms" for name, ms in rows]
+    breakdown_slot.markdown("**Last answer**  \n" + "  \n".join(lines), unsafe_allow_html=True)
+
+
+render_breakdown(st.session_state.get("last_breakdown"))
 
 
 st.title("🧭 AI Travel Assistant")
@@ -62,6 +79,8 @@ st.caption("Powered by Gemini 1.5-flash with local CSV retrieval")
 
 if "messages" not in st.session_state:
     st.session_state.messages = []
+if "dialogue" not in st.session_state:
+    st.session_state.dialogue = DialogueState()
 
 
 for role, content in st.session_state.messages:
@@ -80,7 +99,6 @@ if prompt:
     with st.chat_message("user"):
         st.markdown(prompt)
     st.session_state.messages.append(("user", prompt))
-    intent = classify_intent(user_msg, api_key, MODEL_NAME)
 
     with st.chat_message("assistant"):
         # Anchor for sidebar jump
@@ -90,25 +108,21 @@ if prompt:
         thinking_placeholder = st.empty()
         thinking_placeholder.markdown("_Thinking…_")
 
-        model_name = MODEL_NAME
         fuzzy = True  # always enabled
-        if intent == "greeting":
-            response = handle_greeting(user_msg, api_key, model_name)
-        elif intent == "bus":
-            response = handle_bus_query(user_msg, api_key, fuzzy, model_name)
-        elif intent == "flight":
-            response = handle_flight_query(user_msg, api_key, fuzzy, model_name)
-        elif intent == "hotel":
-            response = handle_hotel_query(user_msg, api_key, fuzzy, model_name)
-        elif intent == "attractions":
-            response = handle_attractions_query(user_msg, api_key, fuzzy, model_name)
-        elif intent == "itinerary":
-            response = handle_itinerary_query(user_msg, api_key, fuzzy, model_name)
-        else:
-            response = "I can help with buses, flights, hotels, attractions, or itineraries. Try asking with a city and optional budget."
-
+        with collect_spans() as spans:
+            response = handle_message(user_msg, api_key, MODEL_NAME, fuzzy=fuzzy, stream=True, state=st.session_state.dialogue)
+
+            if not isinstance(response, str):
+                # Render tokens as they arrive; the placeholder keeps "Thinking…" until the first chunk
+                streamed = ""
+                for chunk in response:
+                    streamed += chunk
+                    thinking_placeholder.markdown(streamed + "▌")
+                response = streamed
         thinking_placeholder.markdown(response)
         st.session_state.messages.append(("assistant", response))
+        st.session_state.last_breakdown = span_breakdown(spans)
+        render_breakdown(st.session_state.last_breakdown)
 
 # Sidebar history links
 with st.sidebar:
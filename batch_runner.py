@@ -0,0 +1,176 @@
+"""
+Headless batch runner: pushes a JSONL file of user messages through the same
+route -> handler pipeline as app.py and streams one JSONL result per message.
+
+Input lines are either {"message": "...", "id": ...} objects or bare JSON strings.
+Results are written as they complete; "index" is the message's position in the input.
+
+    python batch_runner.py queries.jsonl results.jsonl --workers 8 --rps 5
+    python batch_runner.py queries.jsonl results.jsonl --mode async --workers 64
+"""
+
+import os
+import sys
+import warnings
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+warnings.filterwarnings("ignore")
+
+import argparse
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Iterator, List, Optional
+
+from dotenv import load_dotenv
+
+from config import MODEL_NAME
+from services.Gemini_Service import set_rate_limit
+from services.Metrics_Service import set_trace_sink, write_prometheus_snapshot
+from services.Prompt_Service import set_token_stats
+from services.Query_Extraction_service import normalize_message
+from services.Query_Response_Service import ahandle_message, handle_message
+
+
+def read_messages(path: str) -> Iterator[dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        for n, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            if isinstance(item, str):
+                item = {"message": item}
+            item.setdefault("id", n)
+            yield item
+
+
+def _result(item: dict, trace: dict, response: Optional[str], error: Optional[str], elapsed_ms: float) -> dict:
+    timings = trace.get("timings", {})
+    timings["total"] = elapsed_ms
+    return {
+        "id": item["id"],
+        "message": item["message"],
+        "intent": trace.get("intent"),
+        "params": trace.get("params"),
+        "sort": trace.get("sort"),
+        "rows": trace.get("rows"),
+        "response": response,
+        "timings_ms": timings,
+        "error": error,
+    }
+
+
+def run_one(item: dict, api_key: str, model_name: str, fuzzy: bool) -> dict:
+    trace: dict = {}
+    start = time.perf_counter()
+    response, error = None, None
+    try:
+        response = handle_message(normalize_message(item["message"]), api_key, model_name, fuzzy=fuzzy, trace=trace)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    return _result(item, trace, response, error, (time.perf_counter() - start) * 1000)
+
+
+async def arun_one(item: dict, api_key: str, model_name: str, fuzzy: bool) -> dict:
+    trace: dict = {}
+    start = time.perf_counter()
+    response, error = None, None
+    try:
+        response = await ahandle_message(normalize_message(item["message"]), api_key, model_name, fuzzy=fuzzy, trace=trace)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    return _result(item, trace, response, error, (time.perf_counter() - start) * 1000)
+
+
+class _Sink:
+    """Appends results to the output file as they complete and keeps run totals."""
+
+    def __init__(self, path: str) -> None:
+        self._f = open(path, "w", encoding="utf-8")
+        self._lock = threading.Lock()
+        self.latencies: List[float] = []
+        self.errors = 0
+
+    def write(self, result: dict) -> None:
+        line = json.dumps(result, ensure_ascii=False, default=str)
+        with self._lock:
+            self._f.write(line + "\n")
+            self._f.flush()
+            self.latencies.append(result["timings_ms"]["total"])
+            if result["error"]:
+                self.errors += 1
+
+    def close(self) -> None:
+        self._f.close()
+
+
+def run_threads(items: List[dict], sink: _Sink, workers: int, api_key: str, model_name: str, fuzzy: bool) -> None:
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch") as pool:
+        futures = {pool.submit(run_one, item, api_key, model_name, fuzzy): i for i, item in enumerate(items)}
+        # write each result as soon as it is ready, not behind slower messages submitted earlier
+        for fut in as_completed(futures):
+            sink.write({"index": futures[fut], **fut.result()})
+
+
+async def run_async(items: List[dict], sink: _Sink, workers: int, api_key: str, model_name: str, fuzzy: bool) -> None:
+    gate = asyncio.Semaphore(workers)
+
+    async def bounded(index: int, item: dict) -> None:
+        async with gate:
+            sink.write({"index": index, **await arun_one(item, api_key, model_name, fuzzy)})
+
+    await asyncio.gather(*(bounded(i, item) for i, item in enumerate(items)))
+
+
+def summarize(sink: _Sink, elapsed: float) -> str:
+    n = len(sink.latencies)
+    lat = sorted(sink.latencies)
+    pct = lambda p: lat[min(n - 1, int(n * p))] if n else 0.0
+    return (
+        f"{n} messages in {elapsed:.2f}s ({n / elapsed if elapsed else 0.0:.2f} msg/s), "
+        f"{sink.errors} errors, latency p50 {pct(0.5):.0f} ms, p95 {pct(0.95):.0f} ms, max {lat[-1] if n else 0.0:.0f} ms"
+    )
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Run a JSONL file of travel queries through the assistant pipeline.")
+    parser.add_argument("input", help="JSONL file of user messages")
+    parser.add_argument("output", help="JSONL file to write results to")
+    parser.add_argument("--mode", choices=["thread", "async"], default="thread")
+    parser.add_argument("--workers", type=int, default=8, help="concurrent conversations")
+    parser.add_argument("--rps", type=float, default=None, help="global Gemini requests per second")
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--exact", action="store_true", help="disable fuzzy city matching")
+    parser.add_argument("--trace-log", default=None, help="append every pipeline span to this JSONL file")
+    parser.add_argument("--metrics-out", default=None, help="write a Prometheus text snapshot here when done")
+    parser.add_argument("--token-stats", action="store_true", help="measure context tokens before and after compaction")
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    api_key = os.getenv("GEMINI_API_KEY", "")
+    set_rate_limit(args.rps)
+    if args.trace_log:
+        set_trace_sink(args.trace_log)
+    if args.token_stats:
+        set_token_stats(True)
+    items = list(read_messages(args.input))
+    sink = _Sink(args.output)
+    start = time.perf_counter()
+    try:
+        if args.mode == "async":
+            asyncio.run(run_async(items, sink, args.workers, api_key, args.model, not args.exact))
+        else:
+            run_threads(items, sink, args.workers, api_key, args.model, not args.exact)
+    finally:
+        sink.close()
+    print(summarize(sink, time.perf_counter() - start))
+    if args.metrics_out:
+        write_prometheus_snapshot(args.metrics_out)
+    return 1 if sink.errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
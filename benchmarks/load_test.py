@@ -0,0 +1,195 @@
+"""
+Local load test for server.py: starts it with the stub model, drives it from concurrent
+keep-alive clients for a fixed time and reports throughput, latency percentiles and how much
+of each worker's memory is shared with the others.
+
+    python -m benchmarks.load_test                              # 4 workers, 32 clients, 20 s
+    python -m benchmarks.load_test --workers 1,4 --clients 64 --latency-ms 300
+"""
+
+import os
+import sys
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import datetime
+import http.client
+import itertools
+import json
+import socket
+import subprocess
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from benchmarks.run_benchmarks import RESULTS_DIR, _git_revision, _stats
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (method, path, body) mix: chat turns on the local fast path plus direct retrievals
+REQUESTS: List[Tuple[str, str, Optional[dict]]] = [
+    ("POST", "/chat", {"message": "buses from Agra to Delhi under 2000"}),
+    ("POST", "/chat", {"message": "fastest bus from Bengaluru to Chennai"}),
+    ("POST", "/chat", {"message": "hotels in Goa under 3000"}),
+    ("POST", "/chat", {"message": "places to visit in Jaipur"}),
+    ("POST", "/retrieve/bus", {"source": "Delhi", "destination": "Agra", "budget": 800, "sort": "earliest"}),
+    ("POST", "/retrieve/hotel", {"city": "Mumbai", "budget": 5000}),
+    ("POST", "/retrieve/bus_connections", {"source": "Agra", "destination": "Jaipur"}),
+    ("POST", "/retrieve/attractions", {"city": "Kerala", "theme": "beaches"}),
+]
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _request(conn: http.client.HTTPConnection, method: str, path: str, body: Optional[dict]) -> Tuple[int, dict]:
+    conn.request(method, path, body=json.dumps(body) if body is not None else None, headers={"Content-Type": "application/json"})
+    resp = conn.getresponse()
+    return resp.status, json.loads(resp.read() or b"{}")
+
+
+def start_server(port: int, workers: int, latency_ms: float, timeout: float = 60.0) -> subprocess.Popen:
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "server.py"), "--port", str(port), "--workers", str(workers), "--stub-latency-ms", str(latency_ms)],
+        cwd=ROOT,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        env={**os.environ, "DATASET_REFRESH_SECONDS": "0"},
+    )
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"server exited: {proc.stderr.read().decode(errors='replace')[-2000:]}")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=2)
+            if _request(conn, "GET", "/healthz", None)[0] == 200:
+                conn.close()
+                return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError("server did not become healthy")
+
+
+def _memory_kb(pid: int) -> Optional[Dict[str, int]]:
+    """Rss/Pss/Shared/Private totals from /proc (Linux only)."""
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return None
+    totals: Dict[str, int] = {}
+    for line in lines[1:]:
+        key, _, rest = line.partition(":")
+        if rest.strip().endswith("kB"):
+            totals[key] = int(rest.split()[0])
+    return {
+        "rss_kb": totals.get("Rss", 0),
+        "pss_kb": totals.get("Pss", 0),
+        "shared_kb": totals.get("Shared_Clean", 0) + totals.get("Shared_Dirty", 0),
+        "private_kb": totals.get("Private_Clean", 0) + totals.get("Private_Dirty", 0),
+    }
+
+
+def drive(port: int, clients: int, duration: float) -> dict:
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    pids = set()
+    lock = threading.Lock()
+    stop_at = time.monotonic() + duration
+
+    def client(offset: int) -> None:
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+        mine, bad = [], {}
+        for method, path, body in itertools.islice(itertools.cycle(REQUESTS), offset, None):
+            if time.monotonic() >= stop_at:
+                break
+            start = time.perf_counter()
+            try:
+                status, _ = _request(conn, method, path, body)
+            except (OSError, http.client.HTTPException, ValueError) as e:
+                status = type(e).__name__
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+            mine.append((time.perf_counter() - start) * 1000)
+            if status != 200:
+                bad[f"{path}:{status}"] = bad.get(f"{path}:{status}", 0) + 1
+        try:
+            pids.add(_request(conn, "GET", "/healthz", None)[1]["pid"])
+        except (OSError, http.client.HTTPException, ValueError, KeyError):
+            pass
+        conn.close()
+        with lock:
+            latencies.extend(mine)
+            for k, v in bad.items():
+                errors[k] = errors.get(k, 0) + v
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    ordered = sorted(latencies)
+    return {
+        "requests": len(ordered),
+        "seconds": elapsed,
+        "throughput_rps": len(ordered) / elapsed if elapsed else 0.0,
+        "p99_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] if ordered else None,
+        **_stats(ordered),
+        "errors": errors,
+        "worker_pids": sorted(pids),
+    }
+
+
+def run(workers: int, clients: int, duration: float, latency_ms: float) -> dict:
+    port = _free_port()
+    proc = start_server(port, workers, latency_ms)
+    try:
+        drive(port, min(clients, 8), 1.0)  # warm every worker's lazy paths
+        result = drive(port, clients, duration)
+        result["memory"] = {pid: _memory_kb(pid) for pid in result["worker_pids"]}
+        result["memory"]["parent"] = _memory_kb(proc.pid)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+    result.update(workers=workers, clients=clients, stub_latency_ms=latency_ms)
+    mem = [m for k, m in result["memory"].items() if k != "parent" and m]
+    shared = sum(m["shared_kb"] for m in mem) / max(sum(m["rss_kb"] for m in mem), 1)
+    print(
+        f"  workers {workers:>2}  clients {clients:>3}  {result['throughput_rps']:8.1f} req/s  "
+        f"p50 {result['median_ms']:7.1f} ms  p99 {result['p99_ms']:7.1f} ms  errors {sum(result['errors'].values())}"
+        + (f"  worker RSS {sum(m['rss_kb'] for m in mem) / 1024:.0f} MB, {100 * shared:.0f}% shared" if mem else "")
+    )
+    return result
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Load test server.py against the stub model.")
+    parser.add_argument("--workers", default="4", help="comma-separated worker counts to compare")
+    parser.add_argument("--clients", type=int, default=32, help="concurrent keep-alive clients")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds per run")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="stub model latency per call")
+    parser.add_argument("--out", default=None, help="result JSON path (default benchmarks/results/load-<ts>.json)")
+    args = parser.parse_args(argv)
+
+    runs = [run(int(w), args.clients, args.duration, args.latency_ms) for w in args.workers.split(",") if w.strip()]
+    out = args.out or os.path.join(RESULTS_DIR, f"load-{datetime.datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump({
+            "meta": {"timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"), "git": _git_revision(), "cpus": os.cpu_count()},
+            "runs": runs,
+        }, f, indent=2)
+    print(f"\nWrote {len(runs)} runs to {out}")
+    return 1 if any(r["errors"] for r in runs) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,388 @@
+import os
+import sys
+import warnings
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+warnings.filterwarnings("ignore")
+
+import argparse
+import datetime
+import json
+import logging
+import platform
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+from contextlib import contextmanager
+from dataclasses import replace
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+import services.CSV_Service as csv_service
+import services.Query_Response_Service as responses
+import services.Retrieval_Service as retrieval
+from benchmarks.stub_gemini import StubGeminiClient, stub_gemini
+from services.Dataset_Service import DatasetManager
+from services.Retrieval_Service import Query
+
+
+"""
+Offline benchmark suite. Gemini is replaced by StubGeminiClient, so every number here is
+local work (parsing, indexing, retrieval, rendering, orchestration) plus the configured
+stub latency.
+
+    python -m benchmarks.run_benchmarks                        # writes benchmarks/results/bench-<ts>.json
+    python -m benchmarks.run_benchmarks --scales 1,10,50 --latency-ms 300
+    python -m benchmarks.run_benchmarks --compare benchmarks/results/baseline.json
+
+Timings are steady state: each case runs once untimed (its ``first_ms`` is recorded
+separately) and then ``--repeat`` times.
+"""
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+
+def _stats(samples: List[float]) -> dict:
+    ordered = sorted(samples)
+    return {
+        "n": len(ordered),
+        "min_ms": ordered[0],
+        "median_ms": statistics.median(ordered),
+        "mean_ms": statistics.fmean(ordered),
+        "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        "max_ms": ordered[-1],
+    }
+
+
+def _elapsed_ms(fn: Callable[[], object]) -> float:
+    start = time.perf_counter()
+    fn()
+    return (time.perf_counter() - start) * 1000
+
+
+class Suite:
+    def __init__(self, repeat: int) -> None:
+        self.repeat = repeat
+        self.results: List[dict] = []
+
+    def time(self, group: str, name: str, fn: Callable[[], object], repeat: Optional[int] = None, warmup: bool = True, **params) -> dict:
+        first = _elapsed_ms(fn) if warmup else None
+        samples = [_elapsed_ms(fn) for _ in range(repeat or self.repeat)]
+        result = {"group": group, "name": name, "params": params, **_stats(samples)}
+        if first is not None:
+            result["first_ms"] = first
+        self.results.append(result)
+        print(f"  {group:<11} {name:<40} median {result['median_ms']:9.3f} ms  p95 {result['p95_ms']:9.3f} ms")
+        return result
+
+
+def bench_loads(suite: Suite) -> None:
+    """CSV parse (no snapshot), cold load (datasets reset, snapshot if present) and warm (loaded) load."""
+    datasets = csv_service.datasets
+    for name, spec in datasets.specs.items():
+        path = spec.path
+        if not os.path.exists(path):
+            print(f"  load        {name:<40} skipped: {path} not found")
+            continue
+        datasets.frame(name)  # make sure the snapshot exists so "cold" measures the serving path
+
+        def cold(name=name):
+            datasets.reset()
+            datasets.frame(name)
+
+        suite.time("load", f"{name}.csv_parse", lambda: spec.parse(path), warmup=False, path=path)
+        suite.time("load", f"{name}.cold", cold, warmup=False, path=path)
+        suite.time("load", f"{name}.warm", lambda name=name: datasets.frame(name), path=path)
+    # Leave a fresh generation behind so later groups rebuild their derived indexes once
+    datasets.reset()
+
+
+def bench_refresh(suite: Suite, rows: int = 100) -> None:
+    """Refresh after ``rows`` rows are appended to a copy of the bus CSV: incremental ingest vs a full reload."""
+    spec = csv_service.datasets.specs["bus"]
+    if not os.path.exists(spec.path):
+        print(f"  refresh     {'bus':<40} skipped: {spec.path} not found")
+        return
+    with open(spec.path, "rb") as f:
+        appended = f.read().splitlines(keepends=True)[1:rows + 1]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bus.csv")
+        shutil.copyfile(spec.path, path)
+        # The copy is parsed directly, so the shared snapshot directory is never touched
+        manager = DatasetManager({"bus": replace(spec, path=path, load=spec.parse, store=None)})
+        index = lambda: manager.derived("bus_route_index", lambda: csv_service.build_bus_route_index(manager.frame("bus")), ("bus",))
+        index()
+
+        def append_and_refresh():
+            with open(path, "ab") as f:
+                f.writelines(appended)
+            reports = manager.refresh()
+            assert reports and reports[0].mode == "append"
+
+        def rewrite_and_refresh():
+            # Same rows in a different order: not an append, so the whole file is parsed again
+            with open(path, "rb") as f:
+                header, *body = f.read().splitlines(keepends=True)
+            with open(path, "wb") as f:
+                f.writelines([header] + body[1:] + body[:1])
+            reports = manager.refresh()
+            assert reports and reports[0].mode == "full"
+
+        suite.time("refresh", f"bus.append_{rows}_rows", append_and_refresh, warmup=False, rows=rows)
+        suite.time("refresh", "bus.full_reload", rewrite_and_refresh, warmup=False, repeat=min(suite.repeat, 5))
+
+
+def synthetic_flights_csv(path: str, rows: int, seed: int = 0) -> None:
+    """A CSV shaped like the public Indian flights fare dump (12 columns, 7 of them used)."""
+    rng = np.random.default_rng(seed)
+    cities = ["Delhi", "Mumbai", "Bangalore", "Kolkata", "Hyderabad", "Chennai"]
+    pd.DataFrame({
+        "date": "11-02-2022",
+        "airline": rng.choice(["SpiceJet", "AirAsia", "Vistara", "GO FIRST", "Indigo", "Air India"], rows),
+        "ch_code": "SG",
+        "num_code": rng.integers(100, 9999, rows),
+        "dep_time": [f"{h:02d}:{m:02d}" for h, m in zip(rng.integers(0, 24, rows), rng.integers(0, 12, rows) * 5)],
+        "from": rng.choice(cities, rows),
+        "time_taken": [f"{h:02d}h {m:02d}m" for h, m in zip(rng.integers(1, 30, rows), rng.integers(0, 60, rows))],
+        "stop": "non-stop ",
+        "arr_time": "08:40",
+        "to": rng.choice(cities, rows),
+        "price": [f"{p:,}" for p in rng.integers(1000, 90000, rows)],
+        "class": rng.choice(["economy", "business"], rows),
+    }).to_csv(path, index=False)
+
+
+def bench_ingest(suite: Suite, rows: int = 300_000) -> None:
+    """Chunked ingest of a synthetic flights dump: wall time, rows/s and the process's peak RSS."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "flights.csv")
+        synthetic_flights_csv(path, rows)
+        result = suite.time("ingest", "flights.chunked", lambda: csv_service._parse_flights(path), warmup=False, repeat=min(suite.repeat, 3), rows=rows)
+        result["rows_per_s"] = rows / (result["median_ms"] / 1000)
+        result["peak_rss_mb"] = csv_service._peak_rss_mb()
+        peak = "n/a" if result["peak_rss_mb"] is None else f"{result['peak_rss_mb']:.0f} MB"
+        print(f"  ingest      {'flights.chunked':<40} {result['rows_per_s']:,.0f} rows/s, process peak RSS {peak}")
+
+
+def scaled_bus_frame(factor: int, seed: int = 0) -> pd.DataFrame:
+    """The bus dataset repeated ``factor`` times with jittered prices, so route partitions grow with it."""
+    base = csv_service.load_bus()
+    if factor <= 1:
+        return base
+    df = pd.concat([base] * factor, ignore_index=True)
+    if "price" in df:
+        jitter = np.random.default_rng(seed).integers(-100, 100, size=len(df))
+        df["price"] = np.maximum(df["price"].to_numpy() + jitter, 0)
+    return df
+
+
+@contextmanager
+def bus_data(df: pd.DataFrame):
+    """Serve the bus retrievals from ``df`` (and a route index and graph built over it) for the duration of the block."""
+    index = csv_service.build_bus_route_index(df)
+    graph = csv_service.build_route_graph(df, "source", "destination")
+    saved = (retrieval.load_bus, retrieval.bus_route_index, retrieval.bus_route_graph)
+    retrieval.load_bus = lambda: df
+    retrieval.bus_route_index = lambda: index
+    retrieval.bus_route_graph = lambda: graph
+    try:
+        yield
+    finally:
+        retrieval.load_bus, retrieval.bus_route_index, retrieval.bus_route_graph = saved
+
+
+_BUS_QUERIES = {
+    "route": Query(source="Agra", destination="Delhi", budget=2000),
+    "route_alias": Query(source="bangalore", destination="chennai"),
+    "source_only": Query(source="Agra", budget=3000),
+    "destination_only": Query(destination="Delhi"),
+}
+
+# Pairs with no direct bus, served by the route planner
+_CONNECTION_QUERIES = {
+    "one_stop": Query(source="Agra", destination="Jaipur"),
+    "two_stops": Query(source="Kochi", destination="Delhi", sort="fastest"),
+    "unreachable": Query(source="Thiruvananthapuram", destination="Agra"),
+}
+
+
+def bench_retrieval(suite: Suite, scales: Sequence[int]) -> None:
+    for factor in scales:
+        df = scaled_bus_frame(factor)
+        suite.time("index", "bus_route_index.build", lambda: csv_service.build_bus_route_index(df), warmup=False, rows=len(df))
+        suite.time("index", "bus_route_graph.build", lambda: csv_service.build_route_graph(df, "source", "destination"), warmup=False, rows=len(df))
+        with bus_data(df):
+            for fuzzy in (True, False):
+                for name, q in _BUS_QUERIES.items():
+                    suite.time("retrieve", f"buses.{name}", lambda q=q, fuzzy=fuzzy: retrieval.retrieve_buses(q, fuzzy), rows=len(df), fuzzy=fuzzy)
+            for name, q in _CONNECTION_QUERIES.items():
+                suite.time("retrieve", f"bus_connections.{name}", lambda q=q: retrieval.retrieve_bus_connections(q, True), rows=len(df))
+
+    others = {
+        "flights.route": (retrieval.retrieve_flights, Query(source="Delhi", destination="Mumbai", budget=8000)),
+        "hotels.city": (retrieval.retrieve_hotels, Query(city="Goa", budget=5000)),
+        "attractions.city": (retrieval.retrieve_attractions, Query(city="Jaipur")),
+    }
+    for name, (fn, q) in others.items():
+        for fuzzy in (True, False):
+            try:
+                fn(q, fuzzy)
+            except FileNotFoundError as e:
+                print(f"  retrieve    {name:<40} skipped: {e.filename} not found")
+                break
+            suite.time("retrieve", name, lambda fn=fn, q=q, fuzzy=fuzzy: fn(q, fuzzy), fuzzy=fuzzy)
+
+
+def bench_rendering(suite: Suite) -> None:
+    for n in (5, 100, 1000):
+        df = scaled_bus_frame(n // len(csv_service.load_bus()) + 1).head(n)
+        present = [c for c in responses._BUS_COLS if c in df.columns]
+        suite.time("render", "rows_to_bulleted_text", lambda df=df: responses._rows_to_bulleted_text(df, present), rows=len(df))
+
+
+_HANDLER_CASES = {
+    "greeting": (lambda msg, api_key, fuzzy: responses.handle_greeting(msg, api_key), "hi there!"),
+    "bus": (responses.handle_bus_query, "buses from Agra to Delhi under 2000"),
+    "flight": (responses.handle_flight_query, "flights from Delhi to Mumbai under 8000"),
+    "hotel": (responses.handle_hotel_query, "hotels in Goa under 5000"),
+    "attractions": (responses.handle_attractions_query, "what to see in Jaipur"),
+    "itinerary": (responses.handle_itinerary_query, "plan a 3 day trip from Agra to Delhi under 10000"),
+}
+
+
+@contextmanager
+def _null():
+    yield
+
+
+@contextmanager
+def _without_fast_path():
+    saved = responses.fast_path_params
+    responses.fast_path_params = lambda intent, text, parsed=None: None
+    try:
+        yield
+    finally:
+        responses.fast_path_params = saved
+
+
+def bench_handlers(suite: Suite, latency: float) -> None:
+    """End-to-end handle_*_query against the stub, with the local fast path and with LLM extraction."""
+    with stub_gemini(latency=latency) as stub:
+        for extraction in ("fast_path", "llm"):
+            ctx = _without_fast_path() if extraction == "llm" else _null()
+            with ctx:
+                for name, (handler, msg) in _HANDLER_CASES.items():
+                    call = lambda handler=handler, msg=msg: handler(msg, "stub", True)
+                    stub.calls = 0
+                    try:
+                        result = suite.time("handler", f"{name}.{extraction}", call, stub_latency_ms=latency * 1000)
+                    except FileNotFoundError as e:
+                        print(f"  handler     {name + '.' + extraction:<40} skipped: {e.filename} not found")
+                        continue
+                    result["model_calls"] = stub.calls / (result["n"] + 1)
+        msg = "buses from Agra to Delhi under 2000"
+        suite.time("handler", "handle_message.bus", lambda: responses.handle_message(msg, "stub"), stub_latency_ms=latency * 1000)
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_suite(repeat: int = 20, scales: Sequence[int] = (1, 10), latency: float = 0.0, groups: Sequence[str] = ("load", "refresh", "ingest", "retrieve", "render", "handler")) -> dict:
+    suite = Suite(repeat)
+    if "load" in groups:
+        bench_loads(suite)
+    if "refresh" in groups:
+        bench_refresh(suite)
+    if "ingest" in groups:
+        bench_ingest(suite)
+    if "retrieve" in groups:
+        bench_retrieval(suite, scales)
+    if "render" in groups:
+        bench_rendering(suite)
+    if "handler" in groups:
+        bench_handlers(suite, latency)
+    return {
+        "meta": {
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "git": _git_revision(),
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "repeat": repeat,
+            "scales": list(scales),
+            "stub_latency_ms": latency * 1000,
+        },
+        "results": suite.results,
+    }
+
+
+def _key(result: dict) -> str:
+    params = ",".join(f"{k}={v}" for k, v in sorted(result["params"].items()) if k != "path")
+    return f"{result['group']}/{result['name']}[{params}]"
+
+
+def compare(current: dict, baseline: dict, threshold: float = 1.2) -> List[str]:
+    """Median-to-median comparison; returns the keys that got slower than ``threshold`` x baseline."""
+    before: Dict[str, dict] = {_key(r): r for r in baseline.get("results", [])}
+    regressions = []
+    print(f"\nCompared with {baseline.get('meta', {}).get('git')} ({baseline.get('meta', {}).get('timestamp')}):")
+    for r in current["results"]:
+        old = before.get(_key(r))
+        if old is None or not old["median_ms"]:
+            continue
+        ratio = r["median_ms"] / old["median_ms"]
+        flag = "  REGRESSION" if ratio > threshold else ""
+        print(f"  {_key(r):<70} {old['median_ms']:9.3f} -> {r['median_ms']:9.3f} ms  x{ratio:5.2f}{flag}")
+        if flag:
+            regressions.append(_key(r))
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Offline benchmarks for loading, retrieval, rendering and handlers.")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--scales", default="1,10", help="comma-separated bus dataset scale factors")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="stub Gemini latency per call")
+    parser.add_argument("--groups", default="load,refresh,ingest,retrieve,render,handler")
+    parser.add_argument("--out", default=None, help="results JSON (default benchmarks/results/bench-<timestamp>.json)")
+    parser.add_argument("--compare", default=None, help="baseline results JSON to compare medians against")
+    parser.add_argument("--threshold", type=float, default=1.2, help="slowdown ratio reported as a regression")
+    args = parser.parse_args(argv)
+    # Missing optional datasets are reported once per case above; keep per-call warnings out of the table
+    logging.basicConfig(level=logging.ERROR)
+
+    report = run_suite(
+        repeat=args.repeat,
+        scales=[int(s) for s in args.scales.split(",") if s.strip()],
+        latency=args.latency_ms / 1000,
+        groups=[g.strip() for g in args.groups.split(",") if g.strip()],
+    )
+    out = args.out or os.path.join(RESULTS_DIR, f"bench-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nWrote {len(report['results'])} results to {out}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regressions over x{args.threshold}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
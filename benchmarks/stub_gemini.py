@@ -0,0 +1,89 @@
+import os
+import sys
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import asyncio
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+
+import services.Query_Extraction_service as extraction
+import services.Query_Response_Service as responses
+
+
+# One reply that satisfies every extraction prompt: each extractor reads only its own keys
+DEFAULT_JSON_REPLY = {
+    "intent": "bus",
+    "source": "Agra",
+    "destination": "Delhi",
+    "city": "Goa",
+    "budget": "5000",
+    "num_days": 3,
+}
+
+DEFAULT_TEXT_REPLY = (
+    "Here are a few options that fit your budget. The first one is the cheapest and well rated; "
+    "the second leaves a little later but has more seats left. Let me know if you want more details."
+)
+
+
+class StubGeminiClient:
+    """
+    Offline stand-in for GeminiClient: same call surface, fixed latency, canned replies.
+    Counts calls so benchmarks can report how many model round trips a path makes.
+    """
+
+    def __init__(self, latency: float = 0.0, json_reply: Optional[dict] = None, text_reply: str = DEFAULT_TEXT_REPLY, chunk_size: int = 40) -> None:
+        self.latency = latency
+        self.json_reply = dict(DEFAULT_JSON_REPLY if json_reply is None else json_reply)
+        self.text_reply = text_reply
+        self.chunk_size = chunk_size
+        self.model_name = "stub"
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _count(self) -> None:
+        with self._lock:
+            self.calls += 1
+
+    def generate(self, prompt: str, temperature: float = 0.4, max_output_tokens: Optional[int] = 2000, cache: bool = False, latency_budget: Optional[float] = None, models: Optional[List[str]] = None) -> str:
+        self._count()
+        time.sleep(self.latency)
+        return self.text_reply
+
+    def generate_stream(self, prompt: str, temperature: float = 0.4, max_output_tokens: Optional[int] = 2000) -> Iterator[str]:
+        self._count()
+        time.sleep(self.latency)
+        for i in range(0, len(self.text_reply), self.chunk_size):
+            yield self.text_reply[i:i + self.chunk_size]
+
+    def extract_json(self, prompt: str, temperature: float = 0.0, max_output_tokens: Optional[int] = 2000, cache: bool = False, latency_budget: Optional[float] = None, models: Optional[List[str]] = None) -> dict:
+        self._count()
+        time.sleep(self.latency)
+        return dict(self.json_reply)
+
+    async def agenerate(self, prompt: str, temperature: float = 0.4, max_output_tokens: Optional[int] = 2000, cache: bool = False, latency_budget: Optional[float] = None, models: Optional[List[str]] = None) -> str:
+        self._count()
+        await asyncio.sleep(self.latency)
+        return self.text_reply
+
+    async def aextract_json(self, prompt: str, temperature: float = 0.0, max_output_tokens: Optional[int] = 2000, cache: bool = False, latency_budget: Optional[float] = None, models: Optional[List[str]] = None) -> dict:
+        self._count()
+        await asyncio.sleep(self.latency)
+        return dict(self.json_reply)
+
+
+@contextmanager
+def stub_gemini(client: Optional[StubGeminiClient] = None, **kwargs):
+    """Route every get_client call in the pipeline to one stub client for the duration of the block."""
+    stub = client or StubGeminiClient(**kwargs)
+    factory = lambda api_key=None, model_name=None: stub
+    saved = (responses.get_client, extraction.get_client)
+    responses.get_client = factory
+    extraction.get_client = factory
+    try:
+        yield stub
+    finally:
+        responses.get_client, extraction.get_client = saved
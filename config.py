@@ -1,6 +1,104 @@
+import os
+
 MODEL_NAME = "gemini-2.5-flash"
 TOP_K = 5
 FUZZY_THRESHOLD = 85
+DATASET_PATHS = {
+    "bus": "dataset/cleaned_bus.csv.csv",
+    "flights": "dataset/flights.csv",
+    "hotels": "dataset/hotel pricing.csv",
+    "attractions": "dataset/india_attractions.csv",
+}
+# Seconds between checks of the dataset files for appended or rewritten rows (0 disables the watcher)
+DATASET_REFRESH_SECONDS = float(os.getenv("DATASET_REFRESH_SECONDS", "30"))
+# Large CSVs are read in chunks sized so the rows in flight plus the kept (narrowed) rows fit this budget
+INGEST_MEMORY_BUDGET_MB = int(os.getenv("INGEST_MEMORY_BUDGET_MB", "512"))
+INGEST_MAX_CHUNK_ROWS = int(os.getenv("INGEST_MAX_CHUNK_ROWS", "200000"))
+# Typed Arrow snapshots of the CSV datasets (rebuilt when the source file changes)
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "dataset/.snapshots")
+# Response cache for deterministic (temperature 0) LLM calls; set LLM_CACHE_PATH to share it across workers
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "1024"))
+LLM_CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", "86400"))
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH") or None
+LLM_CACHE_MAX_DB_ENTRIES = int(os.getenv("LLM_CACHE_MAX_DB_ENTRIES", "50000"))
+# Concurrent identical model calls and retrievals share one in-flight result (0 disables)
+COALESCE_REQUESTS = os.getenv("COALESCE_REQUESTS", "1") == "1"
+# Gemini quota per process (unset means unlimited); --rps on the CLIs adds a per-second cap
+LLM_RPM = float(os.getenv("LLM_RPM", "0")) or None
+LLM_TPM = float(os.getenv("LLM_TPM", "0")) or None
+# Adaptive (AIMD) cap on concurrent Gemini calls: starts at INITIAL, stays within MIN..MAX and
+# halves when calls are throttled, fail on the server or take longer than the latency target
+LLM_CONCURRENCY_INITIAL = int(os.getenv("LLM_CONCURRENCY_INITIAL", "8"))
+LLM_CONCURRENCY_MIN = int(os.getenv("LLM_CONCURRENCY_MIN", "1"))
+LLM_CONCURRENCY_MAX = int(os.getenv("LLM_CONCURRENCY_MAX", "32"))
+LLM_LATENCY_TARGET_SECONDS = float(os.getenv("LLM_LATENCY_TARGET_SECONDS", "20"))
+# Retries of 429 / transient 5xx replies, with full-jitter exponential backoff
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_BASE_SECONDS = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", "0.5"))
+LLM_BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", "8"))
+# Ranked models tried after MODEL_NAME when it is missing, blocked or still throttled after retries
+LLM_FALLBACK_MODELS = [m.strip() for m in os.getenv("LLM_FALLBACK_MODELS", "gemini-2.5-flash-lite,gemini-2.0-flash").split(",") if m.strip()]
+# Hedged requests: a call still unanswered after this percentile of its model's recent latencies
+# (or half the caller's latency budget) is raced against a second request; 0 disables hedging
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_HEDGE_MIN_DELAY_SECONDS = float(os.getenv("LLM_HEDGE_MIN_DELAY_SECONDS", "0.25"))
+# Default latency budget for a model call, in seconds (unset: hedge on the percentile alone)
+LLM_LATENCY_BUDGET_SECONDS = float(os.getenv("LLM_LATENCY_BUDGET_SECONDS", "0")) or None
+# Threads used by the async pipeline for retrieval and prompt building
+RETRIEVAL_WORKERS = int(os.getenv("RETRIEVAL_WORKERS", "8"))
+# Finished pipeline spans are appended here as JSON lines when set
+TRACE_LOG_PATH = os.getenv("TRACE_LOG_PATH") or None
+# Alternate spellings resolved to one dataset city before matching (keys are casefolded)
+CITY_ALIASES = {
+    "bombay": "Mumbai",
+    "bangalore": "Bengaluru",
+    "new delhi": "Delhi",
+    "calcutta": "Kolkata",
+    "madras": "Chennai",
+    "vizag": "Visakhapatnam",
+    "vishakhapatnam": "Visakhapatnam",
+    "trivandrum": "Thiruvananthapuram",
+    "cochin": "Kochi",
+    "poona": "Pune",
+    "banaras": "Varanasi",
+    "benares": "Varanasi",
+    "allahabad": "Prayagraj",
+    "mysuru": "Mysore",
+    "puducherry": "Pondicherry",
+    "alleppey": "Alappuzha",
+}
+# Minimum local-parser confidence needed to skip the Gemini routing/extraction calls
+FAST_PATH_CONFIDENCE = 0.8
+# Result orderings served from indexes built at load; "cheapest" is the default and always available
+SORT_MODES = ("cheapest", "fastest", "best_rated", "earliest")
+DEFAULT_SORT = "cheapest"
+# Output-token caps per call kind; Gemini 2.5 counts thinking tokens against these, so they keep headroom
+MAX_OUTPUT_TOKENS = {
+    "intent": 100,
+    "extract": 512,
+    "greeting": 512,
+    "bus": 1024,
+    "flight": 1024,
+    "hotel": 1024,
+    "attractions": 1024,
+    "itinerary": 2000,
+}
+DEFAULT_MAX_OUTPUT_TOKENS = 2000
+# Prompt token counting: "local" (approximation, no network call) or "api" (Gemini count_tokens)
+TOKEN_COUNTER = os.getenv("TOKEN_COUNTER", "local")
+# Log and export the context size before (bulleted key: value rows) and after compaction (tables)
+PROMPT_TOKEN_STATS = os.getenv("PROMPT_TOKEN_STATS", "0") == "1"
+# Connecting itineraries (planned when there is no direct service): legs per trip and layover window
+ROUTE_MAX_LEGS = int(os.getenv("ROUTE_MAX_LEGS", "3"))
+ROUTE_MIN_LAYOVER_MINS = int(os.getenv("ROUTE_MIN_LAYOVER_MINS", "30"))
+ROUTE_MAX_LAYOVER_MINS = int(os.getenv("ROUTE_MAX_LAYOVER_MINS", "720"))
+SORT_DESCRIPTIONS = {
+    "cheapest": "cheapest first",
+    "fastest": "shortest travel time first",
+    "best_rated": "best rated first",
+    "earliest": "earliest departure first",
+}
 
 PROMPT_INTENT = (
     "You are an intent classifier for a travel assistant. Classify the user's message "
@@ -20,7 +118,7 @@ PROMPT_BUS = (
     "System: Use ONLY the bus options provided. Write a short creative paragraph that reads naturally, "
     "mentioning 3–5 options with bus type, departure_time if available, travel duration, price (₹), rating, and route. "
     "Close with a friendly travel tip.\n"
-    "Context (top {k} buses under budget ₹{budget}):\n{context_rows}\n"
+    "Context (top {k} buses under budget ₹{budget}, {order}):\n{context_rows}\n"
     "User: {user_question}"
 )
 
@@ -28,7 +126,25 @@ PROMPT_FLIGHT = (
     "Greet the user warmly by mentioning their name and a positive mood\n"
     "System: Use ONLY the flights provided. Write a concise, engaging paragraph that mentions 3–5 options, "
     "including airline, class, dep_time if available, time_taken, price (₹), and route. Keep the order as given.\n"
-    "Context (top {k} flights under budget ₹{budget}):\n{context_rows}\n"
+    "Context (top {k} flights under budget ₹{budget}, {order}):\n{context_rows}\n"
+    "User: {user_question}"
+)
+
+PROMPT_BUS_CONNECTIONS = (
+    "System: There is no direct bus on this route. Use ONLY the connecting itineraries provided; each option "
+    "is a sequence of legs taken in order, with the day of travel, departure time and the layover (minutes) before each leg. "
+    "Write a short paragraph presenting the options with their transfer cities, bus types, departure times, "
+    "layovers, total price (₹) and total travel time. Close with a practical tip about making connections.\n"
+    "Context (top {k} connecting options under budget ₹{budget}, {order}):\n{context_rows}\n"
+    "User: {user_question}"
+)
+
+PROMPT_FLIGHT_CONNECTIONS = (
+    "System: There is no direct flight on this route. Use ONLY the connecting itineraries provided; each option "
+    "is a sequence of legs flown in order, with the day of travel, departure time and the layover (minutes) before each leg. "
+    "Write a concise paragraph presenting the options with their transfer cities, airlines, departure times, layovers, "
+    "total price (₹) and total travel time. Keep the order as given.\n"
+    "Context (top {k} connecting options under budget ₹{budget}, {order}):\n{context_rows}\n"
     "User: {user_question}"
 )
 
@@ -113,7 +229,28 @@ PROMPT_EXTRACT_ITINERARY_PARAMS = (
     "JSON:"
 )
 
+PROMPT_ROUTE = (
+    "You are a router for an Indian travel assistant. Read the user's message once and "
+    "return ONLY a valid JSON object with these exact keys: intent, source, destination, city, budget, num_days. "
+    "intent must be exactly one of: greeting, bus, flight, hotel, attractions, itinerary, unknown. "
+    "source and destination are the travel origin and destination (bus, flight, itinerary); "
+    "city is the city for hotels or attractions. "
+    "For budget, extract the numeric value (remove currency symbols and commas). "
+    "For num_days, extract the number of days of an itinerary. "
+    "If a parameter is not mentioned, use null for that key. "
+    "Return only the JSON, no additional text or explanation.\n\n"
+    "User query: {user_message}\n\n"
+    "JSON:"
+)
+
+# The question sent for the final wording of a refined answer
+FOLLOW_UP_QUESTION = "{previous} (follow-up: {follow_up})"
+NO_MORE_OPTIONS = "That’s all I have within ₹{budget} — those were every matching option. Try a higher budget or a different sort."
+
 FALLBACK_BUS = "Sorry, I couldn’t find buses for {source} → {destination} within ₹{budget}."
 FALLBACK_FLIGHT = "Sorry, I couldn’t find flights for {source} → {destination} within ₹{budget}."
+# Direct services run on the route but all cost more than the budget
+OVER_BUDGET_BUS = "Sorry, there are no buses for {source} → {destination} within ₹{budget}; the cheapest direct bus costs ₹{price}."
+OVER_BUDGET_FLIGHT = "Sorry, there are no flights for {source} → {destination} within ₹{budget}; the cheapest direct flight costs ₹{price}."
 FALLBACK_HOTEL = "Sorry, I couldn’t find hotels in {city} within ₹{budget} per night."
 FALLBACK_ATTRACTIONS = "Sorry, I couldn’t find attractions in {city}."
@@ -0,0 +1,377 @@
+"""
+Headless JSON API over the same route -> handler pipeline as app.py, served by a pre-fork
+pool of worker processes that share one copy of the datasets.
+
+    python server.py --port 8080 --workers 4
+    python server.py --workers 4 --stub-latency-ms 300     # offline, canned model replies
+
+    POST /chat              {"message": "buses from Agra to Delhi under 2000", "fuzzy": true}
+    POST /retrieve/<kind>   {"source": "Agra", "destination": "Delhi", "budget": 2000, "sort": "fastest", "top_k": 5}
+                            kind: bus, flight, hotel, attractions, bus_connections, flight_connections
+    GET  /healthz           worker pid and dataset generation
+    GET  /metrics           Prometheus text for the worker that answers
+
+The parent loads every dataset and index, then forks: the workers read the parent's pages
+copy-on-write instead of each parsing and holding its own frames. Dataset changes are picked up
+by the parent too (every DATASET_REFRESH_SECONDS), which then re-forks the workers one by one so
+they keep sharing its pages; keep-alive connections to a replaced worker are closed. Chat answers
+are stateless (follow-up refinements need the Streamlit session), and /metrics covers one worker.
+"""
+
+import os
+import sys
+import warnings
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+warnings.filterwarnings("ignore")
+
+import argparse
+import gc
+import json
+import logging
+import signal
+import time
+from dataclasses import fields
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+
+import pandas as pd
+from dotenv import load_dotenv
+
+from config import DATASET_REFRESH_SECONDS, MODEL_NAME, SORT_MODES, TOP_K
+from services import CSV_Service as csv_service
+from services.Gemini_Service import set_rate_limit
+from services.Metrics_Service import metrics
+from services.Query_Extraction_service import city_gazetteer, normalize_message
+from services.Query_Response_Service import handle_message
+from services.Retrieval_Service import (
+    Query,
+    resolve_city,
+    retrieve_attractions,
+    retrieve_bus_connections,
+    retrieve_buses,
+    retrieve_flight_connections,
+    retrieve_flights,
+    retrieve_hotels,
+)
+
+
+logger = logging.getLogger("server")
+
+RETRIEVERS: Dict[str, Callable] = {
+    "bus": retrieve_buses,
+    "flight": retrieve_flights,
+    "hotel": retrieve_hotels,
+    "attractions": retrieve_attractions,
+    "bus_connections": retrieve_bus_connections,
+    "flight_connections": retrieve_flight_connections,
+}
+
+_QUERY_FIELDS = {f.name for f in fields(Query)}
+
+
+class ApiError(Exception):
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+def warm() -> None:
+    """Load every dataset and derived index in this process (the parent, before forking)."""
+    for name in csv_service.datasets.specs:
+        try:
+            csv_service.datasets.frame(name)
+        except FileNotFoundError as e:
+            logger.warning("Serving without %s: %s", name, e)
+    for build in (
+        csv_service.bus_route_index,
+        csv_service.flight_route_index,
+        csv_service.bus_route_graph,
+        csv_service.flight_route_graph,
+        csv_service.attraction_theme_index,
+        city_gazetteer,
+    ):
+        try:
+            build()
+        except FileNotFoundError:
+            pass
+    resolve_city("Delhi", True)
+
+
+def _records(df: pd.DataFrame) -> List[dict]:
+    # to_json maps NaN to null and numpy scalars to plain JSON values
+    return json.loads(df.to_json(orient="records"))
+
+
+def chat(body: dict, api_key: str, model_name: str) -> dict:
+    message = body.get("message")
+    if not isinstance(message, str) or not message.strip():
+        raise ApiError(400, "'message' must be a non-empty string")
+    trace: dict = {}
+    start = time.perf_counter()
+    reply = handle_message(normalize_message(message), api_key, model_name, fuzzy=bool(body.get("fuzzy", True)), trace=trace)
+    timings = trace.get("timings", {})
+    timings["total"] = (time.perf_counter() - start) * 1000
+    return {
+        "reply": reply,
+        "intent": trace.get("intent"),
+        "params": trace.get("params"),
+        "sort": trace.get("sort"),
+        "rows": trace.get("rows"),
+        "timings_ms": timings,
+    }
+
+
+def _int_field(body: dict, name: str, minimum: int, default: Optional[int] = None) -> Optional[int]:
+    value = body.get(name)
+    if value is None:
+        return default
+    try:
+        if isinstance(value, bool):
+            raise ValueError
+        number = int(value)
+    except (TypeError, ValueError):
+        raise ApiError(400, f"'{name}' must be an integer, got {value!r}")
+    if number < minimum:
+        raise ApiError(400, f"'{name}' must be at least {minimum}, got {number}")
+    return number
+
+
+def _query(body: dict) -> Query:
+    """Validate and coerce the Query fields of a /retrieve body, so bad values are a 400 and not a 500."""
+    params = {k: v for k, v in body.items() if k in _QUERY_FIELDS}
+    for name in ("source", "destination", "city", "theme"):
+        if params.get(name) is not None and not isinstance(params[name], str):
+            raise ApiError(400, f"'{name}' must be a string")
+    for name in ("source_names", "destination_names", "city_names"):
+        if params.get(name) is not None:
+            names = params[name]
+            if not isinstance(names, list) or not all(isinstance(n, str) for n in names):
+                raise ApiError(400, f"'{name}' must be a list of strings")
+            params[name] = tuple(names)
+    if "budget" in params:
+        params["budget"] = _int_field(params, "budget", minimum=0)
+    if params.get("sort") is not None and params["sort"] not in SORT_MODES:
+        raise ApiError(400, f"'sort' must be one of {', '.join(SORT_MODES)}, got {params['sort']!r}")
+    return Query(**params)
+
+
+def retrieve(kind: str, body: dict) -> dict:
+    retriever = RETRIEVERS.get(kind)
+    if retriever is None:
+        raise ApiError(404, f"unknown kind {kind!r}; expected one of {', '.join(RETRIEVERS)}")
+    unknown = set(body) - _QUERY_FIELDS - {"top_k", "fuzzy"}
+    if unknown:
+        raise ApiError(400, f"unknown fields: {', '.join(sorted(unknown))}")
+    q, top_k = _query(body), _int_field(body, "top_k", minimum=1, default=TOP_K)
+    with csv_service.datasets.pinned():
+        result = retriever(q, fuzzy=bool(body.get("fuzzy", True)), top_k=top_k)
+    if kind == "hotel":
+        df, price_col = result
+        return {"rows": _records(df), "price_col": price_col}
+    return {"rows": _records(result)}
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, so clients reuse connections
+    api_key = ""
+    model_name = MODEL_NAME
+
+    def _send(self, status: int, payload: object, content_type: str = "application/json") -> None:
+        data = payload if isinstance(payload, bytes) else json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError as e:
+            raise ApiError(400, f"invalid JSON: {e}")
+        if not isinstance(body, dict):
+            raise ApiError(400, "body must be a JSON object")
+        return body
+
+    def _dispatch(self, route: str, handler: Callable[[], object]) -> None:
+        start = time.perf_counter()
+        status = 200
+        try:
+            self._send(200, handler())
+        except ApiError as e:
+            status = e.status
+            self._send(status, {"error": str(e)})
+        except Exception as e:
+            status = 500
+            logger.exception("Request %s failed", self.path)
+            self._send(status, {"error": f"{type(e).__name__}: {e}"})
+        metrics.observe("travel_http_request_seconds", time.perf_counter() - start, route=route, status=str(status))
+
+    def do_POST(self) -> None:
+        if self.path == "/chat":
+            self._dispatch("chat", lambda: chat(self._body(), self.api_key, self.model_name))
+        elif self.path.startswith("/retrieve/"):
+            self._dispatch("retrieve", lambda: retrieve(self.path[len("/retrieve/"):], self._body()))
+        else:
+            # Drain the body so the next request on this keep-alive connection parses cleanly
+            self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            self._send(404, {"error": f"no route for POST {self.path}"})
+
+    def do_GET(self) -> None:
+        if self.path == "/healthz":
+            self._send(200, {"status": "ok", "pid": os.getpid(), "generation": csv_service.datasets.current().number})
+        elif self.path == "/metrics":
+            self._send(200, metrics.prometheus_text().encode("utf-8"), "text/plain; version=0.0.4")
+        else:
+            self._send(404, {"error": f"no route for GET {self.path}"})
+
+    def log_message(self, fmt: str, *args) -> None:
+        logger.debug("%s " + fmt, self.address_string(), *args)
+
+
+# How often the parent checks for exited workers (and for a due dataset refresh)
+_REAP_INTERVAL = 0.2
+
+
+class ApiServer(ThreadingHTTPServer):
+    # Listen backlog shared by every worker; the default of 5 resets connections under bursts
+    request_queue_size = 256
+
+
+def _worker(server: ThreadingHTTPServer) -> None:
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def _freeze() -> None:
+    # Keep the preloaded objects out of the collector's scans, so workers do not touch (and copy) their pages
+    gc.unfreeze()
+    gc.collect()
+    gc.freeze()
+
+
+def _reload() -> bool:
+    """Refresh the datasets in the parent; True when any of them changed, so the workers must be re-forked."""
+    try:
+        reports = csv_service.datasets.refresh()
+    except Exception:
+        logger.exception("Dataset refresh failed; workers keep generation %d", csv_service.datasets.current().number)
+        return False
+    if not reports:
+        return False
+    _freeze()
+    logger.info("Datasets changed (%s); re-forking workers", ", ".join(sorted({r.dataset for r in reports})))
+    return True
+
+
+def serve(host: str, port: int, workers: int) -> None:
+    """Bind, load the datasets once, then fork ``workers`` processes that accept on the shared socket."""
+    server = ApiServer((host, port), ApiHandler)
+    warm()
+    _freeze()
+    logger.info("Listening on http://%s:%d with %d worker(s)", host, server.server_address[1], workers)
+    if workers <= 1 or not hasattr(os, "fork"):
+        # one process, nothing to share: it refreshes its own datasets
+        csv_service.datasets.start_watcher(DATASET_REFRESH_SECONDS)
+        _worker(server)
+        return
+    children: Dict[int, int] = {}
+
+    def spawn(slot: int) -> None:
+        pid = os.fork()
+        if pid == 0:
+            # Ctrl-C reaches the whole process group; the parent turns it into SIGTERM per worker
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            code = 0
+            try:
+                _worker(server)
+            except SystemExit as e:
+                code = e.code or 0
+            except BaseException:
+                logger.exception("Worker %d crashed", os.getpid())
+                code = 1
+            finally:
+                os._exit(code)
+        children[pid] = slot
+
+    stopping = False
+
+    def stop(*_) -> None:
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def refork() -> None:
+        # start each replacement before retiring the old worker, so the socket is never unserved
+        for pid, slot in list(children.items()):
+            del children[pid]
+            spawn(slot)
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for slot in range(workers):
+        spawn(slot)
+    # Threads do not survive fork, so the parent watches the datasets between reaping its workers
+    next_refresh = time.monotonic() + DATASET_REFRESH_SECONDS
+    while children:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        if pid == 0:
+            if DATASET_REFRESH_SECONDS > 0 and not stopping and time.monotonic() >= next_refresh:
+                if _reload():
+                    refork()
+                next_refresh = time.monotonic() + DATASET_REFRESH_SECONDS
+            time.sleep(_REAP_INTERVAL)
+            continue
+        # retired workers are no longer in children, so they are reaped without a restart
+        slot = children.pop(pid, None)
+        if slot is not None and not stopping:
+            logger.warning("Worker %d exited (status %d); restarting it", pid, status)
+            spawn(slot)
+    server.server_close()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Serve the travel assistant as a JSON HTTP API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker processes forked after the datasets load")
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--rps", type=float, default=None, help="Gemini requests per second, per worker")
+    parser.add_argument("--stub-latency-ms", type=float, default=None, help="answer with the offline stub model (load testing)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(process)d %(levelname)s %(name)s: %(message)s")
+    load_dotenv()
+    ApiHandler.api_key = os.getenv("GEMINI_API_KEY", "")
+    ApiHandler.model_name = args.model
+    set_rate_limit(args.rps)
+    if args.stub_latency_ms is not None:
+        from benchmarks.stub_gemini import stub_gemini
+
+        with stub_gemini(latency=args.stub_latency_ms / 1000):
+            serve(args.host, args.port, args.workers)
+    else:
+        serve(args.host, args.port, args.workers)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,15 +5,56 @@ import warnings
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 warnings.filterwarnings("ignore")
 
-from functools import lru_cache
-from typing import List
+import json
+import logging
+import time
+from itertools import product
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
 
+import numpy as np
 import pandas as pd
 
+from config import (
+    DATASET_PATHS,
+    DEFAULT_SORT,
+    INGEST_MAX_CHUNK_ROWS,
+    INGEST_MEMORY_BUDGET_MB,
+    ROUTE_MAX_LAYOVER_MINS,
+    ROUTE_MIN_LAYOVER_MINS,
+    SNAPSHOT_DIR,
+)
+from services.City_Index_Service import categorize_cities, column_city_index
+from services.Dataset_Service import DatasetManager, DatasetSpec, Source, concat_frames
+from services.Metrics_Service import metrics, span
+from services.Route_Planner_Service import RouteGraph, build_route_graph
+from services.Theme_Index_Service import ThemeIndex, build_theme_index
 
-def _read_csv(path: str, usecols: List[str] | None = None) -> pd.DataFrame:
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:  # snapshots are an optimization; fall back to CSV parsing
+    pa = None
+    feather = None
+
+try:
+    import resource
+except ImportError:  # not available on Windows; peak RSS is then not reported
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever a _parse_* function changes the shape or dtypes it produces
+SNAPSHOT_VERSION = 3
+# Rows read before the chunk size is derived from the measured bytes per row
+_PROBE_ROWS = 2000
+# Peak memory of tokenizing and narrowing a chunk, as a multiple of its kept raw string columns
+# (measured ~5.5x on the public flights fare dump, where 7 of 12 columns are kept)
+_CHUNK_WORKING_SET = 6
+
+
+def _read_csv(source: Source, usecols: List[str] | None = None) -> pd.DataFrame:
     return pd.read_csv(
-        path,
+        source,
         usecols=usecols,
         dtype=str,
         engine="python",
@@ -21,56 +62,243 @@ def _read_csv(path: str, usecols: List[str] | None = None) -> pd.DataFrame:
     )
 
 
+def _snake(name: str) -> str:
+    return name.strip().lower().replace(" ", "_")
+
+
 def _to_snake(df: pd.DataFrame) -> pd.DataFrame:
-    df.columns = [c.strip().lower().replace(" ", "_") for c in df.columns]
+    df.columns = [_snake(c) for c in df.columns]
     return df
 
 
-@lru_cache(maxsize=1)
-def load_bus(path: str = "dataset/cleaned_bus.csv.csv") -> pd.DataFrame:
-    df = _read_csv(path)
-    df = _to_snake(df)
+def _peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def _ingest(
+    source: Source,
+    name: str,
+    transform: Callable[[pd.DataFrame], pd.DataFrame],
+    usecols: Optional[Sequence[str]] = None,
+    city_cols: Sequence[str] = (),
+) -> pd.DataFrame:
+    """
+    Read a CSV in chunks that fit INGEST_MEMORY_BUDGET_MB, keeping only ``usecols`` (snake_case
+    names) and narrowing each chunk with ``transform`` before the next one is read, so the raw
+    all-string rows of the whole file are never held at once. Chunk sizes come from the bytes
+    per raw row measured on a first small chunk (times the working set of the narrowing); the
+    kept chunks are counted twice against the budget because the final concatenation copies them.
+    """
+    budget = INGEST_MEMORY_BUDGET_MB * 2**20
+    wanted = {_snake(c) for c in usecols} if usecols else None
+    start = time.perf_counter()
+    chunks: List[pd.DataFrame] = []
+    kept = rows = 0
+    size = _PROBE_ROWS
+    with span("ingest", dataset=name) as s, pd.read_csv(
+        source,
+        usecols=(lambda c: _snake(c) in wanted) if wanted else None,
+        dtype=str,
+        engine="c",
+        on_bad_lines="skip",
+        iterator=True,
+    ) as reader:
+        while True:
+            try:
+                raw = reader.get_chunk(size)
+            except StopIteration:
+                break
+            if raw.empty and chunks:
+                continue
+            raw_row_bytes = max(raw.memory_usage(deep=True).sum() / max(len(raw), 1), 1.0)
+            chunk = transform(_to_snake(raw))
+            del raw
+            chunks.append(chunk)
+            kept += int(chunk.memory_usage(deep=True).sum())
+            rows += len(chunk)
+            elapsed = time.perf_counter() - start
+            logger.debug("Ingest %s: %d rows (%.0f rows/s), %.1f MB kept, peak RSS %s MB",
+                         name, rows, rows / elapsed if elapsed else 0.0, kept / 2**20, _peak_rss_mb())
+            free = budget - 2 * kept
+            if free < _PROBE_ROWS * _CHUNK_WORKING_SET * raw_row_bytes:
+                raise MemoryError(
+                    f"Ingesting {name}: {rows} rows already take {kept / 2**20:.0f} MB of the "
+                    f"{INGEST_MEMORY_BUDGET_MB} MB budget (INGEST_MEMORY_BUDGET_MB)"
+                )
+            size = int(min(INGEST_MAX_CHUNK_ROWS, free // (_CHUNK_WORKING_SET * raw_row_bytes)))
+        df = concat_frames(chunks)
+        del chunks
+        for c in df.columns:
+            if isinstance(df[c].dtype, pd.CategoricalDtype):
+                # Same categories (and codes) however the file was chunked
+                df[c] = df[c].cat.reorder_categories(df[c].cat.categories.sort_values())
+                if c in city_cols:
+                    column_city_index(df[c])
+        elapsed = time.perf_counter() - start
+        rate = rows / elapsed if elapsed else 0.0
+        peak = _peak_rss_mb()
+        s.set(rows=rows, rows_per_second=round(rate), kept_mb=round(kept / 2**20, 1), peak_rss_mb=peak)
+    metrics.inc("travel_ingest_rows_total", rows, dataset=name)
+    metrics.observe("travel_ingest_seconds", elapsed, dataset=name)
+    logger.info("Ingested %s: %d rows in %.1f ms (%.0f rows/s), %.1f MB kept, peak RSS %s MB",
+                name, rows, elapsed * 1000, rate, kept / 2**20, "n/a" if peak is None else f"{peak:.0f}")
+    return df
+
+
+def _duration_minutes(values: pd.Series) -> pd.Series:
+    """Vectorized parse_time_to_minutes ("02hrs 45mins", "2h 05m"); 0 when nothing parses."""
+    text = values.astype(str)
+    hours = pd.to_numeric(text.str.extract(r"(\d+)h", expand=False), errors="coerce").fillna(0)
+    mins = pd.to_numeric(text.str.extract(r"(\d+)m", expand=False), errors="coerce").fillna(0)
+    return (hours * 60 + mins).astype("int64")
+
+
+def _clock_minutes(values: pd.Series) -> pd.Series:
+    """Minutes past midnight of the first HH:MM in each value ("2024-11-07 04:00:00", "18:55"); -1 if none."""
+    parts = values.astype(str).str.extract(r"(\d{1,2}):(\d{2})")
+    hours = pd.to_numeric(parts[0], errors="coerce")
+    mins = pd.to_numeric(parts[1], errors="coerce")
+    return (hours * 60 + mins).fillna(-1).astype("int64")
+
+
+def _source_signature(path: str) -> dict:
+    st = os.stat(path)
+    return {"version": SNAPSHOT_VERSION, "mtime_ns": st.st_mtime_ns, "size": st.st_size}
+
+
+def _snapshot_paths(path: str) -> Tuple[str, str]:
+    name = os.path.basename(path).replace(" ", "_")
+    base = os.path.join(SNAPSHOT_DIR, name)
+    return base + ".arrow", base + ".meta.json"
+
+
+def _read_snapshot(path: str) -> Optional[pd.DataFrame]:
+    if feather is None:
+        return None
+    data_path, meta_path = _snapshot_paths(path)
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta != _source_signature(path):
+            return None
+        # Memory-mapped Arrow IPC file: replicas on one node share the page cache
+        table = feather.read_table(data_path, memory_map=True)
+        return table.to_pandas(split_blocks=True)
+    except (OSError, ValueError, pa.ArrowException):
+        return None
+
+
+def _write_snapshot(path: str, df: pd.DataFrame) -> None:
+    if feather is None:
+        return
+    data_path, meta_path = _snapshot_paths(path)
+    try:
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        # Write then rename so concurrent readers never see a partial file
+        tmp = f"{data_path}.{os.getpid()}.tmp"
+        feather.write_feather(df.reset_index(drop=True), tmp, compression="uncompressed")
+        os.replace(tmp, data_path)
+        tmp = f"{meta_path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(_source_signature(path), f)
+        os.replace(tmp, meta_path)
+    except (OSError, ValueError, pa.ArrowException) as e:
+        logger.warning("Could not write snapshot for %s: %s", path, e)
+
+
+def _load_with_snapshot(path: str, parse: Callable[[str], pd.DataFrame], city_cols: Sequence[str]) -> pd.DataFrame:
+    """Load from the typed snapshot when it matches the source file, else parse the CSV and snapshot it."""
+    start = time.perf_counter()
+    df = _read_snapshot(path)
+    if df is not None:
+        for c in city_cols:
+            if c in df and isinstance(df[c].dtype, pd.CategoricalDtype):
+                column_city_index(df[c])
+        logger.info("Loaded %s from snapshot in %.1f ms", path, (time.perf_counter() - start) * 1000)
+        return df
+    df = parse(path)
+    _write_snapshot(path, df)
+    logger.info("Parsed %s from CSV in %.1f ms", path, (time.perf_counter() - start) * 1000)
+    return df
+
+
+def build_snapshots() -> None:
+    """Ingest step: parse every dataset and write its snapshot ahead of serving."""
+    datasets.reset()
+    for name in datasets.specs:
+        try:
+            datasets.frame(name)
+        except FileNotFoundError as e:
+            logger.warning("Skipping snapshot: %s", e)
+
+
+def _normalize_bus(df: pd.DataFrame) -> pd.DataFrame:
     # normalize fields
-    for c in ("source", "destination", "bus_type"):
-        if c in df:
-            df[c] = df[c].astype(str).str.strip()
+    if "bus_type" in df:
+        df["bus_type"] = df["bus_type"].astype(str).str.strip()
+    df = categorize_cities(df, ("source", "destination"), build_index=False)
     if "price" in df:
         df["price"] = (
             df["price"].astype(str).str.replace(",", "", regex=False).str.extract(r"(\d+)").fillna("0").astype(int)
         )
     if "rating" in df:
         df["rating"] = pd.to_numeric(df["rating"], errors="coerce").fillna(0.0)
+    if "travel_duration" in df:
+        df["duration_mins"] = _duration_minutes(df["travel_duration"])
+    if "departure_time" in df:
+        df["departure_mins"] = _clock_minutes(df["departure_time"])
     return df
 
 
-@lru_cache(maxsize=1)
-def load_flights(path: str = "dataset/flights.csv") -> pd.DataFrame:
-    usecols = ["airline", "time_taken", "price", "class", "from", "to", "dep_time"]
-    df = _read_csv(path, usecols=None)  # schema issues; read all and then select
-    df = _to_snake(df)
-    cols = [c for c in usecols if c in df.columns]
-    df = df[cols]
-    for c in ("from", "to", "airline", "class"):
+def _parse_bus(source: Source) -> pd.DataFrame:
+    return _ingest(source, "bus", _normalize_bus, city_cols=("source", "destination"))
+
+
+def load_bus() -> pd.DataFrame:
+    return datasets.frame("bus")
+
+
+_FLIGHT_COLS = ["airline", "time_taken", "price", "class", "from", "to", "dep_time"]
+
+
+def _normalize_flights(df: pd.DataFrame) -> pd.DataFrame:
+    # Header spellings vary ("From", " class "); columns are matched by snake_case name
+    df = df[[c for c in _FLIGHT_COLS if c in df.columns]].copy()
+    # Few distinct values per column: categoricals hold one code per row instead of a string
+    for c in ("airline", "class"):
         if c in df:
-            df[c] = df[c].astype(str).str.strip()
+            df[c] = df[c].astype(str).str.strip().astype("category")
+    df = categorize_cities(df, ("from", "to"), build_index=False)
     if "price" in df:
         df["price"] = (
-            df["price"].astype(str).str.replace(",", "", regex=False).str.extract(r"(\d+)").fillna("0").astype(int)
+            df["price"].astype(str).str.replace(",", "", regex=False).str.extract(r"(\d+)").fillna("0").astype(np.int32)
         )
     if "time_taken" in df:
-        # keep raw; parser in utils
-        df["time_taken"] = df["time_taken"].astype(str).str.strip()
+        # keep the raw text for display; minutes are parsed once here for ranking
+        df["time_taken"] = df["time_taken"].astype(str).str.strip().astype("category")
+        df["duration_mins"] = _duration_minutes(df["time_taken"]).astype(np.int32)
     if "dep_time" in df:
-        df["dep_time"] = df["dep_time"].astype(str).str.strip()
+        df["dep_time"] = df["dep_time"].astype(str).str.strip().astype("category")
+        df["departure_mins"] = _clock_minutes(df["dep_time"]).astype(np.int32)
     return df
 
 
-@lru_cache(maxsize=1)
-def load_hotels(path: str = "dataset/hotel pricing.csv") -> pd.DataFrame:
-    df = _read_csv(path)
+def _parse_flights(source: Source) -> pd.DataFrame:
+    return _ingest(source, "flights", _normalize_flights, usecols=_FLIGHT_COLS, city_cols=("from", "to"))
+
+
+def load_flights() -> pd.DataFrame:
+    return datasets.frame("flights")
+
+
+def _parse_hotels(source: Source) -> pd.DataFrame:
+    df = _read_csv(source)
     df = _to_snake(df)
-    if "city" in df:
-        df["city"] = df["city"].astype(str).str.strip()
+    df = categorize_cities(df, ("city",))
     # price column may be named differently; harmonize
     price_col = "price_per_night_inr" if "price_per_night_inr" in df.columns else "price_per_night"
     if price_col in df:
@@ -80,12 +308,181 @@ def load_hotels(path: str = "dataset/hotel pricing.csv") -> pd.DataFrame:
     return df
 
 
-@lru_cache(maxsize=1)
-def load_attractions(path: str = "dataset/india_attractions.csv") -> pd.DataFrame:
-    df = _read_csv(path)
+def load_hotels() -> pd.DataFrame:
+    return datasets.frame("hotels")
+
+
+def _parse_attractions(source: Source) -> pd.DataFrame:
+    df = _read_csv(source)
     df = _to_snake(df)
-    if "city" in df:
-        df["city"] = df["city"].astype(str).str.strip()
+    df = categorize_cities(df, ("city",))
     return df
 
 
+def load_attractions() -> pd.DataFrame:
+    return datasets.frame("attractions")
+
+
+def _spec(name: str, parse: Callable[[Source], pd.DataFrame], city_cols: Tuple[str, ...]) -> DatasetSpec:
+    return DatasetSpec(
+        path=DATASET_PATHS[name],
+        load=lambda path: _load_with_snapshot(path, parse, city_cols),
+        parse=parse,
+        city_cols=city_cols,
+        store=_write_snapshot,
+    )
+
+
+# Every frame and derived index is served from the manager's current generation; refresh() swaps in a new one
+datasets = DatasetManager({
+    "bus": _spec("bus", _parse_bus, ("source", "destination")),
+    "flights": _spec("flights", _parse_flights, ("from", "to")),
+    "hotels": _spec("hotels", _parse_hotels, ("city",)),
+    "attractions": _spec("attractions", _parse_attractions, ("city",)),
+})
+
+
+# (key values, ascending) pairs, most significant first
+Ordering = Sequence[Tuple[np.ndarray, bool]]
+
+
+def _lexsort(keys: Ordering, positions: Optional[np.ndarray] = None, major: Optional[np.ndarray] = None) -> np.ndarray:
+    # np.lexsort sorts by the last key first; descending keys are negated. Ties keep row order.
+    cols = [(k if positions is None else k[positions]) * (1 if asc else -1) for k, asc in keys]
+    order = np.lexsort(tuple(reversed(cols)) + ((major,) if major is not None else ()))
+    return order if positions is None else positions[order]
+
+
+class RouteIndex:
+    """
+    Every ranking (sort mode) of the rows, computed once. Per mode, rows are grouped by
+    (source, destination) and ranked within each route, so a route lookup is a dict hit on the
+    route's span, an optional budget cut and a slice. A ranking of all rows serves the lookups
+    that are not a single route (only a source or only a destination).
+    """
+
+    def __init__(self, df: pd.DataFrame, src_col: str, dst_col: str, orderings: Dict[str, Ordering], prices: Optional[np.ndarray] = None) -> None:
+        self.df = df
+        self.orderings = {mode: list(keys) for mode, keys in orderings.items()}
+        if prices is None:
+            prices = df["price"].to_numpy() if "price" in df else np.zeros(len(df), dtype=int)
+        self.prices = prices
+        self.spans: Dict[Tuple[str, str], Tuple[int, int]] = {}
+        self.route_orders: Dict[str, np.ndarray] = {}
+        self.global_orders = {mode: _lexsort(keys) for mode, keys in self.orderings.items()}
+        # Modes whose per-route ranking is by ascending price can cut the budget with a binary search
+        self._route_prices: Dict[str, np.ndarray] = {}
+        if df.empty or src_col not in df or dst_col not in df:
+            return
+        routes = pd.DataFrame({"s": df[src_col].astype(str).to_numpy(), "d": df[dst_col].astype(str).to_numpy()})
+        groups = routes.groupby(["s", "d"], sort=False)
+        gid = groups.ngroup().to_numpy()
+        counts = np.bincount(gid)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        for key, idx in groups.indices.items():
+            g = gid[idx[0]]
+            self.spans[key] = (int(starts[g]), int(starts[g] + counts[g]))
+        within_route = np.ones(len(df), dtype=bool)
+        within_route[starts[1:] - 1] = False
+        for mode, keys in self.orderings.items():
+            order = _lexsort(keys, major=gid)
+            self.route_orders[mode] = order
+            ranked_prices = prices[order]
+            if np.all((np.diff(ranked_prices) >= 0) | ~within_route[:-1]):
+                self._route_prices[mode] = ranked_prices
+
+    def mode(self, sort: Optional[str]) -> str:
+        return sort if sort in self.orderings else DEFAULT_SORT
+
+    def lookup(self, sources: Iterable[str], destinations: Iterable[str], budget: Optional[int], top_k: int, sort: Optional[str] = None) -> pd.DataFrame:
+        mode = self.mode(sort)
+        order = self.route_orders.get(mode)
+        route_prices = self._route_prices.get(mode)
+        picked: List[np.ndarray] = []
+        for key in product(sources, destinations):
+            span = self.spans.get(key)
+            if span is None:
+                continue
+            start, end = span
+            ranked = order[start:end]
+            if budget is not None:
+                if route_prices is not None:
+                    ranked = ranked[:int(np.searchsorted(route_prices[start:end], int(budget), side="right"))]
+                else:
+                    ranked = ranked[self.prices[ranked] <= int(budget)]
+            picked.append(ranked[:top_k])
+        if not picked:
+            return self.df.iloc[0:0]
+        # Several routes matched (e.g. fuzzy "Delhi" and "New Delhi"): re-rank the few candidates
+        positions = picked[0] if len(picked) == 1 else _lexsort(self.orderings[mode], np.concatenate(picked))
+        return self.df.iloc[positions[:top_k]]
+
+    def select(self, mask: np.ndarray, budget: Optional[int], top_k: int, sort: Optional[str] = None) -> pd.DataFrame:
+        """Top rows among ``mask`` in the requested order: a filter over a precomputed ranking, no sort."""
+        order = self.global_orders[self.mode(sort)]
+        keep = mask[order]
+        if budget is not None:
+            keep &= self.prices[order] <= int(budget)
+        return self.df.iloc[order[np.flatnonzero(keep)[:top_k]]]
+
+
+def _missing_last(values: np.ndarray, missing: int) -> np.ndarray:
+    # Unparsed durations (0) and departures (-1) rank after every real value
+    return np.where(values == missing, np.iinfo(np.int64).max, values)
+
+
+def build_bus_route_index(df: pd.DataFrame) -> RouteIndex:
+    price = df["price"].to_numpy() if "price" in df else np.zeros(len(df), dtype=int)
+    rating = df["rating"].to_numpy(dtype=float) if "rating" in df else None
+    orderings: Dict[str, Ordering] = {"cheapest": [(price, True)] + ([(rating, False)] if rating is not None else [])}
+    if "duration_mins" in df:
+        orderings["fastest"] = [(_missing_last(df["duration_mins"].to_numpy(), 0), True), (price, True)]
+    if rating is not None:
+        orderings["best_rated"] = [(rating, False), (price, True)]
+    if "departure_mins" in df:
+        orderings["earliest"] = [(_missing_last(df["departure_mins"].to_numpy(), -1), True), (price, True)]
+    return RouteIndex(df, "source", "destination", orderings, price)
+
+
+def bus_route_index() -> RouteIndex:
+    return datasets.derived("bus_route_index", lambda: build_bus_route_index(load_bus()), ("bus",))
+
+
+def build_flight_route_index(df: pd.DataFrame) -> RouteIndex:
+    price = df["price"].to_numpy() if "price" in df else np.zeros(len(df), dtype=int)
+    orderings: Dict[str, Ordering] = {"cheapest": [(price, True)]}
+    if "duration_mins" in df:
+        orderings["cheapest"].append((df["duration_mins"].to_numpy(), True))
+        orderings["fastest"] = [(_missing_last(df["duration_mins"].to_numpy(), 0), True), (price, True)]
+    if "departure_mins" in df:
+        orderings["earliest"] = [(_missing_last(df["departure_mins"].to_numpy(), -1), True), (price, True)]
+    return RouteIndex(df, "from", "to", orderings, price)
+
+
+def flight_route_index() -> RouteIndex:
+    return datasets.derived("flight_route_index", lambda: build_flight_route_index(load_flights()), ("flights",))
+
+
+def bus_route_graph() -> RouteGraph:
+    return datasets.derived(
+        "bus_route_graph",
+        lambda: build_route_graph(load_bus(), "source", "destination", ROUTE_MIN_LAYOVER_MINS, ROUTE_MAX_LAYOVER_MINS),
+        ("bus",),
+    )
+
+
+def flight_route_graph() -> RouteGraph:
+    return datasets.derived(
+        "flight_route_graph",
+        lambda: build_route_graph(load_flights(), "from", "to", ROUTE_MIN_LAYOVER_MINS, ROUTE_MAX_LAYOVER_MINS),
+        ("flights",),
+    )
+
+
+def attraction_theme_index() -> ThemeIndex:
+    return datasets.derived("attraction_theme_index", lambda: build_theme_index(load_attractions()), ("attractions",))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    build_snapshots()
@@ -0,0 +1,292 @@
+import os
+import sys
+import warnings
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+warnings.filterwarnings("ignore")
+
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import CancelledError, Future
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from config import COALESCE_REQUESTS, LLM_CACHE_SIZE, LLM_CACHE_TTL_SECONDS, LLM_CACHE_PATH, LLM_CACHE_MAX_DB_ENTRIES
+from services.Metrics_Service import metrics
+
+
+def make_cache_key(model_name: str, prompt: str, temperature: float, max_output_tokens: Optional[int]) -> str:
+    digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+    return f"{model_name}|{temperature}|{max_output_tokens}|{digest}"
+
+
+class ResponseCache:
+    """
+    Two-tier cache for deterministic LLM responses: an in-memory LRU per process and an
+    optional SQLite file shared by every worker on the node. Both tiers honour the TTL.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl_seconds: float = 86400,
+        db_path: Optional[str] = None,
+        max_db_entries: int = 50000,
+    ) -> None:
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.db_path = db_path
+        self.max_db_entries = max_db_entries
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._local = threading.local()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "writes": 0}
+        if db_path:
+            self._init_db()
+
+    # --- sqlite tier ---
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self) -> None:
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+
+    def _db_get(self, key: str, now: float) -> Optional[Tuple[str, float]]:
+        try:
+            row = self._conn().execute("SELECT value, expires_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] <= now:
+                self._conn().execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._bump("expirations")
+                return None
+            self._conn().execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+            return row[0], row[1]
+        except sqlite3.Error:
+            return None
+
+    def _db_set(self, key: str, value: str, expires_at: float, now: float) -> None:
+        try:
+            conn = self._conn()
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, expires_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, value, expires_at, now),
+            )
+            expired = conn.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (now,)).rowcount
+            count = conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+            evicted = 0
+            if count > self.max_db_entries:
+                # Evict the least recently used tenth in one statement
+                evicted = conn.execute(
+                    "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY last_access LIMIT ?)",
+                    (count - self.max_db_entries + self.max_db_entries // 10,),
+                ).rowcount
+            self._bump("expirations", max(expired, 0))
+            self._bump("evictions", max(evicted, 0))
+        except sqlite3.Error:
+            pass
+
+    # --- public API ---
+    def _bump(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self._stats[name] += n
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self._memory.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    return entry[0]
+                del self._memory[key]
+                self._stats["expirations"] += 1
+        if self.db_path:
+            found = self._db_get(key, now)
+            if found is not None:
+                self._bump("disk_hits")
+                self._remember(key, found[0], found[1])
+                return found[0]
+        self._bump("misses")
+        return None
+
+    def _remember(self, key: str, value: str, expires_at: float) -> None:
+        with self._lock:
+            self._memory[key] = (value, expires_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def set(self, key: str, value: str) -> None:
+        now = time.time()
+        expires_at = now + self.ttl_seconds
+        self._remember(key, value, expires_at)
+        self._bump("writes")
+        if self.db_path:
+            self._db_set(key, value, expires_at, now)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+        if self.db_path:
+            try:
+                self._conn().execute("DELETE FROM llm_cache")
+            except sqlite3.Error:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
+
+
+_cache_lock = threading.Lock()
+_response_cache: Optional[ResponseCache] = None
+
+
+def get_response_cache() -> ResponseCache:
+    """Process-wide response cache configured from config.LLM_CACHE_*."""
+    global _response_cache
+    if _response_cache is None:
+        with _cache_lock:
+            if _response_cache is None:
+                _response_cache = ResponseCache(
+                    max_entries=LLM_CACHE_SIZE,
+                    ttl_seconds=LLM_CACHE_TTL_SECONDS,
+                    db_path=LLM_CACHE_PATH,
+                    max_db_entries=LLM_CACHE_MAX_DB_ENTRIES,
+                )
+    return _response_cache
+
+
+def llm_cache_stats() -> dict:
+    return get_response_cache().stats()
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key: the first caller (the leader) runs the work and
+    every caller that arrives while it is in flight waits for the same result instead of repeating
+    it. Nothing is kept once the call finishes, so this complements rather than replaces a cache.
+    Results are shared between callers and must be treated as read-only.
+    """
+
+    def __init__(self, name: str, enabled: bool = True) -> None:
+        self.name = name
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, Future] = {}
+        self._stats = {"leaders": 0, "followers": 0}
+
+    def _join(self, key: Hashable) -> Tuple[Future, bool]:
+        with self._lock:
+            fut = self._calls.get(key)
+            leader = fut is None
+            if leader:
+                fut = self._calls[key] = Future()
+            self._stats["leaders" if leader else "followers"] += 1
+        metrics.inc("travel_coalesced_calls_total", flight=self.name, role="leader" if leader else "follower")
+        return fut, leader
+
+    def _finish(self, key: Hashable, fut: Future, result: Any = None, error: Optional[BaseException] = None) -> None:
+        with self._lock:
+            self._calls.pop(key, None)
+        if error is None:
+            fut.set_result(result)
+        elif isinstance(error, asyncio.CancelledError):
+            # A cancelled leader says nothing about the work itself; its followers retry it
+            fut.cancel()
+        else:
+            fut.set_exception(error)
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """Run ``fn`` or wait for the identical call already in flight; returns (result, shared)."""
+        if not self.enabled:
+            return fn(), False
+        while True:
+            fut, leader = self._join(key)
+            if not leader:
+                try:
+                    return fut.result(), True
+                except CancelledError:
+                    continue
+            try:
+                result = fn()
+            except BaseException as e:
+                self._finish(key, fut, error=e)
+                raise
+            self._finish(key, fut, result)
+            return result, False
+
+    async def ado(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Async counterpart of do; sync and async callers of one key share the same flight."""
+        if not self.enabled:
+            return await fn(), False
+        while True:
+            fut, leader = self._join(key)
+            if not leader:
+                try:
+                    # shield: cancelling this follower must not cancel the flight other callers wait on
+                    return await asyncio.shield(asyncio.wrap_future(fut)), True
+                except asyncio.CancelledError:
+                    if fut.cancelled():
+                        continue
+                    raise
+            try:
+                result = await fn()
+            except BaseException as e:
+                self._finish(key, fut, error=e)
+                raise
+            self._finish(key, fut, result)
+            return result, False
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._calls)
+        total = stats["leaders"] + stats["followers"]
+        stats["coalesce_rate"] = stats["followers"] / total if total else 0.0
+        return stats
+
+
+_flights_lock = threading.Lock()
+_flights: Dict[str, SingleFlight] = {}
+
+
+def get_flight(name: str) -> SingleFlight:
+    """Process-wide SingleFlight group for ``name``, enabled by config.COALESCE_REQUESTS."""
+    flight = _flights.get(name)
+    if flight is None:
+        with _flights_lock:
+            flight = _flights.setdefault(name, SingleFlight(name, COALESCE_REQUESTS))
+    return flight
+
+
+def coalesce_stats() -> Dict[str, dict]:
+    with _flights_lock:
+        flights = list(_flights.values())
+    return {flight.name: flight.stats() for flight in flights}
@@ -0,0 +1,103 @@
+import os
+import sys
+import warnings
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+warnings.filterwarnings("ignore")
+
+from functools import lru_cache
+from typing import Dict, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from rapidfuzz import fuzz, process
+
+from config import CITY_ALIASES, FUZZY_THRESHOLD
+from services.Query_Extraction_service import _city_variants
+
+
+def alias_key(city: str) -> str:
+    """Casefolded matching key with alternate spellings (Bombay, Bangalore, ...) folded together."""
+    key = (city or "").strip().casefold()
+    return CITY_ALIASES.get(key, key).casefold()
+
+
+class CityIndex:
+    """
+    Resolves a user's city string against the distinct city names of one dataset column.
+    Matching runs once per query over a few dozen names instead of once per row.
+    """
+
+    def __init__(self, names: Sequence[str]) -> None:
+        self.names: Tuple[str, ...] = tuple(names)
+        keys, owners = [], []
+        for i, name in enumerate(self.names):
+            for variant in _city_variants(str(name)):
+                keys.append(alias_key(variant))
+                owners.append(i)
+        self._keys = keys
+        self._owners = np.asarray(owners, dtype=np.int64)
+        self._cache: Dict[Tuple[str, bool, int], Tuple[str, ...]] = {}
+
+    def resolve(self, value: str, fuzzy: bool, threshold: int = FUZZY_THRESHOLD) -> Tuple[str, ...]:
+        """Return every indexed name matching ``value`` (exactly or above the fuzzy threshold)."""
+        key = alias_key(value)
+        if not key or not self._keys:
+            return ()
+        cache_key = (key, fuzzy, threshold)
+        cached = self._cache.get(cache_key)
+        if cached is not None:
+            return cached
+        if fuzzy:
+            # Same scorers as fuzzy_city_match, batched over the whole vocabulary
+            scores = np.maximum(
+                process.cdist([key], self._keys, scorer=fuzz.ratio, processor=None)[0],
+                process.cdist([key], self._keys, scorer=fuzz.token_sort_ratio, processor=None)[0],
+            )
+            hit = scores >= threshold
+        else:
+            hit = np.fromiter((k == key for k in self._keys), dtype=bool, count=len(self._keys))
+        matched = tuple(self.names[i] for i in np.unique(self._owners[hit]))
+        if len(self._cache) < 4096:
+            self._cache[cache_key] = matched
+        return matched
+
+
+@lru_cache(maxsize=32)
+def city_index(names: Tuple[str, ...]) -> CityIndex:
+    return CityIndex(names)
+
+
+def column_city_index(series: pd.Series) -> CityIndex:
+    """Index over the categories of a categorical city column (shared by every slice of it)."""
+    return city_index(tuple(series.cat.categories))
+
+
+def names_mask(series: pd.Series, names: Sequence[str]) -> np.ndarray:
+    """Boolean row mask for already-resolved city names; names missing from the column match nothing."""
+    if not isinstance(series.dtype, pd.CategoricalDtype):
+        series = series.astype("category")
+    if not names:
+        return np.zeros(len(series), dtype=bool)
+    codes = series.cat.categories.get_indexer(list(names))
+    return np.isin(series.cat.codes.to_numpy(), codes[codes >= 0])
+
+
+def city_mask(series: pd.Series, value: str, fuzzy: bool) -> np.ndarray:
+    """Boolean row mask for ``value`` as an exact comparison on categorical codes."""
+    if not isinstance(series.dtype, pd.CategoricalDtype):
+        series = series.astype("category")
+    return names_mask(series, column_city_index(series).resolve(value, fuzzy))
+
+
+def categorize_cities(df: pd.DataFrame, cols: Sequence[str], build_index: bool = True) -> pd.DataFrame:
+    """
+    Store city columns as categoricals and build their resolution index at load time (chunked
+    loads pass ``build_index=False`` and index the combined column once).
+    """
+    for c in cols:
+        if c in df:
+            df[c] = df[c].astype(str).str.strip().astype("category")
+            if build_index:
+                column_city_index(df[c])
+    return df
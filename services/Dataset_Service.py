@@ -0,0 +1,303 @@
+import os
+import sys
+import warnings
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+warnings.filterwarnings("ignore")
+
+import contextvars
+import hashlib
+import io
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Callable, Dict, IO, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+import pandas as pd
+
+from services.City_Index_Service import column_city_index
+from services.Metrics_Service import metrics, span
+
+logger = logging.getLogger(__name__)
+
+Source = Union[str, IO[str]]
+
+# Files are hashed a block at a time rather than read whole
+_HASH_BLOCK = 1 << 20
+
+
+@dataclass(frozen=True)
+class DatasetSpec:
+    """How one CSV dataset is loaded cold, parsed from a chunk of appended rows, and persisted."""
+    path: str
+    load: Callable[[str], pd.DataFrame]
+    parse: Callable[[Source], pd.DataFrame]
+    city_cols: Tuple[str, ...] = ()
+    store: Optional[Callable[[str, pd.DataFrame], None]] = None
+
+
+@dataclass(frozen=True)
+class FileState:
+    """What a frame was loaded from: cheap stat fields, plus a digest to tell appends from rewrites."""
+    mtime_ns: int
+    size: int
+    digest: Optional[str]
+    header: bytes
+    ends_with_newline: bool
+
+    @classmethod
+    def read(cls, f: IO[bytes], prefix: Optional[int] = None) -> Tuple["FileState", Optional[str]]:
+        """
+        Hash an open file in fixed-size blocks, so no copy of its bytes outlives the pass. Also
+        returns the digest of its first ``prefix`` bytes (None if it is shorter), to tell appends from rewrites.
+        """
+        st = os.fstat(f.fileno())
+        h = hashlib.blake2b()
+        header, last, size, prefix_digest = b"", b"", 0, None
+        while True:
+            if size == prefix:
+                prefix_digest = h.hexdigest()
+            # stop a block at the prefix boundary so its digest can be taken on the way
+            block = f.read(_HASH_BLOCK if prefix is None or size >= prefix else min(_HASH_BLOCK, prefix - size))
+            if not block:
+                break
+            h.update(block)
+            if not header.endswith(b"\n"):
+                cut = block.find(b"\n")
+                header += block if cut < 0 else block[:cut + 1]
+            size, last = size + len(block), block[-1:]
+        state = cls(mtime_ns=st.st_mtime_ns, size=size, digest=h.hexdigest(), header=header, ends_with_newline=last == b"\n")
+        return state, prefix_digest
+
+
+@dataclass(frozen=True)
+class RefreshReport:
+    dataset: str
+    mode: str  # "append" (only the new rows were parsed) or "full"
+    rows_before: int
+    rows_after: int
+    seconds: float
+
+    @property
+    def rows_added(self) -> int:
+        return self.rows_after - self.rows_before
+
+
+def concat_frames(frames: Sequence[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Stack frames row-wise, keeping categorical columns categorical: their categories are
+    unioned in first-seen order, so codes from earlier frames stay valid.
+    """
+    if len(frames) == 1:
+        return frames[0].reset_index(drop=True)
+    first = frames[0]
+    frames = list(frames)
+    for c in first.columns:
+        if not isinstance(first[c].dtype, pd.CategoricalDtype):
+            continue
+        cats = first[c].cat.categories
+        for f in frames[1:]:
+            values = f[c].cat.categories if isinstance(f[c].dtype, pd.CategoricalDtype) else pd.Index(f[c].dropna().unique())
+            cats = cats.append(values.difference(cats))
+        dtype = pd.CategoricalDtype(cats)
+        frames = [f.assign(**{c: f[c].astype(dtype)}) for f in frames]
+    return pd.concat(frames, ignore_index=True)
+
+
+def append_rows(old: pd.DataFrame, new: pd.DataFrame, city_cols: Sequence[str] = ()) -> pd.DataFrame:
+    """
+    ``old`` followed by ``new`` as a new frame (``old`` is left untouched for readers still using
+    it). City categoricals keep their existing codes; unseen cities are appended as categories.
+    """
+    if list(new.columns) != list(old.columns):
+        raise ValueError(f"appended rows have columns {list(new.columns)}, expected {list(old.columns)}")
+    if new.empty:
+        return old
+    df = concat_frames([old, new])
+    for c in city_cols:
+        if c in df and isinstance(df[c].dtype, pd.CategoricalDtype):
+            column_city_index(df[c])
+    return df
+
+
+class Generation:
+    """
+    One consistent version of every dataset and of the indexes derived from them. Frames load
+    on first use; derived values are built on first use and kept with the frames they came from.
+    """
+
+    def __init__(self, number: int, frames: Optional[Dict[str, Tuple[pd.DataFrame, FileState]]] = None) -> None:
+        self.number = number
+        self.frames: Dict[str, Tuple[pd.DataFrame, FileState]] = dict(frames or {})
+        # key -> (value, build, datasets it depends on; None means all)
+        self.derived: Dict[str, Tuple[object, Callable[[], object], Optional[frozenset]]] = {}
+        self.lock = threading.RLock()
+
+
+_pinned: contextvars.ContextVar[Optional[Generation]] = contextvars.ContextVar("dataset_generation", default=None)
+
+
+class DatasetManager:
+    """
+    Serves the datasets and their derived indexes, and refreshes them when the files change.
+
+    ``refresh`` compares each loaded file's mtime and size; when they moved it checks the digest
+    of the previously loaded bytes, parses only the appended rows if they are unchanged, and
+    otherwise reloads the file. Derived indexes that were in use are rebuilt over the new frames
+    before the new generation replaces the old one in a single assignment, so a request pinned
+    with ``pinned()`` sees one version of everything from start to finish.
+    """
+
+    def __init__(self, specs: Dict[str, DatasetSpec]) -> None:
+        self.specs = dict(specs)
+        self._current = Generation(0)
+        self._refresh_lock = threading.Lock()
+        self._watcher: Optional[threading.Thread] = None
+
+    def current(self) -> Generation:
+        return _pinned.get() or self._current
+
+    @contextmanager
+    def pinned(self, generation: Optional[Generation] = None) -> Iterator[Generation]:
+        """Serve every lookup in the block (and in threads started with bind_context) from one generation."""
+        generation = generation or _pinned.get() or self._current
+        token = _pinned.set(generation)
+        try:
+            yield generation
+        finally:
+            _pinned.reset(token)
+
+    def reset(self) -> None:
+        """Drop every loaded frame and derived index; the next lookups load cold."""
+        with self._refresh_lock:
+            self._current = Generation(self._current.number + 1)
+
+    def frame(self, name: str) -> pd.DataFrame:
+        gen = self.current()
+        loaded = gen.frames.get(name)
+        if loaded is None:
+            with gen.lock:
+                loaded = gen.frames.get(name)
+                if loaded is None:
+                    loaded = gen.frames[name] = self._load(self.specs[name])
+        return loaded[0]
+
+    def derived(self, key: str, build: Callable[[], object], depends: Optional[Iterable[str]] = None) -> object:
+        """``build()`` once per generation; it is rebuilt after a refresh of any dataset in ``depends`` (default: all)."""
+        gen = self.current()
+        hit = gen.derived.get(key)
+        if hit is None:
+            with gen.lock:
+                hit = gen.derived.get(key)
+                if hit is None:
+                    hit = gen.derived[key] = (build(), build, frozenset(depends) if depends is not None else None)
+        return hit[0]
+
+    def _load(self, spec: DatasetSpec) -> Tuple[pd.DataFrame, FileState]:
+        with open(spec.path, "rb") as f:
+            state, _ = FileState.read(f)
+        df = spec.load(spec.path)
+        st = os.stat(spec.path)
+        if (st.st_mtime_ns, st.st_size) != (state.mtime_ns, state.size):
+            # Changed while loading: force a full reload on the next refresh
+            state = FileState(-1, -1, None, b"", False)
+        return df, state
+
+    def _refresh_one(self, name: str, df: pd.DataFrame, state: FileState) -> Optional[Tuple[pd.DataFrame, FileState, Optional[RefreshReport]]]:
+        spec = self.specs[name]
+        try:
+            st = os.stat(spec.path)
+        except FileNotFoundError:
+            logger.warning("Dataset %s disappeared from %s; keeping the loaded rows", name, spec.path)
+            return None
+        if (st.st_mtime_ns, st.st_size) == (state.mtime_ns, state.size):
+            return None
+        start = time.perf_counter()
+        with open(spec.path, "rb") as f:
+            new_state, prefix_digest = FileState.read(f, state.size if state.digest is not None else None)
+            if new_state.digest == state.digest:
+                # Touched, not changed
+                return df, new_state, None
+            grown = (
+                state.digest is not None and state.ends_with_newline and new_state.size > state.size
+                and prefix_digest == state.digest
+            )
+            tail = None
+            if grown:
+                # only the appended bytes are read back, and only for the append path
+                f.seek(state.size)
+                tail = f.read(new_state.size - state.size)
+        mode, updated = "full", None
+        if tail is not None:
+            tail = (state.header + tail).decode("utf-8", errors="replace")
+            try:
+                updated = append_rows(df, spec.parse(io.StringIO(tail)), spec.city_cols)
+                mode = "append"
+                if spec.store is not None:
+                    spec.store(spec.path, updated)
+            except ValueError as e:
+                logger.warning("Could not append new rows of %s (%s); reloading it", name, e)
+                updated = None
+            tail = None
+        if updated is None:
+            updated = spec.load(spec.path)
+        report = RefreshReport(name, mode, len(df), len(updated), time.perf_counter() - start)
+        return updated, new_state, report
+
+    def refresh(self) -> List[RefreshReport]:
+        """Check every loaded dataset file and swap in a new generation if any of them changed."""
+        with self._refresh_lock, span("dataset_refresh") as s:
+            old = self._current
+            with old.lock:
+                frames = dict(old.frames)
+                derived = dict(old.derived)
+            reports, changed, touched = [], set(), False
+            for name, (df, state) in list(frames.items()):
+                result = self._refresh_one(name, df, state)
+                if result is None:
+                    continue
+                updated, new_state, report = result
+                frames[name], touched = (updated, new_state), True
+                if report is not None:
+                    reports.append(report)
+                    changed.add(name)
+            if not touched:
+                return reports
+            gen = Generation(old.number + 1, frames)
+            start = time.perf_counter()
+            with self.pinned(gen):
+                for key, (value, build, depends) in derived.items():
+                    if changed and (depends is None or depends & changed):
+                        self.derived(key, build, depends)
+                    else:
+                        gen.derived[key] = (value, build, depends)
+            rebuild = time.perf_counter() - start
+            self._current = gen
+            s.set(generation=gen.number, changed=sorted(changed))
+            for r in reports:
+                metrics.inc("travel_dataset_reloads_total", dataset=r.dataset, mode=r.mode)
+                metrics.inc("travel_dataset_rows_added_total", max(r.rows_added, 0), dataset=r.dataset)
+                metrics.observe("travel_dataset_reload_seconds", r.seconds, dataset=r.dataset)
+                logger.info("Reloaded %s (%s): %d -> %d rows (%+d) in %.1f ms",
+                            r.dataset, r.mode, r.rows_before, r.rows_after, r.rows_added, r.seconds * 1000)
+            if changed:
+                logger.info("Dataset generation %d live; derived indexes rebuilt in %.1f ms", gen.number, rebuild * 1000)
+            return reports
+
+    def start_watcher(self, interval: float) -> None:
+        """Refresh every ``interval`` seconds from a daemon thread (once per process; 0 disables)."""
+        if interval <= 0 or (self._watcher is not None and self._watcher.is_alive()):
+            return
+
+        def watch() -> None:
+            while True:
+                time.sleep(interval)
+                try:
+                    self.refresh()
+                except Exception:
+                    logger.exception("Dataset refresh failed; still serving generation %d", self._current.number)
+
+        self._watcher = threading.Thread(target=watch, name="dataset-watcher", daemon=True)
+        self._watcher.start()
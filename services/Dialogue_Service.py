@@ -0,0 +1,167 @@
+import os
+import sys
+import warnings
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+warnings.filterwarnings("ignore")
+
+import re
+from dataclasses import dataclass, field, replace
+from typing import Callable, Optional, Tuple, Union
+
+import pandas as pd
+
+from config import DEFAULT_SORT, FAST_PATH_CONFIDENCE
+from services.CSV_Service import RouteIndex, bus_route_index, flight_route_index, load_hotels
+from services.City_Index_Service import column_city_index
+from services.Query_Extraction_service import (
+    AMOUNT_PATTERN,
+    HotelQuery,
+    RouteQuery,
+    mentioned_cities,
+    parse_amount,
+    parse_query_local,
+    requested_sort_mode,
+)
+from services.Retrieval_Service import Query, rank_hotels, retrieve_hotels
+
+
+# Intents whose answers can be refined locally from the rows kept for the session
+REFINABLE = ("bus", "flight", "hotel")
+# Orderings each intent supports (flights carry no rating; hotels rank on price or rating only)
+_SORTS = {
+    "bus": ("cheapest", "fastest", "best_rated", "earliest"),
+    "flight": ("cheapest", "fastest", "earliest"),
+    "hotel": ("cheapest", "best_rated"),
+}
+
+# "for" only reads as a budget with a currency marker: "for ₹900", but not "for 3 of us"
+_BUDGET = re.compile(
+    r"(?:(?:under|below|less than|within|up ?to|max(?:imum)?|cheaper than|budget(?:\s+(?:of|is|to))?)\s*(?:rs\.?|inr|₹)?"
+    r"|\bfor\s*(?:rs\.?|inr|₹))\s*" + AMOUNT_PATTERN,
+    flags=re.I,
+)
+_BARE_AMOUNT = re.compile(r"^\D*?(?:rs\.?|inr|₹)?\s*" + AMOUNT_PATTERN + r"\D*$", flags=re.I)
+_SWAP = re.compile(r"\b(return|way back|back to|other way|reverse|opposite direction|coming back)\b", flags=re.I)
+_MORE = re.compile(r"\b(more|other options|others|next (?:options?|results?|ones?|few|page)|anything else|what else)\b", flags=re.I)
+# A bare number below this is a count ("for 3 of us?"), not a budget
+_MIN_BARE_BUDGET = 100
+
+
+@dataclass
+class Refinement:
+    """A follow-up applied as a diff to the previous turn's parameters."""
+    budget: Optional[int] = None
+    swap: bool = False
+    more: bool = False
+    sort: Optional[str] = None
+
+
+def parse_refinement(text: str, state: "DialogueState") -> Optional[Refinement]:
+    """
+    Read ``text`` as a refinement of the session's last answer ("what about under 1500?",
+    "and the return?", "show more", "fastest one?"), or None when it is a new question: no
+    refinable answer yet, a confidently parsed query of its own, another intent, or a city.
+    """
+    if state.intent not in REFINABLE or state.params is None:
+        return None
+    parsed = parse_query_local(text)
+    if parsed.confidence >= FAST_PATH_CONFIDENCE or parsed.intent not in (state.intent, "unknown"):
+        return None
+    if mentioned_cities(text):
+        return None
+    ref = Refinement()
+    m = _BUDGET.search(text)
+    if m is None and len(text.split()) <= 6:
+        m = _BARE_AMOUNT.match(text)
+        if m is not None and parse_amount(*m.groups()) < _MIN_BARE_BUDGET:
+            m = None
+    if m is not None:
+        ref.budget = parse_amount(*m.groups())
+    ref.swap = state.intent != "hotel" and bool(_SWAP.search(text))
+    ref.more = bool(_MORE.search(text))
+    sort = requested_sort_mode(text)
+    if sort in _SORTS[state.intent]:
+        ref.sort = sort
+    if ref.budget is None and not ref.swap and not ref.more and ref.sort is None:
+        return None
+    return ref
+
+
+@dataclass
+class DialogueState:
+    """
+    One chat session's last answered turn: its intent, resolved parameters and ordering, the
+    question that set the topic, and what its rows are before the budget cut (the route's
+    resolved cities, looked up in the shared RouteIndex, or every hotel of the city), so
+    refinements re-rank the whole route instead of extracting and retrieving again.
+    """
+    intent: Optional[str] = None
+    params: Union[RouteQuery, HotelQuery, None] = None
+    sort: Optional[str] = None
+    question: Optional[str] = None
+    candidates: Optional[pd.DataFrame] = field(default=None, repr=False)
+    price_col: str = "price"
+    shown: int = 0
+    _route: Optional[Tuple[Callable[[], RouteIndex], Tuple[str, ...], Tuple[str, ...]]] = field(default=None, repr=False)
+
+    def clear(self) -> None:
+        self.__init__()
+
+    def remember(self, intent: str, params, sort: Optional[str], question: str, shown: int, fuzzy: bool) -> None:
+        """Keep a finished turn; for refinable intents also fetch its candidate rows."""
+        self.clear()
+        self.intent, self.question = intent, question
+        if intent not in REFINABLE or not isinstance(params, (RouteQuery, HotelQuery)):
+            return
+        self.params, self.sort, self.shown = params, sort or DEFAULT_SORT, shown
+        self._load_candidates(fuzzy)
+
+    def _load_candidates(self, fuzzy: bool) -> None:
+        self.candidates, self._route = None, None
+        q = self.params
+        if self.intent == "hotel":
+            if q.city:
+                self.candidates, self.price_col = retrieve_hotels(Query(city=q.city), fuzzy=fuzzy, top_k=len(load_hotels()))
+            return
+        if not q.source or not q.destination:
+            return
+        index_of, src_col, dst_col = (bus_route_index, "source", "destination") if self.intent == "bus" else (flight_route_index, "from", "to")
+        df = index_of().df
+        sources = column_city_index(df[src_col]).resolve(q.source, fuzzy)
+        destinations = column_city_index(df[dst_col]).resolve(q.destination, fuzzy)
+        if not index_of().lookup(sources, destinations, None, 1).empty:
+            self._route = (index_of, sources, destinations)
+
+    @property
+    def has_candidates(self) -> bool:
+        if self._route is not None:
+            return True
+        return self.candidates is not None and not self.candidates.empty
+
+    def apply(self, ref: Refinement, fuzzy: bool) -> None:
+        """Apply the diff to the parameters; only a swapped route needs new candidate rows."""
+        if ref.budget is not None:
+            self.params = replace(self.params, budget=ref.budget)
+        if ref.sort is not None:
+            self.sort = ref.sort
+        if ref.swap:
+            self.params = replace(self.params, source=self.params.destination, destination=self.params.source)
+            self._load_candidates(fuzzy)
+        if not ref.more:
+            self.shown = 0
+
+    def page(self, top_k: int) -> pd.DataFrame:
+        """The next ``top_k`` candidates under the current budget and ordering; advances ``shown``."""
+        if not self.has_candidates:
+            return pd.DataFrame()
+        budget = self.params.budget
+        if self._route is not None:
+            # Every ordering is ranked over the route's full span, so any sort or page is exact
+            index_of, sources, destinations = self._route
+            ranked = index_of().lookup(sources, destinations, budget, self.shown + top_k, self.sort)
+        else:
+            ranked = rank_hotels(self.candidates, self.price_col, budget, self.sort, self.shown + top_k)
+        rows = ranked.iloc[self.shown:]
+        self.shown += len(rows)
+        return rows
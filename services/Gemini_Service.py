@@ -5,105 +5,856 @@ import warnings
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 warnings.filterwarnings("ignore")
 
-from typing import Optional, List
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Dict, Iterator, Optional, List, Tuple
+import asyncio
+import atexit
 import json
+import logging
+import random
+import threading
+import time
 
 import google.generativeai as genai
-from google.api_core.exceptions import NotFound
+from google.api_core.exceptions import (
+    BadGateway,
+    DeadlineExceeded,
+    GatewayTimeout,
+    InternalServerError,
+    NotFound,
+    ResourceExhausted,
+    ServiceUnavailable,
+    TooManyRequests,
+)
+
+from config import (
+    LLM_BACKOFF_BASE_SECONDS,
+    LLM_BACKOFF_MAX_SECONDS,
+    LLM_CONCURRENCY_INITIAL,
+    LLM_CONCURRENCY_MAX,
+    LLM_CONCURRENCY_MIN,
+    LLM_FALLBACK_MODELS,
+    LLM_HEDGE_MIN_DELAY_SECONDS,
+    LLM_HEDGE_MIN_SAMPLES,
+    LLM_HEDGE_PERCENTILE,
+    LLM_LATENCY_BUDGET_SECONDS,
+    LLM_LATENCY_TARGET_SECONDS,
+    LLM_MAX_RETRIES,
+    LLM_RPM,
+    LLM_TPM,
+)
+from services.Cache_Service import get_flight, get_response_cache, make_cache_key
+from services.Metrics_Service import bind_context, current_span, end_span, metrics, span, start_span
+from services.Prompt_Service import estimate_tokens
+
+
+logger = logging.getLogger(__name__)
+
+_configure_lock = threading.Lock()
+_configured_key: Optional[str] = None
+
+
+class RateLimiter:
+    """
+    Process-wide token buckets for outbound Gemini requests: one for requests (``rps``, or the
+    ``rpm`` quota spread over the minute) and one for tokens (the ``tpm`` quota). ``None`` means
+    unlimited. Prompt tokens are reserved up front and response tokens charged once known.
+    """
+
+    def __init__(self, rps: Optional[float] = None, burst: Optional[int] = None, rpm: Optional[float] = None, tpm: Optional[float] = None) -> None:
+        self._lock = threading.Lock()
+        self.configure(rps, burst, rpm, tpm)
+
+    def configure(self, rps: Optional[float], burst: Optional[int] = None, rpm: Optional[float] = None, tpm: Optional[float] = None) -> None:
+        with self._lock:
+            rates = [r for r in (rps, rpm / 60 if rpm else None) if r and r > 0]
+            self.rps = min(rates) if rates else None
+            self.burst = float(burst or max(1.0, self.rps or 1.0))
+            self._tokens = self.burst
+            # A minute's quota of tokens may be spent at once, as the per-minute quota allows
+            self.tps = tpm / 60 if tpm and tpm > 0 else None
+            self.token_burst = float(tpm) if self.tps else 0.0
+            self._llm_tokens = self.token_burst
+            self._updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._updated
+        self._updated = now
+        if self.rps is not None:
+            self._tokens = min(self.burst, self._tokens + elapsed * self.rps)
+        if self.tps is not None:
+            self._llm_tokens = min(self.token_burst, self._llm_tokens + elapsed * self.tps)
+
+    def _reserve(self, tokens: int = 0) -> float:
+        """Take one request (and ``tokens`` LLM tokens), returning how long the caller must wait before using them."""
+        with self._lock:
+            if self.rps is None and self.tps is None:
+                return 0.0
+            self._refill(time.monotonic())
+            wait, limiter = 0.0, None
+            if self.rps is not None:
+                self._tokens -= 1.0
+                if self._tokens < 0:
+                    wait, limiter = -self._tokens / self.rps, "requests"
+            if self.tps is not None and tokens:
+                self._llm_tokens -= tokens
+                if self._llm_tokens < 0 and -self._llm_tokens / self.tps > wait:
+                    wait, limiter = -self._llm_tokens / self.tps, "tokens"
+        if limiter:
+            metrics.inc("travel_llm_throttled_total", limiter=limiter)
+        return wait
+
+    def charge(self, tokens: int) -> None:
+        """Debit tokens learned after the call (the response) from the tokens-per-minute bucket."""
+        with self._lock:
+            if self.tps is not None and tokens:
+                self._refill(time.monotonic())
+                self._llm_tokens -= tokens
+
+    def acquire(self, tokens: int = 0) -> None:
+        wait = self._reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def aacquire(self, tokens: int = 0) -> None:
+        wait = self._reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class ConcurrencyLimiter:
+    """
+    AIMD cap on concurrent Gemini calls. A healthy call while at least half the slots are busy
+    raises the limit by 1/limit (about one per round of calls); a throttled, failed or slow call
+    multiplies it by ``backoff``, at most once per round trip. Callers over the limit queue in
+    arrival order, sync and async alike.
+    """
+
+    def __init__(self, initial: int = 8, min_limit: int = 1, max_limit: int = 32, latency_target: Optional[float] = None, backoff: float = 0.5) -> None:
+        self._lock = threading.Lock()
+        self._waiters: deque = deque()
+        self._in_flight = 0
+        self._last_cut = 0.0
+        self.configure(initial, min_limit, max_limit, latency_target, backoff)
+
+    def configure(self, initial: int, min_limit: int = 1, max_limit: int = 32, latency_target: Optional[float] = None, backoff: float = 0.5) -> None:
+        with self._lock:
+            self.min_limit = max(1, min_limit)
+            self.max_limit = max(self.min_limit, max_limit)
+            self.limit = float(min(max(initial, self.min_limit), self.max_limit))
+            self.latency_target = latency_target if latency_target and latency_target > 0 else None
+            self.backoff = backoff
+            self._wake()
+            self._publish()
+
+    def _publish(self) -> None:
+        metrics.set("travel_llm_concurrency_limit", int(self.limit))
+        metrics.set("travel_llm_in_flight", self._in_flight)
+        metrics.set("travel_llm_queue_depth", len(self._waiters))
+
+    def _wake(self) -> None:
+        while self._waiters and self._in_flight < int(self.limit):
+            self._in_flight += 1
+            self._waiters.popleft().set_result(None)
+
+    def _enter(self) -> Optional[Future]:
+        with self._lock:
+            if not self._waiters and self._in_flight < int(self.limit):
+                self._in_flight += 1
+                self._publish()
+                return None
+            slot: Future = Future()
+            self._waiters.append(slot)
+            self._publish()
+        metrics.inc("travel_llm_throttled_total", limiter="concurrency")
+        return slot
+
+    def acquire(self) -> None:
+        slot = self._enter()
+        if slot is not None:
+            slot.result()
+
+    async def aacquire(self) -> None:
+        slot = self._enter()
+        if slot is None:
+            return
+        try:
+            await asyncio.shield(asyncio.wrap_future(slot))
+        except asyncio.CancelledError:
+            with self._lock:
+                if slot in self._waiters:
+                    self._waiters.remove(slot)
+                    self._publish()
+                    raise
+            # the slot was handed over as we were cancelled; give it back
+            self.release()
+            raise
+
+    def release(self, seconds: Optional[float] = None, ok: bool = True) -> None:
+        """
+        Free a slot. ``seconds`` is the call's latency and ``ok=False`` marks it throttled or failed
+        on the server; without ``seconds`` (cancelled or rejected calls) the limit is left alone.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._in_flight -= 1
+            if seconds is not None:
+                if not ok or (self.latency_target is not None and seconds > self.latency_target):
+                    # Calls that started before the last cut were sent under the old limit
+                    if now - seconds >= self._last_cut:
+                        self.limit = max(float(self.min_limit), self.limit * self.backoff)
+                        self._last_cut = now
+                elif (self._in_flight + 1) * 2 >= self.limit:
+                    # Only grow when the limit is what holds callers back, not while mostly idle
+                    self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+            self._wake()
+            self._publish()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"limit": int(self.limit), "in_flight": self._in_flight, "queued": len(self._waiters)}
+
+
+rate_limiter = RateLimiter(rpm=LLM_RPM, tpm=LLM_TPM)
+concurrency_limiter = ConcurrencyLimiter(LLM_CONCURRENCY_INITIAL, LLM_CONCURRENCY_MIN, LLM_CONCURRENCY_MAX, LLM_LATENCY_TARGET_SECONDS)
+
+# 429 and transient server errors; anything else (bad request, not found) is not retried
+RETRYABLE_ERRORS = (ResourceExhausted, TooManyRequests, InternalServerError, BadGateway, ServiceUnavailable, GatewayTimeout, DeadlineExceeded)
+
+
+def set_rate_limit(rps: Optional[float], burst: Optional[int] = None, rpm: Optional[float] = LLM_RPM, tpm: Optional[float] = LLM_TPM) -> None:
+    """Cap outbound Gemini requests per second (and per-minute request and token quotas) for the whole process."""
+    rate_limiter.configure(rps, burst, rpm, tpm)
+
+
+def backoff_delay(attempt: int) -> float:
+    """Full-jitter exponential backoff before retry ``attempt`` (1-based)."""
+    return random.uniform(0.0, min(LLM_BACKOFF_MAX_SECONDS, LLM_BACKOFF_BASE_SECONDS * 2 ** (attempt - 1)))
+
+
+def _response_tokens(response, text: str) -> int:
+    usage = getattr(response, "usage_metadata", None)
+    return getattr(usage, "candidates_token_count", None) or estimate_tokens(text)
+
+
+class LatencyTracker:
+    """Recent latencies of successful calls per (model, output cap), the cap standing in for the kind of call."""
+
+    def __init__(self, size: int = 200) -> None:
+        self.size = size
+        self._lock = threading.Lock()
+        self._samples: Dict[Tuple[str, Optional[int]], deque] = {}
+
+    def record(self, model: str, max_output_tokens: Optional[int], seconds: float) -> None:
+        with self._lock:
+            samples = self._samples.get((model, max_output_tokens))
+            if samples is None:
+                samples = self._samples[(model, max_output_tokens)] = deque(maxlen=self.size)
+            samples.append(seconds)
+
+    def percentile(self, model: str, max_output_tokens: Optional[int], p: float, min_samples: int = 1) -> Optional[float]:
+        """The ``p``-th percentile latency, or None with fewer than ``min_samples`` samples."""
+        with self._lock:
+            samples = sorted(self._samples.get((model, max_output_tokens), ()))
+        if not samples or len(samples) < min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._samples.clear()
+
+
+latency_tracker = LatencyTracker()
+
+# Identical generate calls in flight at the same moment share one model request
+_llm_flight = get_flight("llm")
+
+# Threads that run the racing attempts of hedged sync calls
+_hedge_lock = threading.Lock()
+_hedge_pool: Optional[ThreadPoolExecutor] = None
+
+
+def _hedge_executor() -> ThreadPoolExecutor:
+    global _hedge_pool
+    if _hedge_pool is None:
+        with _hedge_lock:
+            if _hedge_pool is None:
+                _hedge_pool = ThreadPoolExecutor(max_workers=2 * LLM_CONCURRENCY_MAX, thread_name_prefix="gemini-hedge")
+    return _hedge_pool
+
+# Time-to-first-token of recent streamed generations, in seconds
+_ttft_lock = threading.Lock()
+_ttft_samples: deque = deque(maxlen=1000)
+
+
+def _response_text(response) -> str:
+    # Robust text extraction even if response.text raises (blocked or empty candidates)
+    try:
+        return response.text  # quick accessor
+    except Exception:
+        try:
+            if getattr(response, "candidates", None):
+                parts = getattr(response.candidates[0].content, "parts", [])
+                return " ".join([getattr(p, "text", "") for p in parts if getattr(p, "text", "")])
+        except Exception:
+            pass
+    return ""
+
+
+def _record_usage(response, model_name: str, prompt: str, text: str, s=None) -> None:
+    """Attach prompt/response sizes (and token counts when the SDK reports them) to the span and metrics."""
+    s = s or current_span()
+    usage = getattr(response, "usage_metadata", None)
+    prompt_tokens = getattr(usage, "prompt_token_count", None) if usage is not None else None
+    response_tokens = getattr(usage, "candidates_token_count", None) if usage is not None else None
+    metrics.inc("travel_llm_prompt_chars_total", len(prompt), model=model_name)
+    metrics.inc("travel_llm_response_chars_total", len(text), model=model_name)
+    if prompt_tokens:
+        metrics.inc("travel_llm_tokens_total", prompt_tokens, model=model_name, kind="prompt")
+    if response_tokens:
+        metrics.inc("travel_llm_tokens_total", response_tokens, model=model_name, kind="response")
+    if s is not None:
+        s.set(model=model_name, response_chars=len(text), prompt_tokens=prompt_tokens, response_tokens=response_tokens)
+
+
+def record_ttft(seconds: float) -> None:
+    with _ttft_lock:
+        _ttft_samples.append(seconds)
+
+
+def ttft_stats() -> dict:
+    """Time-to-first-token summary (seconds) over recent streamed generations."""
+    with _ttft_lock:
+        samples = sorted(_ttft_samples)
+    if not samples:
+        return {"count": 0}
+    return {
+        "count": len(samples),
+        "last": _ttft_samples[-1],
+        "p50": samples[len(samples) // 2],
+        "p95": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+    }
 
 
 class GeminiClient:
     def __init__(self, api_key: str, model_name: str = "gemini-2.5-flash") -> None:
         self.model_name = model_name
+        self._models: Dict[str, genai.GenerativeModel] = {}
+        self._models_lock = threading.Lock()
         self._configure(api_key)
-        self.model = genai.GenerativeModel(self.model_name)
+        self.model = self._model(self.model_name)
 
     @staticmethod
     def _configure(api_key: str) -> None:
+        global _configured_key
         if not api_key:
             api_key = os.getenv("GEMINI_API_KEY", "")
-        genai.configure(api_key=api_key)
+        # genai.configure drops the SDK's cached transports, so only call it when the key changes
+        with _configure_lock:
+            if api_key != _configured_key:
+                genai.configure(api_key=api_key)
+                _configured_key = api_key
+
+    def _model(self, name: str) -> genai.GenerativeModel:
+        model = self._models.get(name)
+        if model is None:
+            with self._models_lock:
+                model = self._models.setdefault(name, genai.GenerativeModel(name))
+        return model
+
+    def close(self) -> None:
+        with self._models_lock:
+            for model in self._models.values():
+                transport = getattr(getattr(model, "_client", None), "transport", None)
+                if transport is not None:
+                    try:
+                        transport.close()
+                    except Exception:
+                        pass
+            self._models.clear()
 
     def _retry_models(self) -> List[str]:
         base = self.model_name
         candidates = list(dict.fromkeys([
-            base
+            base,
+            *LLM_FALLBACK_MODELS,
         ]))
         return candidates
 
-    def generate(self, prompt: str, temperature: float = 0.4, max_output_tokens: Optional[int] = 2000) -> str:
-        last_err: Optional[Exception] = None
-        for name in self._retry_models():
+    def _ranked(self, models: Optional[List[str]]) -> List[str]:
+        return list(dict.fromkeys(models)) if models else self._retry_models()
+
+    def count_tokens(self, prompt: str) -> Optional[int]:
+        """Prompt tokens as counted by the Gemini API, or None when the call fails."""
+        try:
+            return int(self.model.count_tokens(prompt).total_tokens)
+        except Exception:
+            return None
+
+    def generate(
+        self,
+        prompt: str,
+        temperature: float = 0.4,
+        max_output_tokens: Optional[int] = 2000,
+        cache: bool = False,
+        latency_budget: Optional[float] = None,
+        models: Optional[List[str]] = None,
+    ) -> str:
+        """
+        Generate text for the prompt. With ``cache=True`` (meant for deterministic, temperature 0
+        call sites) identical requests are answered from the shared response cache. Identical
+        calls already in flight are joined rather than sent again, cached or not.
+
+        ``models`` ranks the models to try (default: this client's model, then the configured
+        fallbacks). A call that runs past its hedge delay (the model's recent p95, or half of
+        ``latency_budget``) is raced against a second request and the first answer wins.
+        """
+        models = self._ranked(models)
+        with span("gemini.generate", model=models[0], prompt_chars=len(prompt), temperature=temperature) as s:
+            key = make_cache_key(models[0], prompt, temperature, max_output_tokens)
+            if cache:
+                cached = get_response_cache().get(key)
+                if cached is not None:
+                    s.set(cache="hit", response_chars=len(cached))
+                    metrics.inc("travel_llm_requests_total", model=models[0], cache="hit")
+                    return cached
+            text, shared = _llm_flight.do(key, lambda: self._generate(prompt, temperature, max_output_tokens, models, latency_budget))
+            return self._settle(s, models[0], key, text, shared, cache)
+
+    @staticmethod
+    def _settle(s, model: str, key: str, text: str, shared: bool, cache: bool) -> str:
+        """Record how a generate call was answered, caching the text when this call fetched it."""
+        outcome = "coalesced" if shared else "miss" if cache else "off"
+        if cache and text and not shared:
+            get_response_cache().set(key, text)
+        if cache or shared:
+            s.set(cache=outcome)
+        metrics.inc("travel_llm_requests_total", model=model, cache=outcome)
+        return text
+
+    @staticmethod
+    def _hedge_plan(models: List[str], max_output_tokens: Optional[int], latency_budget: Optional[float]) -> Tuple[Optional[float], str]:
+        """Seconds to wait before hedging the first model (None: never) and the model the hedge goes to."""
+        if LLM_HEDGE_PERCENTILE <= 0:
+            return None, models[0]
+        delay = latency_tracker.percentile(models[0], max_output_tokens, LLM_HEDGE_PERCENTILE, LLM_HEDGE_MIN_SAMPLES)
+        budget = latency_budget if latency_budget is not None else LLM_LATENCY_BUDGET_SECONDS
+        if budget:
+            delay = budget / 2 if delay is None else min(delay, budget / 2)
+        if delay is None:
+            return None, models[0]
+        # The hedge goes to the same model unless a ranked one is known to answer this kind of call faster
+        target = models[0]
+        best = latency_tracker.percentile(target, max_output_tokens, 50, LLM_HEDGE_MIN_SAMPLES)
+        for name in models[1:]:
+            median = latency_tracker.percentile(name, max_output_tokens, 50, LLM_HEDGE_MIN_SAMPLES)
+            if median is not None and (best is None or median < best):
+                target, best = name, median
+        return max(delay, LLM_HEDGE_MIN_DELAY_SECONDS), target
+
+    @staticmethod
+    def _hedge_won(s, model: str, role: str) -> None:
+        metrics.inc("travel_llm_hedge_wins_total", model=model, role=role)
+        if s is not None:
+            s.set(hedge_winner=role, answered_by=model)
+
+    @staticmethod
+    def _fell_back(name: str, reason: str) -> None:
+        metrics.inc("travel_llm_fallbacks_total", model=name, reason=reason)
+
+    def _call(self, name: str, prompt: str, generation_config: dict, stream: bool = False):
+        """
+        One generate_content call under the rate and concurrency limits, retried with jittered
+        backoff on 429s and transient server errors. A streamed response keeps its concurrency
+        slot; the caller releases it once the stream is drained.
+        """
+        model = self._model(name)
+        tokens = estimate_tokens(prompt)
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            rate_limiter.acquire(tokens)
+            concurrency_limiter.acquire()
+            start = time.monotonic()
             try:
-                self.model = genai.GenerativeModel(name)
-                response = self.model.generate_content(
-                    prompt,
-                    generation_config={
-                        "temperature": temperature,
-                        "max_output_tokens": max_output_tokens,
-                    },
-                )
-                # Robust text extraction even if response.text raises
-                try:
-                    text = response.text  # quick accessor
-                except Exception:
-                    text = ""
-                    try:
-                        if getattr(response, "candidates", None):
-                            parts = getattr(response.candidates[0].content, "parts", [])
-                            text = " ".join([getattr(p, "text", "") for p in parts if getattr(p, "text", "")])
-                    except Exception:
-                        text = ""
-                if text:
-                    return text
-                # If model replied but empty/blocked, continue to next candidate model
+                if stream:
+                    response = model.generate_content(prompt, generation_config=generation_config, stream=True)
+                else:
+                    response = model.generate_content(prompt, generation_config=generation_config)
+            except RETRYABLE_ERRORS as e:
+                concurrency_limiter.release(time.monotonic() - start, ok=False)
+                if attempt == LLM_MAX_RETRIES:
+                    raise
+                time.sleep(self._retry_delay(name, e, attempt + 1))
                 continue
+            except BaseException:
+                concurrency_limiter.release()
+                raise
+            if not stream:
+                elapsed = time.monotonic() - start
+                concurrency_limiter.release(elapsed)
+                latency_tracker.record(name, generation_config.get("max_output_tokens"), elapsed)
+            return response
+
+    async def _acall(self, name: str, prompt: str, generation_config: dict):
+        """Async counterpart of _call."""
+        model = self._model(name)
+        tokens = estimate_tokens(prompt)
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            await rate_limiter.aacquire(tokens)
+            await concurrency_limiter.aacquire()
+            start = time.monotonic()
+            try:
+                response = await model.generate_content_async(prompt, generation_config=generation_config)
+            except RETRYABLE_ERRORS as e:
+                concurrency_limiter.release(time.monotonic() - start, ok=False)
+                if attempt == LLM_MAX_RETRIES:
+                    raise
+                await asyncio.sleep(self._retry_delay(name, e, attempt + 1))
+                continue
+            except BaseException:
+                concurrency_limiter.release()
+                raise
+            elapsed = time.monotonic() - start
+            concurrency_limiter.release(elapsed)
+            latency_tracker.record(name, generation_config.get("max_output_tokens"), elapsed)
+            return response
+
+    @staticmethod
+    def _retry_delay(name: str, error: Exception, attempt: int) -> float:
+        delay = backoff_delay(attempt)
+        metrics.inc("travel_llm_retries_total", model=name, error=type(error).__name__)
+        s = current_span()
+        if s is not None:
+            s.set(retries=attempt)
+        logger.warning("Gemini %s failed with %s; retry %d in %.2fs", name, type(error).__name__, attempt, delay)
+        return delay
+
+    def _generate(self, prompt: str, temperature: float, max_output_tokens: Optional[int], models: Optional[List[str]] = None, latency_budget: Optional[float] = None) -> str:
+        models = self._ranked(models)
+        config = {"temperature": temperature, "max_output_tokens": max_output_tokens}
+        delay, hedge_model = self._hedge_plan(models, max_output_tokens, latency_budget)
+        if delay is None:
+            return self._cascade(models, prompt, config)[0]
+        return self._hedged(models, hedge_model, prompt, config, delay)
+
+    def _cascade(self, models: List[str], prompt: str, config: dict) -> Tuple[str, str]:
+        """Try each model in turn until one answers; returns (text, model that answered)."""
+        last_err: Optional[Exception] = None
+        for name in models:
+            try:
+                response = self._call(name, prompt, config)
             except NotFound as e:
                 last_err = e
+                self._fell_back(name, "not_found")
+                continue
+            except RETRYABLE_ERRORS as e:
+                # Still throttled or failing after the retries; another model has its own quota
+                last_err = e
+                self._fell_back(name, type(e).__name__)
                 continue
+            text = _response_text(response)
+            if text:
+                _record_usage(response, name, prompt, text)
+                rate_limiter.charge(_response_tokens(response, text))
+                return text, name
+            # If model replied but empty/blocked, continue to next candidate model
+            self._fell_back(name, "empty")
         if last_err:
             raise last_err
+        return "", models[-1]
+
+    def _hedged(self, models: List[str], hedge_model: str, prompt: str, config: dict, delay: float) -> str:
+        pool = _hedge_executor()
+        primary = pool.submit(bind_context(self._cascade, models, prompt, config))
+        done, _ = wait([primary], timeout=delay)
+        # Hedging while callers already queue for a slot would only add to the overload
+        if done or concurrency_limiter.stats()["queued"]:
+            return primary.result()[0]
+        s = current_span()
+        if s is not None:
+            s.set(hedged=True, hedge_model=hedge_model)
+        metrics.inc("travel_llm_hedges_total", model=models[0], hedge_model=hedge_model)
+        hedge = pool.submit(bind_context(self._cascade, [hedge_model], prompt, config))
+        roles = {primary: "primary", hedge: "hedge"}
+        pending = set(roles)
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                try:
+                    text, name = fut.result()
+                except Exception as e:
+                    error = error or e
+                    continue
+                if text:
+                    # A sync call already on the wire cannot be interrupted; its reply is dropped
+                    for loser in pending:
+                        loser.cancel()
+                    self._hedge_won(s, name, roles[fut])
+                    return text
+        if error is not None:
+            raise error
         return ""
 
-    def extract_json(self, prompt: str, temperature: float = 0.0, max_output_tokens: Optional[int] = 2000) -> dict:
+    def generate_stream(self, prompt: str, temperature: float = 0.4, max_output_tokens: Optional[int] = 2000) -> Iterator[str]:
+        """
+        Yield text chunks as the model produces them. Blocked or empty chunks are skipped;
+        if a model yields nothing at all, the next candidate model is tried like in generate.
+        """
+        # A generator runs in its consumer's context, so the span is ended by hand rather than made current
+        s = start_span("gemini.generate_stream", model=self.model_name, prompt_chars=len(prompt), temperature=temperature)
+        metrics.inc("travel_llm_requests_total", model=self.model_name, cache="off")
+        error: Optional[BaseException] = None
+        try:
+            last_err: Optional[Exception] = None
+            for name in self._retry_models():
+                start = time.perf_counter()
+                yielded = False
+                received: List[str] = []
+                last_chunk = None
+                try:
+                    response = self._call(name, prompt, {
+                        "temperature": temperature,
+                        "max_output_tokens": max_output_tokens,
+                    }, stream=True)
+                except NotFound as e:
+                    last_err = e
+                    self._fell_back(name, "not_found")
+                    continue
+                except RETRYABLE_ERRORS as e:
+                    last_err = e
+                    self._fell_back(name, type(e).__name__)
+                    continue
+                # The slot is held until the stream is drained; time to first token is the latency signal
+                ttft: Optional[float] = None
+                ok = True
+                try:
+                    for chunk in response:
+                        last_chunk = chunk
+                        text = _response_text(chunk)
+                        if not text:
+                            continue
+                        if not yielded:
+                            ttft = time.perf_counter() - start
+                            record_ttft(ttft)
+                            s.set(ttft_ms=ttft * 1000)
+                            yielded = True
+                        received.append(text)
+                        yield text
+                except RETRYABLE_ERRORS:
+                    ok = False
+                    raise
+                except NotFound as e:
+                    if yielded:
+                        raise
+                    last_err = e
+                    continue
+                finally:
+                    concurrency_limiter.release(ttft if ok else time.perf_counter() - start, ok)
+                if yielded:
+                    # The final chunk carries the usage totals for the whole stream
+                    text = "".join(received)
+                    _record_usage(last_chunk, name, prompt, text, s)
+                    rate_limiter.charge(_response_tokens(last_chunk, text))
+                    return
+            if last_err:
+                raise last_err
+        except BaseException as e:
+            error = e if not isinstance(e, GeneratorExit) else None
+            raise
+        finally:
+            end_span(s, error)
+
+    def extract_json(self, prompt: str, temperature: float = 0.0, max_output_tokens: Optional[int] = 2000, cache: bool = False, latency_budget: Optional[float] = None, models: Optional[List[str]] = None) -> dict:
         """
         Generate a response and parse it as JSON. Returns an empty dict if parsing fails.
         """
-        text = self.generate(prompt, temperature=temperature, max_output_tokens=max_output_tokens)
-        if not text:
-            return {}
-        
-        # Clean up the text - remove markdown code blocks if present
-        text = text.strip()
-        if text.startswith("```"):
-            # Remove ```json or ``` markers
-            lines = text.split("\n")
-            if lines[0].startswith("```"):
-                lines = lines[1:]
-            if lines and lines[-1].strip() == "```":
-                lines = lines[:-1]
-            text = "\n".join(lines).strip()
-        
-        # Try to parse JSON
+        text = self.generate(prompt, temperature=temperature, max_output_tokens=max_output_tokens, cache=cache, latency_budget=latency_budget, models=models)
+        return parse_json_reply(text)
+
+    async def agenerate(
+        self,
+        prompt: str,
+        temperature: float = 0.4,
+        max_output_tokens: Optional[int] = 2000,
+        cache: bool = False,
+        latency_budget: Optional[float] = None,
+        models: Optional[List[str]] = None,
+    ) -> str:
+        """Async counterpart of generate; awaits the SDK's async transport instead of blocking a thread."""
+        models = self._ranked(models)
+        with span("gemini.generate", model=models[0], prompt_chars=len(prompt), temperature=temperature) as s:
+            key = make_cache_key(models[0], prompt, temperature, max_output_tokens)
+            if cache:
+                cached = get_response_cache().get(key)
+                if cached is not None:
+                    s.set(cache="hit", response_chars=len(cached))
+                    metrics.inc("travel_llm_requests_total", model=models[0], cache="hit")
+                    return cached
+            text, shared = await _llm_flight.ado(key, lambda: self._agenerate(prompt, temperature, max_output_tokens, models, latency_budget))
+            return self._settle(s, models[0], key, text, shared, cache)
+
+    async def _agenerate(self, prompt: str, temperature: float, max_output_tokens: Optional[int], models: Optional[List[str]] = None, latency_budget: Optional[float] = None) -> str:
+        models = self._ranked(models)
+        config = {"temperature": temperature, "max_output_tokens": max_output_tokens}
+        delay, hedge_model = self._hedge_plan(models, max_output_tokens, latency_budget)
+        if delay is None:
+            return (await self._acascade(models, prompt, config))[0]
+        return await self._ahedged(models, hedge_model, prompt, config, delay)
+
+    async def _acascade(self, models: List[str], prompt: str, config: dict) -> Tuple[str, str]:
+        last_err: Optional[Exception] = None
+        for name in models:
+            try:
+                response = await self._acall(name, prompt, config)
+            except NotFound as e:
+                last_err = e
+                self._fell_back(name, "not_found")
+                continue
+            except RETRYABLE_ERRORS as e:
+                last_err = e
+                self._fell_back(name, type(e).__name__)
+                continue
+            text = _response_text(response)
+            if text:
+                _record_usage(response, name, prompt, text)
+                rate_limiter.charge(_response_tokens(response, text))
+                return text, name
+            self._fell_back(name, "empty")
+        if last_err:
+            raise last_err
+        return "", models[-1]
+
+    async def _ahedged(self, models: List[str], hedge_model: str, prompt: str, config: dict, delay: float) -> str:
+        primary = asyncio.ensure_future(self._acascade(models, prompt, config))
+        roles = {primary: "primary"}
         try:
-            return json.loads(text)
-        except (json.JSONDecodeError, ValueError):
-            # If JSON parsing fails, try to extract JSON object from the text
-            # Look for {...} pattern with better nested handling
-            # Try to find the first { and matching }
-            start = text.find('{')
-            if start != -1:
-                depth = 0
-                for i in range(start, len(text)):
-                    if text[i] == '{':
-                        depth += 1
-                    elif text[i] == '}':
-                        depth -= 1
-                        if depth == 0:
-                            try:
-                                return json.loads(text[start:i+1])
-                            except (json.JSONDecodeError, ValueError):
-                                break
-            return {}
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done or concurrency_limiter.stats()["queued"]:
+                return (await primary)[0]
+            s = current_span()
+            if s is not None:
+                s.set(hedged=True, hedge_model=hedge_model)
+            metrics.inc("travel_llm_hedges_total", model=models[0], hedge_model=hedge_model)
+            roles[asyncio.ensure_future(self._acascade([hedge_model], prompt, config))] = "hedge"
+            pending = set(roles)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = error or task.exception()
+                        continue
+                    text, name = task.result()
+                    if text:
+                        self._hedge_won(s, name, roles[task])
+                        return text
+            if error is not None:
+                raise error
+            return ""
+        finally:
+            # Cancelling the loser aborts its request and frees its concurrency slot
+            for task in roles:
+                if not task.done():
+                    task.cancel()
+
+    async def aextract_json(self, prompt: str, temperature: float = 0.0, max_output_tokens: Optional[int] = 2000, cache: bool = False, latency_budget: Optional[float] = None, models: Optional[List[str]] = None) -> dict:
+        text = await self.agenerate(prompt, temperature=temperature, max_output_tokens=max_output_tokens, cache=cache, latency_budget=latency_budget, models=models)
+        return parse_json_reply(text)
+
+
+def parse_json_reply(text: str) -> dict:
+    """
+    Parse a model reply as JSON, tolerating markdown code fences and surrounding prose.
+    Returns an empty dict if parsing fails.
+    """
+    if not text:
+        return {}
+    
+    # Clean up the text - remove markdown code blocks if present
+    text = text.strip()
+    if text.startswith("```"):
+        # Remove ```json or ``` markers
+        lines = text.split("\n")
+        if lines[0].startswith("```"):
+            lines = lines[1:]
+        if lines and lines[-1].strip() == "```":
+            lines = lines[:-1]
+        text = "\n".join(lines).strip()
+    
+    # Try to parse JSON
+    try:
+        return json.loads(text)
+    except (json.JSONDecodeError, ValueError):
+        # If JSON parsing fails, try to extract JSON object from the text
+        # Look for {...} pattern with better nested handling
+        # Try to find the first { and matching }
+        start = text.find('{')
+        if start != -1:
+            depth = 0
+            for i in range(start, len(text)):
+                if text[i] == '{':
+                    depth += 1
+                elif text[i] == '}':
+                    depth -= 1
+                    if depth == 0:
+                        try:
+                            return json.loads(text[start:i+1])
+                        except (json.JSONDecodeError, ValueError):
+                            break
+        return {}
+
+
+## process-wide client registry, keyed by (api_key, model_name)
+_registry_lock = threading.Lock()
+_clients: Dict[Tuple[str, str], GeminiClient] = {}
+_registry_stats = {"hits": 0, "created": 0, "create_seconds": 0.0}
+
+
+def get_client(api_key: str, model_name: str = "gemini-2.5-flash") -> GeminiClient:
+    """
+    Return the shared GeminiClient for this key and model, creating it on first use.
+    Clients, their model objects and the SDK transport are reused across requests and sessions.
+    """
+    key = (api_key or os.getenv("GEMINI_API_KEY", ""), model_name)
+    client = _clients.get(key)
+    if client is not None:
+        with _registry_lock:
+            _registry_stats["hits"] += 1
+        return client
+    with _registry_lock:
+        client = _clients.get(key)
+        if client is not None:
+            _registry_stats["hits"] += 1
+            return client
+        start = time.perf_counter()
+        client = GeminiClient(*key)
+        _clients[key] = client
+        _registry_stats["created"] += 1
+        _registry_stats["create_seconds"] += time.perf_counter() - start
+        return client
+
+
+def client_registry_stats() -> dict:
+    with _registry_lock:
+        stats = dict(_registry_stats)
+        stats["clients"] = len(_clients)
+    total = stats["hits"] + stats["created"]
+    stats["hit_rate"] = stats["hits"] / total if total else 0.0
+    return stats
+
+
+def shutdown_clients() -> None:
+    """Close every pooled client's transport and empty the registry."""
+    global _configured_key
+    with _registry_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        client.close()
+    with _configure_lock:
+        _configured_key = None
 
 
+atexit.register(shutdown_clients)
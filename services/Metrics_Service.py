@@ -0,0 +1,314 @@
+import os
+import sys
+import warnings
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+warnings.filterwarnings("ignore")
+
+import bisect
+import contextvars
+import functools
+import inspect
+import itertools
+import json
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from config import TRACE_LOG_PATH
+
+
+## spans: one per pipeline step, nested through a context variable (threads need bind_context)
+
+_span_ids = itertools.count(1)
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+_collector: contextvars.ContextVar[Optional[List["Span"]]] = contextvars.ContextVar("span_collector", default=None)
+
+
+class Span:
+    __slots__ = ("name", "attrs", "trace_id", "span_id", "parent_id", "start", "duration_ms", "error", "_t0", "_collector")
+
+    def __init__(self, name: str, attrs: dict, parent: Optional["Span"]) -> None:
+        self.name = name
+        self.attrs = attrs
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex[:16]
+        self.span_id = next(_span_ids)
+        self.parent_id = parent.span_id if parent else None
+        self.start = time.time()
+        self.duration_ms: Optional[float] = None
+        self.error: Optional[str] = None
+        self._t0 = time.perf_counter()
+        self._collector = _collector.get()
+
+    def set(self, **attrs) -> None:
+        self.attrs.update(attrs)
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": self.duration_ms,
+            "error": self.error,
+            "attrs": self.attrs,
+        }
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def start_span(name: str, **attrs) -> Span:
+    """Open a span under the current one without making it current (for generators and callbacks)."""
+    return Span(name, attrs, _current_span.get())
+
+
+def end_span(span: Span, error: Optional[BaseException] = None) -> None:
+    span.duration_ms = (time.perf_counter() - span._t0) * 1000
+    if error is not None:
+        span.error = f"{type(error).__name__}: {error}"
+        metrics.inc("travel_span_errors_total", span=span.name)
+    metrics.observe("travel_span_duration_seconds", span.duration_ms / 1000, span=span.name)
+    if span._collector is not None:
+        span._collector.append(span)
+    if _sink is not None:
+        _sink.write(span)
+
+
+@contextmanager
+def use_span(s: Span) -> Iterator[Span]:
+    """Make a span opened with start_span current for the block, e.g. while a generator pulls its next item."""
+    token = _current_span.set(s)
+    try:
+        yield s
+    finally:
+        _current_span.reset(token)
+
+
+@contextmanager
+def span(name: str, **attrs) -> Iterator[Span]:
+    s = start_span(name, **attrs)
+    token = _current_span.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        end_span(s, e)
+        raise
+    else:
+        end_span(s)
+    finally:
+        _current_span.reset(token)
+
+
+def traced(name: Optional[str] = None) -> Callable:
+    """Decorator: run each call of a sync or async function inside a span (default name: the function's)."""
+    def decorate(fn: Callable) -> Callable:
+        span_name = name or fn.__name__
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def bind_context(fn: Callable, *args) -> Callable[[], object]:
+    """Wrap a call for a worker thread so its spans nest under the submitting request's span."""
+    return functools.partial(contextvars.copy_context().run, fn, *args)
+
+
+@contextmanager
+def collect_spans() -> Iterator[List[Span]]:
+    """Gather every span started inside the block (including bound worker threads) as it finishes."""
+    spans: List[Span] = []
+    token = _collector.set(spans)
+    try:
+        yield spans
+    finally:
+        _collector.reset(token)
+
+
+def span_breakdown(spans: List[Span]) -> List[Tuple[str, float]]:
+    """(indented name, ms) rows in start order, children under their parents."""
+    by_parent: Dict[Optional[int], List[Span]] = {}
+    ids = {s.span_id for s in spans}
+    for s in sorted(spans, key=lambda s: s.start):
+        parent = s.parent_id if s.parent_id in ids else None
+        by_parent.setdefault(parent, []).append(s)
+    rows: List[Tuple[str, float]] = []
+
+    def walk(parent: Optional[int], depth: int) -> None:
+        for s in by_parent.get(parent, []):
+            rows.append(("  " * depth + s.name, s.duration_ms or 0.0))
+            walk(s.span_id, depth + 1)
+
+    walk(None, 0)
+    return rows
+
+
+class JsonlSink:
+    """Appends finished spans to a JSON lines file."""
+
+    def __init__(self, path: str) -> None:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._f = open(path, "a", encoding="utf-8")
+
+    def write(self, span: Span) -> None:
+        line = json.dumps(span.to_dict(), ensure_ascii=False, default=str)
+        with self._lock:
+            self._f.write(line + "\n")
+            self._f.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            self._f.close()
+
+
+_sink: Optional[JsonlSink] = JsonlSink(TRACE_LOG_PATH) if TRACE_LOG_PATH else None
+
+
+def set_trace_sink(path: Optional[str]) -> None:
+    """Write finished spans to ``path`` as JSON lines (``None`` turns the sink off)."""
+    global _sink
+    old, _sink = _sink, (JsonlSink(path) if path else None)
+    if old is not None:
+        old.close()
+
+
+## metrics: counters, gauges and fixed-bucket histograms, exported in the Prometheus text format
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_HELP = {
+    "travel_span_duration_seconds": "Wall time of each traced pipeline step.",
+    "travel_span_errors_total": "Traced pipeline steps that raised.",
+    "travel_llm_requests_total": "Gemini generate calls, by model and cache outcome.",
+    "travel_llm_prompt_chars_total": "Characters sent to Gemini.",
+    "travel_llm_response_chars_total": "Characters received from Gemini.",
+    "travel_llm_tokens_total": "Tokens reported by Gemini usage metadata, by kind.",
+    "travel_prompt_tokens_total": "Prompt tokens sent for replies (local estimate unless TOKEN_COUNTER=api), by intent.",
+    "travel_prompt_context_tokens_total": "Estimated context tokens as verbose rows and as compact tables (PROMPT_TOKEN_STATS).",
+    "travel_dataset_reloads_total": "Dataset files re-ingested after a change, by dataset and mode (append or full).",
+    "travel_dataset_rows_added_total": "Rows added to the served datasets by refreshes.",
+    "travel_dataset_reload_seconds": "Time to ingest a changed dataset file.",
+    "travel_ingest_rows_total": "Rows parsed from dataset CSVs by the chunked reader.",
+    "travel_ingest_seconds": "Time to parse a dataset CSV (or its appended rows).",
+    "travel_coalesced_calls_total": "Model calls and retrievals by single-flight role; follower / total is the coalesce ratio.",
+    "travel_llm_retries_total": "Gemini calls retried after throttling or a transient server error, by model and error.",
+    "travel_llm_throttled_total": "Gemini calls held back client-side, by limiter (requests, tokens or concurrency).",
+    "travel_llm_concurrency_limit": "Current adaptive (AIMD) limit on concurrent Gemini calls.",
+    "travel_llm_in_flight": "Gemini calls currently holding a concurrency slot.",
+    "travel_llm_queue_depth": "Gemini calls waiting for a concurrency slot.",
+    "travel_llm_fallbacks_total": "Gemini calls passed on to the next ranked model, by model and reason.",
+    "travel_llm_hedges_total": "Gemini calls raced against a hedged second request, by model and hedge model.",
+    "travel_llm_hedge_wins_total": "Hedged Gemini calls by the model and role (primary or hedge) that answered first.",
+    "travel_http_request_seconds": "Requests served by the JSON API (server.py), by route and status.",
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class MetricsRegistry:
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._gauges: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, List[float]]] = {}
+
+    def inc(self, name: str, value: float = 1.0, **labels) -> None:
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def set(self, name: str, value: float, **labels) -> None:
+        """Set a gauge to its current value."""
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            self._gauges.setdefault(name, {})[key] = float(value)
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            # per-bucket counts, the overflow bucket, then sum and count
+            h = series.get(key)
+            if h is None:
+                h = series[key] = [0.0] * (len(self.buckets) + 3)
+            h[bisect.bisect_left(self.buckets, value)] += 1
+            h[-2] += value
+            h[-1] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counters = {n: {k: v for k, v in s.items()} for n, s in self._counters.items()}
+            gauges = {n: {k: v for k, v in s.items()} for n, s in self._gauges.items()}
+            histograms = {n: {k: list(h) for k, h in s.items()} for n, s in self._histograms.items()}
+        return {"counters": counters, "gauges": gauges, "histograms": histograms}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+    def prometheus_text(self) -> str:
+        snap = self.snapshot()
+        lines: List[str] = []
+
+        def fmt(labels: Labels, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+        for kind, group in (("counter", "counters"), ("gauge", "gauges")):
+            for name in sorted(snap[group]):
+                if name in _HELP:
+                    lines.append(f"# HELP {name} {_HELP[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in sorted(snap[group][name].items()):
+                    lines.append(f"{name}{fmt(labels)} {value:g}")
+        for name in sorted(snap["histograms"]):
+            if name in _HELP:
+                lines.append(f"# HELP {name} {_HELP[name]}")
+            lines.append(f"# TYPE {name} histogram")
+            for labels, h in sorted(snap["histograms"][name].items()):
+                cumulative = 0.0
+                for bound, count in zip(self.buckets, h):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{fmt(labels, (('le', f'{bound:g}'),))} {cumulative:g}")
+                lines.append(f"{name}_bucket{fmt(labels, (('le', '+Inf'),))} {h[-1]:g}")
+                lines.append(f"{name}_sum{fmt(labels)} {h[-2]:g}")
+                lines.append(f"{name}_count{fmt(labels)} {h[-1]:g}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+
+def write_prometheus_snapshot(path: str) -> None:
+    """Write the current metrics in the Prometheus text exposition format (atomically)."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(metrics.prometheus_text())
+    os.replace(tmp, path)
@@ -0,0 +1,73 @@
+import os
+import sys
+import warnings
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+warnings.filterwarnings("ignore")
+
+import logging
+import re
+from typing import Optional
+
+from config import DEFAULT_MAX_OUTPUT_TOKENS, MAX_OUTPUT_TOKENS, PROMPT_TOKEN_STATS, TOKEN_COUNTER
+from services.Metrics_Service import current_span, metrics
+
+logger = logging.getLogger(__name__)
+
+# Words, single digits (Gemini splits numbers digit by digit) and single symbols
+_PIECES = re.compile(r"[^\W\d_]+|\d|[^\w\s]")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Local approximation of the Gemini token count: one token per digit or symbol, and one per
+    word up to 6 characters plus one for every 6 after that (long or rare words split into pieces).
+    """
+    return sum(1 + (len(p) - 1) // 6 for p in _PIECES.findall(text))
+
+
+def count_tokens(text: str, client=None) -> int:
+    """Prompt tokens from the Gemini counter when TOKEN_COUNTER is "api" and it answers, else the local estimate."""
+    if TOKEN_COUNTER == "api" and client is not None:
+        counted = client.count_tokens(text)
+        if counted is not None:
+            return counted
+    return estimate_tokens(text)
+
+
+def output_limit(intent: Optional[str]) -> int:
+    return MAX_OUTPUT_TOKENS.get(intent or "", DEFAULT_MAX_OUTPUT_TOKENS)
+
+
+_stats_enabled = PROMPT_TOKEN_STATS
+
+
+def set_token_stats(enabled: bool) -> None:
+    """Measure every context block in both renderings (costs a second render per block)."""
+    global _stats_enabled
+    _stats_enabled = enabled
+
+
+def token_stats_enabled() -> bool:
+    return _stats_enabled or logger.isEnabledFor(logging.DEBUG)
+
+
+def record_context_tokens(verbose: str, compact: str) -> None:
+    before, after = estimate_tokens(verbose), estimate_tokens(compact)
+    metrics.inc("travel_prompt_context_tokens_total", before, form="verbose")
+    metrics.inc("travel_prompt_context_tokens_total", after, form="compact")
+    s = current_span()
+    if s is not None:
+        s.set(context_tokens_before=s.attrs.get("context_tokens_before", 0) + before,
+              context_tokens_after=s.attrs.get("context_tokens_after", 0) + after)
+    logger.info("Context tokens: %d -> %d (%.0f%% saved)", before, after, 100.0 * (before - after) / before if before else 0.0)
+
+
+def record_prompt_tokens(intent: Optional[str], prompt: str, max_output_tokens: int, client=None) -> int:
+    tokens = count_tokens(prompt, client)
+    metrics.inc("travel_prompt_tokens_total", tokens, intent=intent or "other")
+    s = current_span()
+    if s is not None:
+        s.set(prompt_tokens_est=tokens, max_output_tokens=max_output_tokens)
+    logger.debug("Prompt for %s: %d tokens, output capped at %d", intent or "other", tokens, max_output_tokens)
+    return tokens
@@ -6,18 +6,25 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 warnings.filterwarnings("ignore")
 
 import re
-from dataclasses import dataclass
-from typing import Optional
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple, Union
 
 from rapidfuzz import fuzz
 
-from services.Gemini_Service import GeminiClient
+from services.Gemini_Service import get_client
+from services.Metrics_Service import traced
 from config import (
     PROMPT_EXTRACT_HOTEL_PARAMS,
     PROMPT_EXTRACT_BUS_PARAMS,
     PROMPT_EXTRACT_FLIGHT_PARAMS,
     PROMPT_EXTRACT_ATTRACTION_PARAMS,
-    PROMPT_EXTRACT_ITINERARY_PARAMS
+    PROMPT_EXTRACT_ITINERARY_PARAMS,
+    PROMPT_ROUTE,
+    FAST_PATH_CONFIDENCE,
+    CITY_ALIASES,
+    DEFAULT_SORT,
+    MAX_OUTPUT_TOKENS,
 )
 
 def normalize_message(msg: str) -> str:
@@ -43,19 +50,33 @@ def detect_intent(text: str) -> str:
     t = text.lower()
     if re.search(r"\b(hi|hello|hey|good\s*(morning|evening|night))\b", t):
         return "greeting"
-    if "itinerary" in t or "iternary" in t or re.search(r"\bplan\b.*\bday", t):
-        return "itinerary"
-    if "flight" in t or "airline" in t:
-        return "flight"
-    if "bus" in t or "sleeper" in t or "coach" in t:
-        return "bus"
-    if "hotel" in t or "stay" in t or "lodge" in t:
-        return "hotel"
-    if "place" in t or "visit" in t or "things to do" in t:
-        return "attractions"
+    # Same whole-word keywords as the fast path, so "business" or "coaching" is not a bus
+    for label, pat in _INTENT_KEYWORDS.items():
+        if re.search(pat, t):
+            return label
     return "unknown"
 
 
+_SORT_PATTERNS = (
+    ("fastest", r"\b(fastest|quickest|shortest|least time|less time|quick|fast)\b"),
+    ("best_rated", r"\b(best|top|highest)[\s-]*(rated|reviewed)\b|\bbest\b|\bhighest rating\b"),
+    ("earliest", r"\b(earliest|soonest|early morning|first (bus|flight|departure)|leaves? early)\b"),
+    ("cheapest", r"\b(cheapest|cheap|lowest price|budget|affordable)\b"),
+)
+
+
+def requested_sort_mode(text: str) -> Optional[str]:
+    """The result ordering the user explicitly asked for, if any; the earliest matching phrase wins."""
+    t = text.lower()
+    found = [(m.start(), mode) for mode, pattern in _SORT_PATTERNS for m in [re.search(pattern, t)] if m]
+    return min(found)[1] if found else None
+
+
+def detect_sort_mode(text: str) -> str:
+    """Pick the result ordering the user asked for, cheapest by default."""
+    return requested_sort_mode(text) or DEFAULT_SORT
+
+
 def parse_budget(text: str) -> Optional[int]:
     m = re.search(r"(?:under|upto|up to|budget)\s*₹?\s*([\d,]+)", text, flags=re.I)
     if not m:
@@ -99,117 +120,177 @@ class ItineraryQuery:
     budget: Optional[int] = None
 
 
-def extract_bus_params_gemini(user_msg: str, api_key: str, model_name: str = "gemini-2.5-flash") -> RouteQuery:
-    """Extract bus query parameters using Gemini."""
-    client = GeminiClient(api_key, model_name)
-    prompt = PROMPT_EXTRACT_BUS_PARAMS.format(user_message=user_msg)
-    result = client.extract_json(prompt, temperature=0.0)
-    
-    source = result.get("source", "").strip() if result.get("source") else None
-    destination = result.get("destination", "").strip() if result.get("destination") else None
-    budget = None
-    if result.get("budget") is not None:
+INTENT_LABELS = ("greeting", "bus", "flight", "hotel", "attractions", "itinerary", "unknown")
+
+
+@dataclass
+class RoutedQuery:
+    intent: str
+    params: Union[RouteQuery, HotelQuery, ItineraryQuery, str, None] = None
+    # The local parse routing already tried (and counted) when it fell back to Gemini
+    local: Optional["LocalParse"] = field(default=None, repr=False, compare=False)
+
+
+def _parse_budget_value(value, default: int = 10000) -> int:
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except (ValueError, TypeError):
+        return default
+
+
+def _parse_num_days(value, user_msg: str) -> int:
+    if value is not None:
         try:
-            budget = int(result.get("budget"))
+            return int(value)
         except (ValueError, TypeError):
-            # Fallback to regex parsing
-            budget = 10000
-    else:
-        budget = 10000
+            pass
+    # Fallback to regex
+    m_days = re.search(r"(\d+)\s*-?\s*day", user_msg, flags=re.I)
+    if m_days:
+        return int(m_days.group(1))
+    return 3
+
 
-    return RouteQuery(source=source, destination=destination, budget=budget)
+def _clean_str(result: dict, key: str) -> Optional[str]:
+    return result.get(key, "").strip() if result.get(key) else None
 
 
+def _route_query_from_json(result: dict) -> RouteQuery:
+    return RouteQuery(
+        source=_clean_str(result, "source"),
+        destination=_clean_str(result, "destination"),
+        budget=_parse_budget_value(result.get("budget")),
+    )
+
+
+def _hotel_query_from_json(result: dict) -> HotelQuery:
+    return HotelQuery(city=_clean_str(result, "city"), budget=_parse_budget_value(result.get("budget")))
+
+
+def _attraction_city_from_json(result: dict, user_msg: str) -> Optional[str]:
+    city = _clean_str(result, "city")
+    if not city:
+        # Fallback to regex parsing
+        city = extract_city_only(user_msg)
+    return city
+
+
+def _itinerary_query_from_json(result: dict, user_msg: str) -> ItineraryQuery:
+    return ItineraryQuery(
+        num_days=_parse_num_days(result.get("num_days"), user_msg),
+        source=_clean_str(result, "source"),
+        destination=_clean_str(result, "destination"),
+        budget=_parse_budget_value(result.get("budget")),
+    )
+
+
+@traced()
+def extract_bus_params_gemini(user_msg: str, api_key: str, model_name: str = "gemini-2.5-flash") -> RouteQuery:
+    """Extract bus query parameters using Gemini."""
+    client = get_client(api_key, model_name)
+    prompt = PROMPT_EXTRACT_BUS_PARAMS.format(user_message=user_msg)
+    result = client.extract_json(prompt, temperature=0.0, max_output_tokens=MAX_OUTPUT_TOKENS["extract"], cache=True)
+    return _route_query_from_json(result)
+
+
+@traced()
 def extract_flight_params_gemini(user_msg: str, api_key: str, model_name: str = "gemini-2.5-flash") -> RouteQuery:
     """Extract flight query parameters using Gemini."""
-    
-    client = GeminiClient(api_key, model_name)
+    client = get_client(api_key, model_name)
     prompt = PROMPT_EXTRACT_FLIGHT_PARAMS.format(user_message=user_msg)
-    result = client.extract_json(prompt, temperature=0.0)
-    
-    source = result.get("source", "").strip() if result.get("source") else None
-    destination = result.get("destination", "").strip() if result.get("destination") else None
-    budget = None
-    if result.get("budget") is not None:
-        try:
-            budget = int(result.get("budget"))
-        except (ValueError, TypeError):
-            budget = 10000
-    else:
-        budget = 10000
-    
-    return RouteQuery(source=source, destination=destination, budget=budget)
+    result = client.extract_json(prompt, temperature=0.0, max_output_tokens=MAX_OUTPUT_TOKENS["extract"], cache=True)
+    return _route_query_from_json(result)
 
 
+@traced()
 def extract_hotel_params_gemini(user_msg: str, api_key: str, model_name: str = "gemini-2.5-flash") -> HotelQuery:
     """Extract hotel query parameters using Gemini."""
-    
-    client = GeminiClient(api_key, model_name)
+    client = get_client(api_key, model_name)
     prompt = PROMPT_EXTRACT_HOTEL_PARAMS.format(user_message=user_msg)
-    result = client.extract_json(prompt, temperature=0.0)
-    
-    city = result.get("city", "").strip() if result.get("city") else None
-    budget = None
-    if result.get("budget") is not None:
-        try:
-            budget = int(result.get("budget"))
-        except (ValueError, TypeError):
-            budget = 10000
-    else:
-        budget = 10000
-    
-    return HotelQuery(city=city, budget=budget)
+    result = client.extract_json(prompt, temperature=0.0, max_output_tokens=MAX_OUTPUT_TOKENS["extract"], cache=True)
+    return _hotel_query_from_json(result)
 
 
+@traced()
 def extract_attraction_params_gemini(user_msg: str, api_key: str, model_name: str = "gemini-2.5-flash") -> Optional[str]:
     """Extract city for attractions query using Gemini."""
-    
-    client = GeminiClient(api_key, model_name)
+    client = get_client(api_key, model_name)
     prompt = PROMPT_EXTRACT_ATTRACTION_PARAMS.format(user_message=user_msg)
-    result = client.extract_json(prompt, temperature=0.0)
-    
-    city = result.get("city", "").strip() if result.get("city") else None
-    if not city:
-        # Fallback to regex parsing
-        city = extract_city_only(user_msg)
-    return city
+    result = client.extract_json(prompt, temperature=0.0, max_output_tokens=MAX_OUTPUT_TOKENS["extract"], cache=True)
+    return _attraction_city_from_json(result, user_msg)
 
 
+@traced()
 def extract_itinerary_params_gemini(user_msg: str, api_key: str, model_name: str = "gemini-2.5-flash") -> ItineraryQuery:
     """Extract itinerary query parameters using Gemini."""
-    
-    client = GeminiClient(api_key, model_name)
+    client = get_client(api_key, model_name)
     prompt = PROMPT_EXTRACT_ITINERARY_PARAMS.format(user_message=user_msg)
-    result = client.extract_json(prompt, temperature=0.0)
-    
-    source = result.get("source", "").strip() if result.get("source") else None
-    destination = result.get("destination", "").strip() if result.get("destination") else None
-    
-    num_days = 3
-    if result.get("num_days") is not None:
-        try:
-            num_days = int(result.get("num_days"))
-        except (ValueError, TypeError):
-            # Fallback to regex
-            m_days = re.search(r"(\d+)\s*-?\s*day", user_msg, flags=re.I)
-            if m_days:
-                num_days = int(m_days.group(1))
-    else:
-        m_days = re.search(r"(\d+)\s*-?\s*day", user_msg, flags=re.I)
-        if m_days:
-            num_days = int(m_days.group(1))
-    
-    budget = None
-    if result.get("budget") is not None:
-        try:
-            budget = int(result.get("budget"))
-        except (ValueError, TypeError):
-            budget = 10000
-    else:
-        budget = 10000
+    result = client.extract_json(prompt, temperature=0.0, max_output_tokens=MAX_OUTPUT_TOKENS["extract"], cache=True)
+    return _itinerary_query_from_json(result, user_msg)
+
+
+@traced()
+def extract_route_params_gemini(user_msg: str, api_key: str, model_name: str = "gemini-2.5-flash") -> Optional[RoutedQuery]:
+    """
+    Classify the intent and extract its parameters in a single Gemini call.
+    Returns None if the model reply is not usable, so callers can fall back.
+    """
+    client = get_client(api_key, model_name)
+    prompt = PROMPT_ROUTE.format(user_message=user_msg)
+    result = client.extract_json(prompt, temperature=0.0, max_output_tokens=MAX_OUTPUT_TOKENS["extract"], cache=True)
+    return _routed_from_json(result, user_msg)
+
+
+def _routed_from_json(result: dict, user_msg: str) -> Optional[RoutedQuery]:
+    intent = str(result.get("intent") or "").strip().lower()
+    if intent not in INTENT_LABELS:
+        return None
+    if intent in ("bus", "flight"):
+        return RoutedQuery(intent, _route_query_from_json(result))
+    if intent == "hotel":
+        return RoutedQuery(intent, _hotel_query_from_json(result))
+    if intent == "attractions":
+        return RoutedQuery(intent, _attraction_city_from_json(result, user_msg))
+    if intent == "itinerary":
+        return RoutedQuery(intent, _itinerary_query_from_json(result, user_msg))
+    return RoutedQuery(intent)
+
+
+async def _aextract(user_msg: str, api_key: str, model_name: str, template: str) -> dict:
+    client = get_client(api_key, model_name)
+    return await client.aextract_json(template.format(user_message=user_msg), temperature=0.0, max_output_tokens=MAX_OUTPUT_TOKENS["extract"], cache=True)
+
+
+@traced()
+async def aextract_bus_params_gemini(user_msg: str, api_key: str, model_name: str = "gemini-2.5-flash") -> RouteQuery:
+    return _route_query_from_json(await _aextract(user_msg, api_key, model_name, PROMPT_EXTRACT_BUS_PARAMS))
+
+
+@traced()
+async def aextract_flight_params_gemini(user_msg: str, api_key: str, model_name: str = "gemini-2.5-flash") -> RouteQuery:
+    return _route_query_from_json(await _aextract(user_msg, api_key, model_name, PROMPT_EXTRACT_FLIGHT_PARAMS))
+
 
-    # Add budget to ItineraryQuery dataclass if needed
-    return ItineraryQuery(num_days=num_days, source=source, destination=destination, budget=budget)
+@traced()
+async def aextract_hotel_params_gemini(user_msg: str, api_key: str, model_name: str = "gemini-2.5-flash") -> HotelQuery:
+    return _hotel_query_from_json(await _aextract(user_msg, api_key, model_name, PROMPT_EXTRACT_HOTEL_PARAMS))
+
+
+@traced()
+async def aextract_attraction_params_gemini(user_msg: str, api_key: str, model_name: str = "gemini-2.5-flash") -> Optional[str]:
+    return _attraction_city_from_json(await _aextract(user_msg, api_key, model_name, PROMPT_EXTRACT_ATTRACTION_PARAMS), user_msg)
+
+
+@traced()
+async def aextract_itinerary_params_gemini(user_msg: str, api_key: str, model_name: str = "gemini-2.5-flash") -> ItineraryQuery:
+    return _itinerary_query_from_json(await _aextract(user_msg, api_key, model_name, PROMPT_EXTRACT_ITINERARY_PARAMS), user_msg)
+
+
+@traced()
+async def aextract_route_params_gemini(user_msg: str, api_key: str, model_name: str = "gemini-2.5-flash") -> Optional[RoutedQuery]:
+    return _routed_from_json(await _aextract(user_msg, api_key, model_name, PROMPT_ROUTE), user_msg)
 
 
 def canonicalize_city(city: str) -> str:
@@ -241,3 +322,221 @@ def extract_city_only(text: str) -> Optional[str]:
 
 
 
+
+
+## local fast path: deterministic parser for well-formed queries
+_NON_CITY_NAMES = {"multiple", "nan", ""}
+
+_INTENT_KEYWORDS = {
+    "itinerary": r"\b(?:itinerary|iternary)\b|\bplan\b.*\bdays?\b",
+    "flight": r"\b(?:flights?|airlines?|fly|flying)\b",
+    "bus": r"\b(?:bus|buses|sleepers?|coach|coaches)\b",
+    "hotel": r"\b(?:hotels?|stay|stays|staying|lodges?|resorts?)\b",
+    "attractions": r"\b(?:places?|visit|visiting|things to do|attractions?|sightseeing)\b",
+}
+# "trip" alone reads as an itinerary, but a "bus trip" is a bus query, and next to hotels or
+# places it only makes the intent ambiguous
+_WEAK_ITINERARY = re.compile(r"\btrips?\b")
+
+# An amount as written in a message: "2000", "8,000", "5k", "1.5k"
+AMOUNT_PATTERN = r"(\d[\d,]*(?:\.\d+)?)\s*(k\b)?"
+
+_EXPLICIT_BUDGET = re.compile(
+    r"(?:under|below|within|less than|upto|up to|max(?:imum)?|budget(?:\s+of)?)\s*(?:rs\.?|inr|₹)?\s*" + AMOUNT_PATTERN
+    + r"|₹\s*" + AMOUNT_PATTERN
+    + r"|" + AMOUNT_PATTERN + r"\s*(?:rs\b|inr\b|rupees)",
+    flags=re.I,
+)
+
+
+def parse_amount(digits: str, thousands: Optional[str] = None) -> int:
+    """Rupees for an AMOUNT_PATTERN match: digits with optional commas and decimals, times 1000 with a "k"."""
+    value = float(digits.replace(",", ""))
+    return int(round(value * 1000)) if thousands else int(value)
+
+
+@dataclass
+class LocalParse:
+    intent: str
+    params: Union[RouteQuery, HotelQuery, ItineraryQuery, str, None]
+    confidence: float
+
+
+_fast_path_lock = threading.Lock()
+_fast_path_stats = {"attempts": 0, "hits": 0}
+
+
+def record_fast_path(hit: bool) -> None:
+    with _fast_path_lock:
+        _fast_path_stats["attempts"] += 1
+        if hit:
+            _fast_path_stats["hits"] += 1
+
+
+def fast_path_stats() -> dict:
+    """Return how often the local parser answered without an LLM call."""
+    with _fast_path_lock:
+        stats = dict(_fast_path_stats)
+    stats["hit_rate"] = stats["hits"] / stats["attempts"] if stats["attempts"] else 0.0
+    return stats
+
+
+def _city_variants(name: str) -> List[str]:
+    # "Coorg (Kodagu)" is reachable as "Coorg (Kodagu)", "Coorg" and "Kodagu"
+    variants = [name]
+    m = re.match(r"^(.*?)\s*\((.*?)\)\s*$", name)
+    if m:
+        variants.extend(v.strip() for v in m.groups() if v.strip())
+    return variants
+
+
+def city_gazetteer() -> Dict[str, str]:
+    """Lowercase city spelling -> dataset city name, over every local dataset."""
+    from services.CSV_Service import datasets
+
+    return datasets.derived("city_gazetteer", _build_city_gazetteer)
+
+
+def _build_city_gazetteer() -> Dict[str, str]:
+    from services.CSV_Service import load_bus, load_flights, load_hotels, load_attractions
+
+    sources = (
+        (load_bus, ("source", "destination")),
+        (load_flights, ("from", "to")),
+        (load_hotels, ("city",)),
+        (load_attractions, ("city",)),
+    )
+    gazetteer: Dict[str, str] = {}
+    for loader, cols in sources:
+        try:
+            df = loader()
+        except (FileNotFoundError, ValueError):
+            continue
+        for col in cols:
+            if col not in df.columns:
+                continue
+            for name in df[col].dropna().astype(str).unique():
+                name = name.strip()
+                if name.lower() in _NON_CITY_NAMES:
+                    continue
+                for variant in _city_variants(name):
+                    gazetteer.setdefault(variant.lower(), name)
+    for alias, canonical in CITY_ALIASES.items():
+        if canonical.lower() in gazetteer:
+            gazetteer.setdefault(alias, gazetteer[canonical.lower()])
+    return gazetteer
+
+
+def _gazetteer_pattern() -> Optional[re.Pattern]:
+    from services.CSV_Service import datasets
+
+    return datasets.derived("gazetteer_pattern", _build_gazetteer_pattern)
+
+
+def _build_gazetteer_pattern() -> Optional[re.Pattern]:
+    names = sorted(city_gazetteer(), key=len, reverse=True)
+    if not names:
+        return None
+    return re.compile(r"\b(" + "|".join(re.escape(n) for n in names) + r")\b", flags=re.I)
+
+
+def _find_cities(text: str) -> List[Tuple[str, Optional[str]]]:
+    """Return (city, role) for each gazetteer city in order; role comes from the preceding word."""
+    pattern = _gazetteer_pattern()
+    if pattern is None:
+        return []
+    gazetteer = city_gazetteer()
+    found: List[Tuple[str, Optional[str]]] = []
+    for m in pattern.finditer(text):
+        before = re.findall(r"[a-z]+", text[:m.start()].lower())
+        prev = before[-1] if before else ""
+        role = {"from": "source", "to": "destination", "in": "city", "at": "city", "of": "city", "near": "city"}.get(prev)
+        found.append((gazetteer[m.group(1).lower()], role))
+    return found
+
+
+def mentioned_cities(text: str) -> List[str]:
+    """Dataset cities named in the text, in order."""
+    return [c for c, _ in _find_cities(text)]
+
+
+def _parse_explicit_budget(text: str) -> Optional[int]:
+    m = _EXPLICIT_BUDGET.search(text)
+    if not m:
+        return None
+    groups = m.groups()
+    # (digits, "k") pairs, one per alternative; exactly one pair took part in the match
+    digits, thousands = next((groups[i], groups[i + 1]) for i in range(0, len(groups), 2) if groups[i])
+    return parse_amount(digits, thousands)
+
+
+def parse_query_local(text: str) -> LocalParse:
+    """
+    Deterministic intent and parameter parser built on the dataset gazetteer and simple
+    from/to/in/under/days patterns. Confidence is high only when the intent keyword is
+    unambiguous and every slot the handler needs was matched against a known city.
+    """
+    t = text.lower()
+    hits = [label for label, pat in _INTENT_KEYWORDS.items() if re.search(pat, t)]
+    if "itinerary" not in hits and _WEAK_ITINERARY.search(t) and not {"bus", "flight"} & set(hits):
+        hits.append("itinerary")
+    if not hits:
+        intent = detect_intent(text)
+        if intent == "greeting" and len(re.findall(r"[a-z]+", t)) <= 4:
+            return LocalParse("greeting", None, 0.9)
+        return LocalParse(intent, None, 0.0)
+
+    intent = hits[0]
+    confidence = 0.5 if len(hits) == 1 else 0.2
+    if hits == ["itinerary"] and not re.search(_INTENT_KEYWORDS["itinerary"], t):
+        # only "trip" named the intent: worth a guess, not enough to skip Gemini
+        confidence = 0.3
+    cities = _find_cities(text)
+    budget = _parse_explicit_budget(text)
+
+    if intent in ("bus", "flight", "itinerary"):
+        source = next((c for c, r in cities if r == "source"), None)
+        destination = next((c for c, r in cities if r == "destination"), None)
+        if source and destination and source != destination:
+            confidence += 0.4
+        else:
+            # Order-based fallback: "Agra Delhi buses"
+            names = [c for c, _ in cities]
+            if len(names) == 2 and names[0] != names[1]:
+                source, destination = source or names[0], destination or names[1]
+                confidence += 0.2
+        if intent == "itinerary":
+            params = ItineraryQuery(
+                num_days=_parse_num_days(None, text),
+                source=source,
+                destination=destination,
+                budget=budget if budget is not None else 10000,
+            )
+        else:
+            params = RouteQuery(source=source, destination=destination, budget=budget if budget is not None else 10000)
+        return LocalParse(intent, params, round(confidence, 2))
+
+    names = [c for c, _ in cities]
+    city = next((c for c, r in cities if r == "city"), None)
+    if city:
+        confidence += 0.4
+    elif len(set(names)) == 1:
+        city = names[0]
+        confidence += 0.3
+    if intent == "hotel":
+        return LocalParse(intent, HotelQuery(city=city, budget=budget if budget is not None else 10000), round(confidence, 2))
+    return LocalParse(intent, city, round(confidence, 2))
+
+
+def fast_path_params(intent: str, text: str, parsed: Optional[LocalParse] = None):
+    """
+    Return locally parsed params for an already-known intent, or None if not confident.
+    ``parsed`` is an earlier local parse of the same message (from routing): it is reused and,
+    having been counted already, not recorded as a second fast-path attempt.
+    """
+    counted = parsed is not None
+    parsed = parsed or parse_query_local(text)
+    hit = parsed.intent == intent and parsed.confidence >= FAST_PATH_CONFIDENCE
+    if not counted:
+        record_fast_path(hit)
+    return parsed.params if hit else None
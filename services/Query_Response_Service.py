@@ -5,8 +5,17 @@ import warnings
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 warnings.filterwarnings("ignore")
 
-from typing import Optional
+import asyncio
+import json
+import logging
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, replace
+from typing import Callable, Dict, Iterator, Optional, Tuple, Union
 
+import numpy as np
 import pandas as pd
 
 from config import (
@@ -14,6 +23,8 @@ from config import (
     PROMPT_INTENT,
     PROMPT_BUS,
     PROMPT_FLIGHT,
+    PROMPT_BUS_CONNECTIONS,
+    PROMPT_FLIGHT_CONNECTIONS,
     PROMPT_HOTEL,
     PROMPT_ATTRACTIONS,
     PROMPT_ITINERARY,
@@ -21,166 +32,786 @@ from config import (
     FALLBACK_FLIGHT,
     FALLBACK_HOTEL,
     FALLBACK_ATTRACTIONS,
+    OVER_BUDGET_BUS,
+    OVER_BUDGET_FLIGHT,
     TOP_K,
     MODEL_NAME,
+    DEFAULT_SORT,
+    SORT_DESCRIPTIONS,
+    FAST_PATH_CONFIDENCE,
+    RETRIEVAL_WORKERS,
+    MAX_OUTPUT_TOKENS,
+    FOLLOW_UP_QUESTION,
+    NO_MORE_OPTIONS,
 )
 
-from services.Retrieval_Service import Query, retrieve_buses, retrieve_flights, retrieve_hotels, retrieve_attractions
-from services.Gemini_Service import GeminiClient
+from services.Retrieval_Service import (
+    Query,
+    resolve_city,
+    retrieve_buses,
+    retrieve_flights,
+    retrieve_bus_connections,
+    retrieve_flight_connections,
+    retrieve_hotels,
+    retrieve_attractions,
+)
+from services.CSV_Service import datasets
+from services.Dialogue_Service import DialogueState, Refinement, parse_refinement
+from services.Gemini_Service import get_client
+from services.Metrics_Service import Span, bind_context, end_span, span, start_span, traced, use_span
+from services.Prompt_Service import output_limit, record_context_tokens, record_prompt_tokens, token_stats_enabled
 from services.Query_Extraction_service import (
     extract_bus_params_gemini,
     extract_flight_params_gemini,
     extract_hotel_params_gemini,
     extract_attraction_params_gemini,
     extract_itinerary_params_gemini,
+    extract_route_params_gemini,
+    aextract_bus_params_gemini,
+    aextract_flight_params_gemini,
+    aextract_hotel_params_gemini,
+    aextract_attraction_params_gemini,
+    aextract_itinerary_params_gemini,
+    aextract_route_params_gemini,
+    RouteQuery,
+    HotelQuery,
+    ItineraryQuery,
+    RoutedQuery,
+    LocalParse,
+    parse_query_local,
+    fast_path_params,
+    record_fast_path,
     analyze_sentiment,
     format_currency,
     detect_intent,
+    detect_sort_mode,
 )
 
+logger = logging.getLogger(__name__)
+
+# Handler-level retrieval/prompt building (async pipeline) and the itinerary legs use separate
+# pools, so an itinerary waiting on its legs can never starve them of workers.
+_retrieval_pool = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS, thread_name_prefix="retrieval")
+_leg_pool = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS, thread_name_prefix="itinerary-leg")
+
+
 def classify_intent(user_msg: str, api_key: str, model_name: Optional[str] = None) -> str:
-    client = GeminiClient(api_key, model_name or MODEL_NAME)
-    label = client.generate(PROMPT_INTENT.format(user_message=user_msg), temperature=0.0, max_output_tokens=100)
-    label = (label or "").strip().split()[0].lower()
+    parsed = parse_query_local(user_msg)
+    if parsed.confidence >= FAST_PATH_CONFIDENCE:
+        record_fast_path(True)
+        return parsed.intent
+    record_fast_path(False)
+    client = get_client(api_key, model_name or MODEL_NAME)
+    label = client.generate(PROMPT_INTENT.format(user_message=user_msg), temperature=0.0, max_output_tokens=MAX_OUTPUT_TOKENS["intent"], cache=True)
+    words = (label or "").split()
+    label = words[0].lower() if words else ""
     if label in {"greeting","bus","flight","hotel","attractions","itinerary","unknown"}:
         return label
     # Fallback to lightweight local classifier if model returns empty/blocked
     return detect_intent(user_msg)
 
 
-def _rows_to_bulleted_text(df: pd.DataFrame, cols: list[str]) -> str:
-    lines: list[str] = []
-    for _, row in df.iterrows():
-        parts = []
-        for c in cols:
-            val = row.get(c, "")
-            if c == "price" and isinstance(val, (int, float)):
-                val = format_currency(int(val))
-            parts.append(f"{c}: {val}")
-        lines.append(" - " + "; ".join(parts))
-    return "\n".join(lines) if lines else ""
+def route_query(user_msg: str, api_key: str, model_name: Optional[str] = None) -> RoutedQuery:
+    """
+    Resolve intent and parameters, locally when the deterministic parser is confident,
+    otherwise with one Gemini call. If the combined reply is unusable, fall back to the
+    local classifier and let the handler extract params.
+    """
+    parsed = parse_query_local(user_msg)
+    if parsed.confidence >= FAST_PATH_CONFIDENCE:
+        record_fast_path(True)
+        return RoutedQuery(parsed.intent, parsed.params)
+    record_fast_path(False)
+    routed = extract_route_params_gemini(user_msg, api_key, model_name or MODEL_NAME)
+    if routed is not None:
+        return replace(routed, local=parsed)
+    return RoutedQuery(detect_intent(user_msg), local=parsed)
+
+
+def _display_values(series: pd.Series, label: str) -> np.ndarray:
+    if label == "price" and pd.api.types.is_numeric_dtype(series):
+        return np.array([format_currency(v) for v in series.to_numpy(dtype="int64").tolist()], dtype=str)
+    # Element-wise str() in C, matching how the values print on their own ("nan" for missing)
+    return np.asarray(series.to_numpy(dtype=object), dtype=str)
+
+
+def _rows_to_bulleted_text(df: pd.DataFrame, cols: list[str], labels: Optional[Dict[str, str]] = None) -> str:
+    """
+    Render rows as " - col: value; ..." lines, building each line column-wise with vectorized
+    string ops. ``labels`` renames columns in the output without copying the frame.
+    """
+    if df.empty:
+        return ""
+    labels = labels or {}
+    lines = np.full(len(df), " - ")
+    for i, c in enumerate(cols):
+        label = labels.get(c, c)
+        lines = np.char.add(lines, f"; {label}: " if i else f"{label}: ")
+        if c in df.columns:
+            lines = np.char.add(lines, _display_values(df[c], label))
+    return "\n".join(lines.tolist())
+
+
+def _rows_to_table(df: pd.DataFrame, cols: list[str], labels: Optional[Dict[str, str]] = None) -> str:
+    """
+    Render rows as a compact table: columns holding one value on every row are stated once on
+    top, then the header once and one " | "-separated line per distinct row.
+    """
+    if df.empty:
+        return ""
+    labels = labels or {}
+    shared, header, columns = [], [], []
+    for c in cols:
+        if c not in df.columns:
+            continue
+        label = labels.get(c, c)
+        values = _display_values(df[c], label)
+        if len(values) > 1 and (values == values[0]).all():
+            shared.append(f"{label}: {values[0]}")
+        else:
+            header.append(label)
+            columns.append(values)
+    lines = ["(all rows) " + "; ".join(shared)] if shared else []
+    if columns:
+        rows = columns[0]
+        for values in columns[1:]:
+            rows = np.char.add(np.char.add(rows, " | "), values)
+        lines.append(" | ".join(header))
+        lines.extend(dict.fromkeys(rows.tolist()))
+    return "\n".join(lines)
+
+
+def _context(df: pd.DataFrame, cols: list[str], labels: Optional[Dict[str, str]] = None) -> str:
+    """Prompt context for ``df`` as a compact table; with token stats on, also measures the bulleted form it replaces."""
+    table = _rows_to_table(df, cols, labels)
+    if token_stats_enabled():
+        record_context_tokens(_rows_to_bulleted_text(df, cols, labels), table)
+    return table
+
+
+@contextmanager
+def _stage(trace: Optional[dict], name: str):
+    """Run one pipeline stage in a span and, when tracing, record its wall time (ms) into ``trace["timings"]``."""
+    start = time.perf_counter()
+    try:
+        with span(f"stage.{name}"):
+            yield
+    finally:
+        _note_timing(trace, name, start)
+
+
+def _note_timing(trace: Optional[dict], name: str, start: float) -> None:
+    if trace is not None:
+        trace.setdefault("timings", {})[name] = (time.perf_counter() - start) * 1000
+
+
+def _stream_in_span(s: Span, start_chunks: Callable[[], Iterator[str]], on_close: Optional[Callable[[], None]] = None) -> Iterator[str]:
+    """
+    Start a streamed reply under ``s`` and keep the span (and the pinned dataset generation) open until
+    the caller has drained or closed the stream; ``on_close`` runs just before the span ends.
+    """
+    try:
+        with use_span(s):
+            chunks = start_chunks()
+    except BaseException as e:
+        if on_close is not None:
+            on_close()
+        end_span(s, e)
+        raise
+    return _held_open(chunks, s, datasets.current(), on_close)
+
+
+def _held_open(chunks: Iterator[str], s: Span, generation, on_close: Optional[Callable[[], None]]) -> Iterator[str]:
+    # A generator runs in its consumer's context, so as in generate_stream the span is ended by hand;
+    # it and the pin are only made current while a chunk is pulled, never across a yield
+    error: Optional[BaseException] = None
+    try:
+        while True:
+            with datasets.pinned(generation), use_span(s):
+                chunk = next(chunks, None)
+            if chunk is None:
+                return
+            yield chunk
+    except BaseException as e:
+        error = e if not isinstance(e, GeneratorExit) else None
+        raise
+    finally:
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            with datasets.pinned(generation), use_span(s):
+                close()
+        if on_close is not None:
+            on_close()
+        end_span(s, error)
+
+
+def _note_params(trace: Optional[dict], params) -> None:
+    if trace is None:
+        return
+    if params is None or isinstance(params, str):
+        trace["params"] = {"city": params}
+    else:
+        trace["params"] = asdict(params)
+
+
+def _note_rows(trace: Optional[dict], df: pd.DataFrame, sort: Optional[str] = None) -> None:
+    if trace is not None:
+        if sort is not None:
+            trace["sort"] = sort
+        # to_json maps NaN to null and numpy scalars to plain JSON values
+        trace["rows"] = json.loads(df.to_json(orient="records"))
+
+
+@dataclass
+class PreparedReply:
+    """Either a prompt still to be sent to Gemini, or a final text (e.g. a fallback message)."""
+    prompt: Optional[str] = None
+    text: Optional[str] = None
+    # Intent the prompt answers; picks the output-token cap
+    intent: Optional[str] = None
+
+
+def _reply(prepared: PreparedReply, api_key: str, model_name: Optional[str], stream: bool) -> Union[str, Iterator[str]]:
+    if prepared.prompt is None:
+        return iter([prepared.text or ""]) if stream else (prepared.text or "")
+    client = get_client(api_key, model_name or MODEL_NAME)
+    limit = output_limit(prepared.intent)
+    record_prompt_tokens(prepared.intent, prepared.prompt, limit, client)
+    if stream:
+        return client.generate_stream(prepared.prompt, max_output_tokens=limit)
+    return client.generate(prepared.prompt, max_output_tokens=limit)
+
+
+def _generate(trace: Optional[dict], prepared: PreparedReply, api_key: str, model_name: Optional[str], stream: bool) -> Union[str, Iterator[str]]:
+    """The "generate" stage; for a streamed reply it lasts until the caller has consumed the stream."""
+    if not stream:
+        with _stage(trace, "generate"):
+            return _reply(prepared, api_key, model_name, stream)
+    start = time.perf_counter()
+    return _stream_in_span(start_span("stage.generate"), lambda: _reply(prepared, api_key, model_name, stream), lambda: _note_timing(trace, "generate", start))
 
 
-def handle_greeting(user_msg: str, api_key: str, model_name: Optional[str] = None) -> str:
+def _greeting_prompt(user_msg: str) -> PreparedReply:
     sentiment = analyze_sentiment(user_msg)
-    client = GeminiClient(api_key, model_name or MODEL_NAME)
-    prompt = PROMPT_GREETING.format(sentiment=sentiment, user_message=user_msg)
-    return client.generate(prompt)
+    return PreparedReply(prompt=PROMPT_GREETING.format(sentiment=sentiment, user_message=user_msg), intent="greeting")
 
 
-def handle_bus_query(user_msg: str, api_key: str, fuzzy: bool, model_name: Optional[str] = None) -> str:
-    q = extract_bus_params_gemini(user_msg, api_key, model_name or MODEL_NAME)
-    df = retrieve_buses(Query(source=q.source, destination=q.destination, budget=q.budget), fuzzy=fuzzy, top_k=TOP_K)
+@traced()
+def handle_greeting(user_msg: str, api_key: str, model_name: Optional[str] = None, stream: bool = False, trace: Optional[dict] = None) -> Union[str, Iterator[str]]:
+    return _generate(trace, _greeting_prompt(user_msg), api_key, model_name, stream)
+
+
+def _bus_prompt(user_msg: str, q: RouteQuery, fuzzy: bool, trace: Optional[dict] = None, sort: Optional[str] = None) -> PreparedReply:
+    sort = sort or detect_sort_mode(user_msg)
+    df = retrieve_buses(Query(source=q.source, destination=q.destination, budget=q.budget, sort=sort), fuzzy=fuzzy, top_k=TOP_K)
     if df.empty:
-        return FALLBACK_BUS.format(source=q.source or "?", destination=q.destination or "?", budget=q.budget or "?")
+        _note_rows(trace, df, sort)
+        return _over_budget_reply(retrieve_buses, OVER_BUDGET_BUS, q, fuzzy) or _bus_connections_prompt(user_msg, q, fuzzy, sort, trace)
+    _note_rows(trace, df, sort)
+    return _bus_rows_prompt(user_msg, df, q, sort)
+
+
+def _bus_rows_prompt(user_msg: str, df: pd.DataFrame, q: RouteQuery, sort: str) -> PreparedReply:
     # include departure_time if present from cleaned_bus.csv
     bus_cols = ["source", "destination", "bus_type", "departure_time", "travel_duration", "price", "rating"]
-    context_rows = _rows_to_bulleted_text(df, [c for c in bus_cols if c in df.columns])
-    client = GeminiClient(api_key, model_name or MODEL_NAME)
-    prompt = PROMPT_BUS.format(k=TOP_K, budget=q.budget or "?", context_rows=context_rows, user_question=user_msg)
-    return client.generate(prompt)
+    context_rows = _context(df, [c for c in bus_cols if c in df.columns])
+    return PreparedReply(prompt=PROMPT_BUS.format(k=TOP_K, budget=q.budget or "?", order=SORT_DESCRIPTIONS[sort], context_rows=context_rows, user_question=user_msg), intent="bus")
+
+
+def _over_budget_reply(retrieve, template: str, q: RouteQuery, fuzzy: bool) -> Optional[PreparedReply]:
+    """Direct services run but none fits the budget: quote the cheapest one rather than planning connections."""
+    # a fare is only meaningful for a known route; with an endpoint missing any direct service would match
+    if q.budget is None or not q.source or not q.destination:
+        return None
+    cheapest = retrieve(Query(source=q.source, destination=q.destination, sort=DEFAULT_SORT), fuzzy=fuzzy, top_k=1)
+    if cheapest.empty:
+        return None
+    return PreparedReply(text=template.format(source=q.source, destination=q.destination, budget=q.budget, price=int(cheapest["price"].iloc[0])))
+
+
+# Connecting itineraries are planned on price, or on door-to-door time for "fastest"
+def _connection_sort(sort: str) -> str:
+    return sort if sort == "fastest" else DEFAULT_SORT
+
 
+_CONNECTION_COLS = ["option", "leg", "day", "departs", "layover_mins"]
+_CONNECTION_TOTALS = ["total_price", "total_duration_mins"]
 
-def handle_flight_query(user_msg: str, api_key: str, fuzzy: bool, model_name: Optional[str] = None) -> str:
-    q = extract_flight_params_gemini(user_msg, api_key, model_name or MODEL_NAME)
-    df = retrieve_flights(Query(source=q.source, destination=q.destination, budget=q.budget), fuzzy=fuzzy, top_k=TOP_K)
+
+def _bus_connections_prompt(user_msg: str, q: RouteQuery, fuzzy: bool, sort: str, trace: Optional[dict] = None) -> PreparedReply:
+    """No direct bus: offer the best connecting itineraries, or the fallback when the cities aren't connected."""
+    sort = _connection_sort(sort)
+    df = retrieve_bus_connections(Query(source=q.source, destination=q.destination, budget=q.budget, sort=sort), fuzzy=fuzzy, top_k=TOP_K)
+    _note_rows(trace, df, sort)
+    if df.empty:
+        return PreparedReply(text=FALLBACK_BUS.format(source=q.source or "?", destination=q.destination or "?", budget=q.budget or "?"))
+    bus_cols = _CONNECTION_COLS + ["source", "destination", "bus_type", "travel_duration", "price", "rating"] + _CONNECTION_TOTALS
+    context_rows = _context(df, [c for c in bus_cols if c in df.columns])
+    return PreparedReply(prompt=PROMPT_BUS_CONNECTIONS.format(k=TOP_K, budget=q.budget or "?", order=SORT_DESCRIPTIONS[sort], context_rows=context_rows, user_question=user_msg), intent="bus")
+
+
+@traced()
+def handle_bus_query(user_msg: str, api_key: str, fuzzy: bool, model_name: Optional[str] = None, params: Optional[RouteQuery] = None, local: Optional[LocalParse] = None, stream: bool = False, trace: Optional[dict] = None) -> Union[str, Iterator[str]]:
+    with _stage(trace, "extract"):
+        q = params or fast_path_params("bus", user_msg, local) or extract_bus_params_gemini(user_msg, api_key, model_name or MODEL_NAME)
+    _note_params(trace, q)
+    with _stage(trace, "retrieve"):
+        prepared = _bus_prompt(user_msg, q, fuzzy, trace)
+    return _generate(trace, prepared, api_key, model_name, stream)
+
+
+def _flight_prompt(user_msg: str, q: RouteQuery, fuzzy: bool, trace: Optional[dict] = None, sort: Optional[str] = None) -> PreparedReply:
+    sort = sort or detect_sort_mode(user_msg)
+    if sort == "best_rated":
+        sort = DEFAULT_SORT  # flights carry no rating
+    df = retrieve_flights(Query(source=q.source, destination=q.destination, budget=q.budget, sort=sort), fuzzy=fuzzy, top_k=TOP_K)
     if df.empty:
-        return FALLBACK_FLIGHT.format(source=q.source or "?", destination=q.destination or "?", budget=q.budget or "?")
+        _note_rows(trace, df, sort)
+        return _over_budget_reply(retrieve_flights, OVER_BUDGET_FLIGHT, q, fuzzy) or _flight_connections_prompt(user_msg, q, fuzzy, sort, trace)
+    _note_rows(trace, df, sort)
+    return _flight_rows_prompt(user_msg, df, q, sort)
+
+
+def _flight_rows_prompt(user_msg: str, df: pd.DataFrame, q: RouteQuery, sort: str) -> PreparedReply:
     # include dep_time if present from flights.csv
     flight_cols = ["from", "to", "airline", "class", "dep_time", "time_taken", "price"]
-    context_rows = _rows_to_bulleted_text(df, [c for c in flight_cols if c in df.columns])
-    client = GeminiClient(api_key, model_name or MODEL_NAME)
-    prompt = PROMPT_FLIGHT.format(k=TOP_K, budget=q.budget or "?", context_rows=context_rows, user_question=user_msg)
-    return client.generate(prompt)
+    context_rows = _context(df, [c for c in flight_cols if c in df.columns])
+    return PreparedReply(prompt=PROMPT_FLIGHT.format(k=TOP_K, budget=q.budget or "?", order=SORT_DESCRIPTIONS[sort], context_rows=context_rows, user_question=user_msg), intent="flight")
 
 
-def handle_hotel_query(user_msg: str, api_key: str, fuzzy: bool, model_name: Optional[str] = None) -> str:
-    q = extract_hotel_params_gemini(user_msg, api_key, model_name or MODEL_NAME)
-    df, price_col = retrieve_hotels(Query(city=q.city, budget=q.budget), fuzzy=fuzzy, top_k=TOP_K)
+def _flight_connections_prompt(user_msg: str, q: RouteQuery, fuzzy: bool, sort: str, trace: Optional[dict] = None) -> PreparedReply:
+    sort = _connection_sort(sort)
+    df = retrieve_flight_connections(Query(source=q.source, destination=q.destination, budget=q.budget, sort=sort), fuzzy=fuzzy, top_k=TOP_K)
+    _note_rows(trace, df, sort)
     if df.empty:
-        return FALLBACK_HOTEL.format(city=q.city or "?", budget=q.budget or "?")
-    cols = ["city", "hotel_name", price_col, "rating"]
-    cols = [c for c in cols if c in df.columns]
-    # rename price col in display
-    disp_df = df.copy()
-    if price_col in disp_df.columns:
-        disp_df.rename(columns={price_col: "price_per_night"}, inplace=True)
-    context_rows = _rows_to_bulleted_text(disp_df, [c for c in ["city", "hotel_name", "price_per_night", "rating"] if c in disp_df.columns])
-    client = GeminiClient(api_key, model_name or MODEL_NAME)
-    prompt = PROMPT_HOTEL.format(k=TOP_K, budget=q.budget or "?", context_rows=context_rows, user_question=user_msg)
-    return client.generate(prompt)
-
-
-def handle_attractions_query(user_msg: str, api_key: str, fuzzy: bool, model_name: Optional[str] = None) -> str:
-    city = extract_attraction_params_gemini(user_msg, api_key, model_name or MODEL_NAME)
-    df = retrieve_attractions(Query(city=city), fuzzy=fuzzy, top_k=TOP_K)
+        return PreparedReply(text=FALLBACK_FLIGHT.format(source=q.source or "?", destination=q.destination or "?", budget=q.budget or "?"))
+    flight_cols = _CONNECTION_COLS + ["from", "to", "airline", "class", "time_taken", "price"] + _CONNECTION_TOTALS
+    context_rows = _context(df, [c for c in flight_cols if c in df.columns])
+    return PreparedReply(prompt=PROMPT_FLIGHT_CONNECTIONS.format(k=TOP_K, budget=q.budget or "?", order=SORT_DESCRIPTIONS[sort], context_rows=context_rows, user_question=user_msg), intent="flight")
+
+
+@traced()
+def handle_flight_query(user_msg: str, api_key: str, fuzzy: bool, model_name: Optional[str] = None, params: Optional[RouteQuery] = None, local: Optional[LocalParse] = None, stream: bool = False, trace: Optional[dict] = None) -> Union[str, Iterator[str]]:
+    with _stage(trace, "extract"):
+        q = params or fast_path_params("flight", user_msg, local) or extract_flight_params_gemini(user_msg, api_key, model_name or MODEL_NAME)
+    _note_params(trace, q)
+    with _stage(trace, "retrieve"):
+        prepared = _flight_prompt(user_msg, q, fuzzy, trace)
+    return _generate(trace, prepared, api_key, model_name, stream)
+
+
+def _hotel_prompt(user_msg: str, q: HotelQuery, fuzzy: bool, trace: Optional[dict] = None, sort: Optional[str] = None) -> PreparedReply:
+    sort = sort or detect_sort_mode(user_msg)
+    df, price_col = retrieve_hotels(Query(city=q.city, budget=q.budget, sort=sort), fuzzy=fuzzy, top_k=TOP_K)
+    _note_rows(trace, df, sort)
+    if df.empty:
+        return PreparedReply(text=FALLBACK_HOTEL.format(city=q.city or "?", budget=q.budget or "?"))
+    return _hotel_rows_prompt(user_msg, df, q, price_col)
+
+
+def _hotel_rows_prompt(user_msg: str, df: pd.DataFrame, q: HotelQuery, price_col: str) -> PreparedReply:
+    # show the price column as price_per_night whatever the dataset calls it
+    context_rows = _context(df, [c for c in ["city", "hotel_name", price_col, "rating"] if c in df.columns], {price_col: "price_per_night"})
+    return PreparedReply(prompt=PROMPT_HOTEL.format(k=TOP_K, budget=q.budget or "?", context_rows=context_rows, user_question=user_msg), intent="hotel")
+
+
+@traced()
+def handle_hotel_query(user_msg: str, api_key: str, fuzzy: bool, model_name: Optional[str] = None, params: Optional[HotelQuery] = None, local: Optional[LocalParse] = None, stream: bool = False, trace: Optional[dict] = None) -> Union[str, Iterator[str]]:
+    with _stage(trace, "extract"):
+        q = params or fast_path_params("hotel", user_msg, local) or extract_hotel_params_gemini(user_msg, api_key, model_name or MODEL_NAME)
+    _note_params(trace, q)
+    with _stage(trace, "retrieve"):
+        prepared = _hotel_prompt(user_msg, q, fuzzy, trace)
+    return _generate(trace, prepared, api_key, model_name, stream)
+
+
+def _theme_text(user_msg: str, *cities: Optional[str]) -> str:
+    """The user's wording minus the city names, so ranking follows the theme rather than the place."""
+    for city in cities:
+        if city:
+            user_msg = re.sub(re.escape(city), " ", user_msg, flags=re.I)
+    return user_msg
+
+
+def _attractions_prompt(user_msg: str, city: Optional[str], fuzzy: bool, trace: Optional[dict] = None) -> PreparedReply:
+    df = retrieve_attractions(Query(city=city, theme=_theme_text(user_msg, city)), fuzzy=fuzzy, top_k=TOP_K)
+    _note_rows(trace, df)
     if df.empty:
-        return FALLBACK_ATTRACTIONS.format(city=city or "?")
+        return PreparedReply(text=FALLBACK_ATTRACTIONS.format(city=city or "?"))
     take_cols = [c for c in ["city", "category", "attraction", "description", "activities", "best_time"] if c in df.columns]
-    context_rows = _rows_to_bulleted_text(df, take_cols)
-    client = GeminiClient(api_key, model_name or MODEL_NAME)
-    prompt = PROMPT_ATTRACTIONS.format(context_rows=context_rows, user_question=user_msg)
-    return client.generate(prompt)
+    context_rows = _context(df, take_cols)
+    return PreparedReply(prompt=PROMPT_ATTRACTIONS.format(context_rows=context_rows, user_question=user_msg), intent="attractions")
 
 
-def handle_itinerary_query(user_msg: str, api_key: str, fuzzy: bool, model_name: Optional[str] = None) -> str:
-    it = extract_itinerary_params_gemini(user_msg, api_key, model_name or MODEL_NAME)
-    
-    # Calculate sub-budgets from total budget: 40% travel, 40% hotels, 20% activities
-    total_budget = it.budget or 50000  # Default to 50000 if not specified
-    travel_budget = int(total_budget * 0.4)  # 40% for outbound travel
-    hotel_budget = int(total_budget * 0.4)  # 40% for hotels (per night)
-    # 20% for activities is implicit (no explicit budget filtering for attractions)
-    
-    # Outbound travel options (from source to destination)
-    bus_df = retrieve_buses(Query(source=it.source, destination=it.destination, budget=travel_budget), fuzzy=fuzzy, top_k=TOP_K)
-    flight_df = retrieve_flights(Query(source=it.source, destination=it.destination, budget=travel_budget), fuzzy=fuzzy, top_k=TOP_K)
-    
-    # Hotels in destination
-    hotel_df, price_col = retrieve_hotels(Query(city=it.destination, budget=hotel_budget), fuzzy=fuzzy, top_k=TOP_K)
-    
+@traced()
+def handle_attractions_query(user_msg: str, api_key: str, fuzzy: bool, model_name: Optional[str] = None, params: Optional[str] = None, local: Optional[LocalParse] = None, stream: bool = False, trace: Optional[dict] = None) -> Union[str, Iterator[str]]:
+    with _stage(trace, "extract"):
+        city = params or fast_path_params("attractions", user_msg, local) or extract_attraction_params_gemini(user_msg, api_key, model_name or MODEL_NAME)
+    _note_params(trace, city)
+    with _stage(trace, "retrieve"):
+        prepared = _attractions_prompt(user_msg, city, fuzzy, trace)
+    return _generate(trace, prepared, api_key, model_name, stream)
+
+_BUS_COLS = ["source", "destination", "bus_type", "departure_time", "travel_duration", "price", "rating"]
+_FLIGHT_COLS = ["from", "to", "airline", "class", "dep_time", "time_taken", "price"]
+
+
+def _format_or(df: pd.DataFrame, cols: list[str], empty: str, labels: Optional[Dict[str, str]] = None) -> str:
+    return _context(df, [c for c in cols if c in df.columns], labels) if not df.empty else empty
+
+
+def _itinerary_hotels(q: Query, fuzzy: bool) -> str:
+    hotel_df, price_col = retrieve_hotels(q, fuzzy=fuzzy, top_k=TOP_K)
+    return _format_or(hotel_df, ["city", "hotel_name", price_col, "rating"], "(no hotels found)", {price_col: "price_per_night"})
+
+
+def _itinerary_attractions(q: Query, fuzzy: bool, num_days: int) -> str:
+    if q.theme:
+        # The best theme matches, one per day, when the theme covers every day
+        themed = retrieve_attractions(q, fuzzy=fuzzy, top_k=num_days)
+        if "theme_score" in themed.columns and len(themed) >= num_days:
+            return _format_or(themed, ["attraction", "category", "description", "activities"], "(no attractions found)")
+        q = replace(q, theme=None)
     # Random attractions for each day (one per day)
-    pool_df = retrieve_attractions(Query(city=it.destination), fuzzy=fuzzy, top_k=20)  # Get larger pool for randomness
-    if not pool_df.empty and len(pool_df) >= it.num_days:
+    pool_df = retrieve_attractions(q, fuzzy=fuzzy, top_k=20)  # Get larger pool for randomness
+    if not pool_df.empty and len(pool_df) >= num_days:
         # Randomly sample num_days attractions
-        attr_df = pool_df.sample(n=it.num_days, random_state=None).reset_index(drop=True)
+        attr_df = pool_df.sample(n=num_days, random_state=None).reset_index(drop=True)
     elif not pool_df.empty:
         attr_df = pool_df.sample(n=len(pool_df), random_state=None).reset_index(drop=True)
     else:
         attr_df = pool_df
-    
-    # Return journey options (from destination back to source)
-    return_bus_df = retrieve_buses(Query(source=it.destination, destination=it.source, budget=travel_budget), fuzzy=fuzzy, top_k=TOP_K)
-    return_flight_df = retrieve_flights(Query(source=it.destination, destination=it.source, budget=travel_budget), fuzzy=fuzzy, top_k=TOP_K)
-
-    # Format all data for the prompt
-    bus_rows = _rows_to_bulleted_text(bus_df, [c for c in ["source","destination","bus_type","departure_time","travel_duration","price","rating"] if c in bus_df.columns]) if not bus_df.empty else "(no buses found)"
-    flight_rows = _rows_to_bulleted_text(flight_df, [c for c in ["from","to","airline","class","dep_time","time_taken","price"] if c in flight_df.columns]) if not flight_df.empty else "(no flights found)"
-    
-    hotels_disp = hotel_df.copy()
-    if not hotels_disp.empty and price_col in hotels_disp.columns:
-        hotels_disp.rename(columns={price_col: "price_per_night"}, inplace=True)
-    hotel_rows = _rows_to_bulleted_text(hotels_disp, [c for c in ["city", "hotel_name", "price_per_night", "rating"] if c in hotels_disp.columns]) if not hotel_df.empty else "(no hotels found)"
-    
-    attr_rows = _rows_to_bulleted_text(attr_df, [c for c in ["attraction", "category", "description", "activities"] if c in attr_df.columns]) if not attr_df.empty else "(no attractions found)"
-    
-    return_bus_rows = _rows_to_bulleted_text(return_bus_df, [c for c in ["source","destination","bus_type","departure_time","travel_duration","price","rating"] if c in return_bus_df.columns]) if not return_bus_df.empty else "(no return buses found)"
-    return_flight_rows = _rows_to_bulleted_text(return_flight_df, [c for c in ["from","to","airline","class","dep_time","time_taken","price"] if c in return_flight_df.columns]) if not return_flight_df.empty else "(no return flights found)"
-
-    client = GeminiClient(api_key, model_name or MODEL_NAME)
+    return _format_or(attr_df, ["attraction", "category", "description", "activities"], "(no attractions found)")
+
+
+def _timed_leg(name: str, empty: str, fn, *args) -> Tuple[str, str, float]:
+    start = time.perf_counter()
+    with span(f"leg.{name}") as s:
+        try:
+            rows = fn(*args)
+        except FileNotFoundError as e:
+            logger.warning("Itinerary leg %s skipped: %s", name, e)
+            s.set(skipped=str(e))
+            rows = empty
+        except Exception as e:
+            # One failing leg (e.g. a missing dataset) should not sink the whole itinerary
+            logger.exception("Itinerary leg %s failed", name)
+            s.set(skipped=f"{type(e).__name__}: {e}")
+            rows = empty
+    return name, rows, (time.perf_counter() - start) * 1000
+
+
+def _itinerary_prompt(user_msg: str, it: ItineraryQuery, fuzzy: bool, trace: Optional[dict] = None) -> PreparedReply:
+    # Calculate sub-budgets from total budget: 40% travel, 40% hotels, 20% activities
+    total_budget = it.budget or 50000  # Default to 50000 if not specified
+    travel_budget = int(total_budget * 0.4)  # 40% for outbound travel
+    hotel_budget = int(total_budget * 0.4)  # 40% for hotels (per night)
+    # 20% for activities is implicit (no explicit budget filtering for attractions)
+
+    # Resolve both cities once; every leg (including the swapped return legs) reuses it
+    start = time.perf_counter()
+    src_names = resolve_city(it.source, fuzzy) if it.source else None
+    dst_names = resolve_city(it.destination, fuzzy) if it.destination else None
+    resolve_ms = (time.perf_counter() - start) * 1000
+
+    outbound = Query(source=it.source, destination=it.destination, budget=travel_budget,
+                     source_names=src_names, destination_names=dst_names)
+    inbound = Query(source=it.destination, destination=it.source, budget=travel_budget,
+                    source_names=dst_names, destination_names=src_names)
+    at_destination = Query(city=it.destination, budget=hotel_budget, city_names=dst_names)
+
+    legs = [
+        ("outbound_bus", "(no buses found)",
+         lambda: _format_or(retrieve_buses(outbound, fuzzy=fuzzy, top_k=TOP_K), _BUS_COLS, "(no buses found)")),
+        ("outbound_flight", "(no flights found)",
+         lambda: _format_or(retrieve_flights(outbound, fuzzy=fuzzy, top_k=TOP_K), _FLIGHT_COLS, "(no flights found)")),
+        ("hotels", "(no hotels found)", lambda: _itinerary_hotels(at_destination, fuzzy)),
+        ("attractions", "(no attractions found)",
+         lambda: _itinerary_attractions(Query(city=it.destination, city_names=dst_names,
+                                              theme=_theme_text(user_msg, it.source, it.destination)), fuzzy, it.num_days)),
+        ("return_bus", "(no return buses found)",
+         lambda: _format_or(retrieve_buses(inbound, fuzzy=fuzzy, top_k=TOP_K), _BUS_COLS, "(no return buses found)")),
+        ("return_flight", "(no return flights found)",
+         lambda: _format_or(retrieve_flights(inbound, fuzzy=fuzzy, top_k=TOP_K), _FLIGHT_COLS, "(no return flights found)")),
+    ]
+    # Independent retrievals and their formatting run concurrently
+    futures = [_leg_pool.submit(bind_context(_timed_leg, name, empty, fn)) for name, empty, fn in legs]
+    rows, timings = {}, {"resolve_cities": resolve_ms}
+    for fut in futures:
+        name, text, ms = fut.result()
+        rows[name] = text
+        timings[name] = ms
+    timings["fan_out"] = (time.perf_counter() - start) * 1000
+    logger.debug("Itinerary leg timings (ms): %s", timings)
+    if trace is not None:
+        trace.setdefault("timings", {}).update(timings)
+
     prompt = PROMPT_ITINERARY.format(
         num_days=it.num_days,
         destination=it.destination or "?",
         source=it.source or "?",
         budget=total_budget,
-        bus_rows=bus_rows,
-        flight_rows=flight_rows,
-        hotel_rows=hotel_rows,
-        attraction_rows=attr_rows,
-        return_bus_rows=return_bus_rows,
-        return_flight_rows=return_flight_rows,
+        bus_rows=rows["outbound_bus"],
+        flight_rows=rows["outbound_flight"],
+        hotel_rows=rows["hotels"],
+        attraction_rows=rows["attractions"],
+        return_bus_rows=rows["return_bus"],
+        return_flight_rows=rows["return_flight"],
         user_question=user_msg,
     )
-    return client.generate(prompt)
+    return PreparedReply(prompt=prompt, intent="itinerary")
+
+
+@traced()
+def handle_itinerary_query(user_msg: str, api_key: str, fuzzy: bool, model_name: Optional[str] = None, params: Optional[ItineraryQuery] = None, local: Optional[LocalParse] = None, stream: bool = False, trace: Optional[dict] = None) -> Union[str, Iterator[str]]:
+    with _stage(trace, "extract"):
+        it = params or fast_path_params("itinerary", user_msg, local) or extract_itinerary_params_gemini(user_msg, api_key, model_name or MODEL_NAME)
+    _note_params(trace, it)
+    with _stage(trace, "retrieve"):
+        prepared = _itinerary_prompt(user_msg, it, fuzzy, trace)
+    return _generate(trace, prepared, api_key, model_name, stream)
+
+
+## asyncio pipeline: LLM calls are awaited, retrieval and prompt building run in a thread pool
+
+
+async def _in_pool(fn, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_retrieval_pool, bind_context(fn, *args))
+
+
+async def _areply(prepared: PreparedReply, api_key: str, model_name: Optional[str]) -> str:
+    if prepared.prompt is None:
+        return prepared.text or ""
+    client = get_client(api_key, model_name or MODEL_NAME)
+    limit = output_limit(prepared.intent)
+    record_prompt_tokens(prepared.intent, prepared.prompt, limit, client)
+    return await client.agenerate(prepared.prompt, max_output_tokens=limit)
+
+
+async def aclassify_intent(user_msg: str, api_key: str, model_name: Optional[str] = None) -> str:
+    parsed = parse_query_local(user_msg)
+    if parsed.confidence >= FAST_PATH_CONFIDENCE:
+        record_fast_path(True)
+        return parsed.intent
+    record_fast_path(False)
+    client = get_client(api_key, model_name or MODEL_NAME)
+    label = await client.agenerate(PROMPT_INTENT.format(user_message=user_msg), temperature=0.0, max_output_tokens=MAX_OUTPUT_TOKENS["intent"], cache=True)
+    words = (label or "").strip().split()
+    if words and words[0].lower() in {"greeting", "bus", "flight", "hotel", "attractions", "itinerary", "unknown"}:
+        return words[0].lower()
+    return detect_intent(user_msg)
+
+
+async def aroute_query(user_msg: str, api_key: str, model_name: Optional[str] = None) -> RoutedQuery:
+    parsed = parse_query_local(user_msg)
+    if parsed.confidence >= FAST_PATH_CONFIDENCE:
+        record_fast_path(True)
+        return RoutedQuery(parsed.intent, parsed.params)
+    record_fast_path(False)
+    routed = await aextract_route_params_gemini(user_msg, api_key, model_name or MODEL_NAME)
+    if routed is not None:
+        return replace(routed, local=parsed)
+    return RoutedQuery(detect_intent(user_msg), local=parsed)
+
+
+@traced()
+async def ahandle_greeting(user_msg: str, api_key: str, model_name: Optional[str] = None, trace: Optional[dict] = None) -> str:
+    with _stage(trace, "generate"):
+        return await _areply(_greeting_prompt(user_msg), api_key, model_name)
+
+
+@traced()
+async def ahandle_bus_query(user_msg: str, api_key: str, fuzzy: bool, model_name: Optional[str] = None, params: Optional[RouteQuery] = None, local: Optional[LocalParse] = None, trace: Optional[dict] = None) -> str:
+    with _stage(trace, "extract"):
+        q = params or fast_path_params("bus", user_msg, local) or await aextract_bus_params_gemini(user_msg, api_key, model_name or MODEL_NAME)
+    _note_params(trace, q)
+    with _stage(trace, "retrieve"):
+        prepared = await _in_pool(_bus_prompt, user_msg, q, fuzzy, trace)
+    with _stage(trace, "generate"):
+        return await _areply(prepared, api_key, model_name)
+
+
+@traced()
+async def ahandle_flight_query(user_msg: str, api_key: str, fuzzy: bool, model_name: Optional[str] = None, params: Optional[RouteQuery] = None, local: Optional[LocalParse] = None, trace: Optional[dict] = None) -> str:
+    with _stage(trace, "extract"):
+        q = params or fast_path_params("flight", user_msg, local) or await aextract_flight_params_gemini(user_msg, api_key, model_name or MODEL_NAME)
+    _note_params(trace, q)
+    with _stage(trace, "retrieve"):
+        prepared = await _in_pool(_flight_prompt, user_msg, q, fuzzy, trace)
+    with _stage(trace, "generate"):
+        return await _areply(prepared, api_key, model_name)
+
+
+@traced()
+async def ahandle_hotel_query(user_msg: str, api_key: str, fuzzy: bool, model_name: Optional[str] = None, params: Optional[HotelQuery] = None, local: Optional[LocalParse] = None, trace: Optional[dict] = None) -> str:
+    with _stage(trace, "extract"):
+        q = params or fast_path_params("hotel", user_msg, local) or await aextract_hotel_params_gemini(user_msg, api_key, model_name or MODEL_NAME)
+    _note_params(trace, q)
+    with _stage(trace, "retrieve"):
+        prepared = await _in_pool(_hotel_prompt, user_msg, q, fuzzy, trace)
+    with _stage(trace, "generate"):
+        return await _areply(prepared, api_key, model_name)
+
+
+@traced()
+async def ahandle_attractions_query(user_msg: str, api_key: str, fuzzy: bool, model_name: Optional[str] = None, params: Optional[str] = None, local: Optional[LocalParse] = None, trace: Optional[dict] = None) -> str:
+    with _stage(trace, "extract"):
+        city = params or fast_path_params("attractions", user_msg, local) or await aextract_attraction_params_gemini(user_msg, api_key, model_name or MODEL_NAME)
+    _note_params(trace, city)
+    with _stage(trace, "retrieve"):
+        prepared = await _in_pool(_attractions_prompt, user_msg, city, fuzzy, trace)
+    with _stage(trace, "generate"):
+        return await _areply(prepared, api_key, model_name)
+
+
+@traced()
+async def ahandle_itinerary_query(user_msg: str, api_key: str, fuzzy: bool, model_name: Optional[str] = None, params: Optional[ItineraryQuery] = None, local: Optional[LocalParse] = None, trace: Optional[dict] = None) -> str:
+    with _stage(trace, "extract"):
+        it = params or fast_path_params("itinerary", user_msg, local) or await aextract_itinerary_params_gemini(user_msg, api_key, model_name or MODEL_NAME)
+    _note_params(trace, it)
+    with _stage(trace, "retrieve"):
+        prepared = await _in_pool(_itinerary_prompt, user_msg, it, fuzzy, trace)
+    with _stage(trace, "generate"):
+        return await _areply(prepared, api_key, model_name)
+
+
+
+UNKNOWN_REPLY = "I can help with buses, flights, hotels, attractions, or itineraries. Try asking with a city and optional budget."
+
+_HANDLERS = {
+    "bus": handle_bus_query,
+    "flight": handle_flight_query,
+    "hotel": handle_hotel_query,
+    "attractions": handle_attractions_query,
+    "itinerary": handle_itinerary_query,
+}
+
+_ASYNC_HANDLERS = {
+    "bus": ahandle_bus_query,
+    "flight": ahandle_flight_query,
+    "hotel": ahandle_hotel_query,
+    "attractions": ahandle_attractions_query,
+    "itinerary": ahandle_itinerary_query,
+}
+
+
+## follow-ups: refinements of the session's last answer are applied locally
+
+
+_PROMPT_BUILDERS = {"bus": _bus_prompt, "flight": _flight_prompt, "hotel": _hotel_prompt}
+_PARAM_TYPES = {"bus": RouteQuery, "flight": RouteQuery, "hotel": HotelQuery}
+
+
+def _refined_prompt(user_msg: str, state: DialogueState, ref: Refinement, fuzzy: bool, trace: Optional[dict] = None) -> PreparedReply:
+    """
+    Answer a follow-up from the session state: the refinement is applied to the last turn's
+    parameters and the kept candidate rows are re-ranked; only the wording needs Gemini.
+    """
+    state.apply(ref, fuzzy)
+    q, sort = state.params, state.sort
+    question = FOLLOW_UP_QUESTION.format(previous=state.question, follow_up=user_msg)
+    _note_params(trace, q)
+    if not state.has_candidates:
+        # nothing kept (connecting routes, no city): rebuild from the new parameters, still without extraction
+        return _PROMPT_BUILDERS[state.intent](question, q, fuzzy, trace, sort)
+    df = state.page(TOP_K)
+    _note_rows(trace, df, sort)
+    if df.empty and ref.more and state.shown:
+        return PreparedReply(text=NO_MORE_OPTIONS.format(budget=q.budget or "?"))
+    if state.intent == "hotel":
+        if df.empty:
+            return PreparedReply(text=FALLBACK_HOTEL.format(city=q.city or "?", budget=q.budget or "?"))
+        return _hotel_rows_prompt(question, df, q, state.price_col)
+    if df.empty:
+        # the kept route has direct services, so an empty page means they all cost more than the budget
+        retrieve, template = (retrieve_buses, OVER_BUDGET_BUS) if state.intent == "bus" else (retrieve_flights, OVER_BUDGET_FLIGHT)
+        over_budget = _over_budget_reply(retrieve, template, q, fuzzy)
+        if over_budget is not None:
+            return over_budget
+        fallback = FALLBACK_BUS if state.intent == "bus" else FALLBACK_FLIGHT
+        return PreparedReply(text=fallback.format(source=q.source or "?", destination=q.destination or "?", budget=q.budget or "?"))
+    rows_prompt = _bus_rows_prompt if state.intent == "bus" else _flight_rows_prompt
+    return rows_prompt(question, df, q, sort)
+
+
+def _remember(state: DialogueState, intent: str, user_msg: str, trace: dict, fuzzy: bool) -> None:
+    """Keep the answered turn in the session state (greetings and unknown messages leave it as is)."""
+    if intent not in _HANDLERS:
+        return
+    cls, params = _PARAM_TYPES.get(intent), trace.get("params")
+    q = cls(**params) if cls is not None and params else None
+    state.remember(intent, q, trace.get("sort"), user_msg, len(trace.get("rows") or []), fuzzy)
+
+
+def handle_message(user_msg: str, api_key: str, model_name: Optional[str] = None, fuzzy: bool = True, stream: bool = False, trace: Optional[dict] = None, state: Optional[DialogueState] = None) -> Union[str, Iterator[str]]:
+    """
+    Route one user message and answer it with the matching handler. With a session ``state``,
+    follow-ups that refine the previous answer skip routing, extraction and retrieval.
+    """
+    # One dataset generation for the whole message, even if a refresh lands mid-way
+    with datasets.pinned():
+        if not stream:
+            with span("handle_message", stream=False) as s:
+                return _answer_message(s, user_msg, api_key, model_name, fuzzy, False, trace, state)
+        # a streamed reply is still being produced after we return: its span closes once it is drained
+        s = start_span("handle_message", stream=True)
+        return _stream_in_span(s, lambda: _answer_message(s, user_msg, api_key, model_name, fuzzy, True, trace, state))
+
+
+def _answer_message(s: Span, user_msg: str, api_key: str, model_name: Optional[str], fuzzy: bool, stream: bool, trace: Optional[dict], state: Optional[DialogueState]) -> Union[str, Iterator[str]]:
+    if state is not None:
+        ref = parse_refinement(user_msg, state)
+        if ref is not None:
+            s.set(intent=state.intent, refinement=True)
+            if trace is not None:
+                trace["intent"] = state.intent
+            with _stage(trace, "refine"):
+                prepared = _refined_prompt(user_msg, state, ref, fuzzy, trace)
+            return _generate(trace, prepared, api_key, model_name, stream)
+        trace = {} if trace is None else trace
+    with _stage(trace, "route"):
+        routed = route_query(user_msg, api_key, model_name)
+    s.set(intent=routed.intent)
+    if trace is not None:
+        trace["intent"] = routed.intent
+    if routed.intent == "greeting":
+        return handle_greeting(user_msg, api_key, model_name, stream=stream, trace=trace)
+    handler = _HANDLERS.get(routed.intent)
+    if handler is None:
+        return iter([UNKNOWN_REPLY]) if stream else UNKNOWN_REPLY
+    reply = handler(user_msg, api_key, fuzzy, model_name, params=routed.params, local=routed.local, stream=stream, trace=trace)
+    if state is not None:
+        with _stage(trace, "remember"):
+            _remember(state, routed.intent, user_msg, trace, fuzzy)
+    return reply
 
 
+async def ahandle_message(user_msg: str, api_key: str, model_name: Optional[str] = None, fuzzy: bool = True, trace: Optional[dict] = None, state: Optional[DialogueState] = None) -> str:
+    with datasets.pinned(), span("handle_message") as s:
+        if state is not None:
+            ref = parse_refinement(user_msg, state)
+            if ref is not None:
+                s.set(intent=state.intent, refinement=True)
+                if trace is not None:
+                    trace["intent"] = state.intent
+                with _stage(trace, "refine"):
+                    prepared = await _in_pool(_refined_prompt, user_msg, state, ref, fuzzy, trace)
+                with _stage(trace, "generate"):
+                    return await _areply(prepared, api_key, model_name)
+            trace = {} if trace is None else trace
+        with _stage(trace, "route"):
+            routed = await aroute_query(user_msg, api_key, model_name)
+        s.set(intent=routed.intent)
+        if trace is not None:
+            trace["intent"] = routed.intent
+        if routed.intent == "greeting":
+            return await ahandle_greeting(user_msg, api_key, model_name, trace=trace)
+        handler = _ASYNC_HANDLERS.get(routed.intent)
+        if handler is None:
+            return UNKNOWN_REPLY
+        reply = await handler(user_msg, api_key, fuzzy, model_name, params=routed.params, local=routed.local, trace=trace)
+        if state is not None:
+            with _stage(trace, "remember"):
+                await _in_pool(_remember, state, routed.intent, user_msg, trace, fuzzy)
+        return reply
@@ -5,17 +5,31 @@ import warnings
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 warnings.filterwarnings("ignore")
 
-from dataclasses import dataclass
-from typing import List, Optional, Tuple
+import functools
+from dataclasses import astuple, dataclass
+from typing import Callable, List, Optional, Tuple
 
+import numpy as np
 import pandas as pd
 
-from services.CSV_Service import load_bus, load_flights, load_hotels, load_attractions
+from config import ROUTE_MAX_LEGS
+from services.CSV_Service import (
+    load_bus,
+    load_flights,
+    load_hotels,
+    load_attractions,
+    bus_route_index,
+    flight_route_index,
+    bus_route_graph,
+    flight_route_graph,
+    attraction_theme_index,
+    datasets,
+)
+from services.Cache_Service import get_flight
+from services.City_Index_Service import CityIndex, city_mask, column_city_index, names_mask
+from services.Metrics_Service import current_span, traced
 from services.Query_Extraction_service import (
-    canonicalize_city,
-    fuzzy_city_match,
     parse_budget,
-    parse_time_to_minutes,
 )
 
 
@@ -25,69 +39,170 @@ class Query:
     destination: Optional[str] = None
     city: Optional[str] = None
     budget: Optional[int] = None
+    # Optional pre-resolved dataset names (see resolve_city); when set, matching is skipped
+    source_names: Optional[Tuple[str, ...]] = None
+    destination_names: Optional[Tuple[str, ...]] = None
+    city_names: Optional[Tuple[str, ...]] = None
+    # One of config.SORT_MODES; None means the default (cheapest) ordering
+    sort: Optional[str] = None
+    # Free text ("beaches", "heritage forts") to rank attractions by, via the TF-IDF theme index
+    theme: Optional[str] = None
+
+
+_retrieval_flight = get_flight("retrieval")
+
+
+def _coalesced(fn: Callable) -> Callable:
+    """
+    Let concurrent identical retrievals against the same dataset generation share one result.
+    The frames are shared between the callers, which only ever read them.
+    """
+    @functools.wraps(fn)
+    def wrapper(q: Query, fuzzy: bool, top_k: int = 5):
+        key = (fn.__name__, datasets.current().number, astuple(q), bool(fuzzy), int(top_k))
+        result, shared = _retrieval_flight.do(key, lambda: fn(q, fuzzy, top_k))
+        if shared:
+            s = current_span()
+            if s is not None:
+                s.set(coalesced=True)
+        return result
+    return wrapper
+
+
+def _all_cities_index() -> CityIndex:
+    return datasets.derived("all_cities_index", _build_all_cities_index)
+
+
+def _build_all_cities_index() -> CityIndex:
+    names = set()
+    for loader, cols in (
+        (load_bus, ("source", "destination")),
+        (load_flights, ("from", "to")),
+        (load_hotels, ("city",)),
+        (load_attractions, ("city",)),
+    ):
+        try:
+            df = loader()
+        except FileNotFoundError:
+            continue
+        for c in cols:
+            if c in df and isinstance(df[c].dtype, pd.CategoricalDtype):
+                names.update(df[c].cat.categories)
+    return CityIndex(sorted(names))
+
+
+def resolve_city(value: Optional[str], fuzzy: bool) -> Tuple[str, ...]:
+    """Resolve a city once against every dataset's vocabulary, for reuse across several retrievals."""
+    if not value:
+        return ()
+    return _all_cities_index().resolve(value, fuzzy)
+
+
+def _apply_city_filters(df: pd.DataFrame, col: str, value: str, fuzzy: bool, names: Optional[Tuple[str, ...]] = None) -> pd.Series:
+    # The city is resolved once against the column's distinct names; rows are matched by code
+    if names is not None:
+        return pd.Series(names_mask(df[col], names), index=df.index)
+    return pd.Series(city_mask(df[col], value, fuzzy), index=df.index)
+
+
+def _route_lookup(index, src_col: str, dst_col: str, q: Query, fuzzy: bool, top_k: int) -> pd.DataFrame:
+    df = index.df
+    sources = q.source_names if q.source_names is not None else column_city_index(df[src_col]).resolve(q.source, fuzzy)
+    destinations = q.destination_names if q.destination_names is not None else column_city_index(df[dst_col]).resolve(q.destination, fuzzy)
+    return index.lookup(sources, destinations, q.budget, top_k, q.sort)
+
+
+def _ranked_select(index, src_col: str, dst_col: str, q: Query, fuzzy: bool, top_k: int) -> pd.DataFrame:
+    df = index.df
+    mask = np.ones(len(df), dtype=bool)
+    if q.source:
+        mask &= _apply_city_filters(df, src_col, q.source, fuzzy, q.source_names).to_numpy()
+    if q.destination:
+        mask &= _apply_city_filters(df, dst_col, q.destination, fuzzy, q.destination_names).to_numpy()
+    return index.select(mask, q.budget, top_k, q.sort)
 
 
-def _apply_city_filters(df: pd.DataFrame, col: str, value: str, fuzzy: bool) -> pd.Series:
-    if not fuzzy:
-        return df[col].str.casefold() == canonicalize_city(value).casefold()
-    return df[col].apply(lambda x: fuzzy_city_match(x, value))
-
-
+@traced()
+@_coalesced
 def retrieve_buses(q: Query, fuzzy: bool, top_k: int = 5) -> pd.DataFrame:
-    df = load_bus()
-    if q.source:
-        df = df[_apply_city_filters(df, "source", q.source, fuzzy)]
-    if q.destination:
-        df = df[_apply_city_filters(df, "destination", q.destination, fuzzy)]
-    if q.budget is not None and "price" in df:
-        df = df[df["price"] <= int(q.budget)]
-    if df.empty:
-        return df
-    sort_cols = ["price"] + (["rating"] if "rating" in df.columns else [])
-    ascending = [True] + ([False] if "rating" in df.columns else [])
-    df = df.sort_values(by=sort_cols, ascending=ascending).head(top_k)
-    return df
+    index = bus_route_index()
+    if q.source and q.destination:
+        return _route_lookup(index, "source", "destination", q, fuzzy, top_k)
+    return _ranked_select(index, "source", "destination", q, fuzzy, top_k)
 
 
+@traced()
+@_coalesced
 def retrieve_flights(q: Query, fuzzy: bool, top_k: int = 5) -> pd.DataFrame:
-    df = load_flights()
-    if q.source:
-        df = df[_apply_city_filters(df, "from", q.source, fuzzy)]
-    if q.destination:
-        df = df[_apply_city_filters(df, "to", q.destination, fuzzy)]
-    if q.budget is not None and "price" in df:
-        df = df[df["price"] <= int(q.budget)]
-    if df.empty:
-        return df
-    if "time_taken" in df:
-        df = df.assign(_mins=df["time_taken"].map(parse_time_to_minutes))
-    sort_cols = ["price"] + (["_mins"] if "_mins" in df.columns else [])
-    ascending = [True] + ([True] if "_mins" in df.columns else [])
-    df = df.sort_values(by=sort_cols, ascending=ascending).head(top_k)
-    return df.drop(columns=[c for c in ["_mins"] if c in df.columns])
+    index = flight_route_index()
+    if q.source and q.destination:
+        return _route_lookup(index, "from", "to", q, fuzzy, top_k)
+    return _ranked_select(index, "from", "to", q, fuzzy, top_k)
+
+
+def _connections(graph, src_col: str, dst_col: str, q: Query, fuzzy: bool, top_k: int) -> pd.DataFrame:
+    df = graph.df
+    if not q.source or not q.destination:
+        return df.iloc[0:0]
+    sources = q.source_names if q.source_names is not None else column_city_index(df[src_col]).resolve(q.source, fuzzy)
+    destinations = q.destination_names if q.destination_names is not None else column_city_index(df[dst_col]).resolve(q.destination, fuzzy)
+    objective = "duration" if q.sort == "fastest" else "price"
+    itineraries = graph.plan(sources, destinations, objective, ROUTE_MAX_LEGS, top_k, q.budget)
+    return graph.to_frame(itineraries)
+
+
+@traced()
+@_coalesced
+def retrieve_bus_connections(q: Query, fuzzy: bool, top_k: int = 5) -> pd.DataFrame:
+    """Connecting bus itineraries (one row per leg, grouped by ``option``) for routes with no direct bus."""
+    return _connections(bus_route_graph(), "source", "destination", q, fuzzy, top_k)
+
+
+@traced()
+@_coalesced
+def retrieve_flight_connections(q: Query, fuzzy: bool, top_k: int = 5) -> pd.DataFrame:
+    """Connecting flight itineraries (one row per leg, grouped by ``option``) for routes with no direct flight."""
+    return _connections(flight_route_graph(), "from", "to", q, fuzzy, top_k)
 
 
+@traced()
+@_coalesced
 def retrieve_hotels(q: Query, fuzzy: bool, top_k: int = 5) -> Tuple[pd.DataFrame, str]:
     df = load_hotels()
     price_col = "price_per_night_inr" if "price_per_night_inr" in df.columns else "price_per_night"
     if q.city:
-        df = df[_apply_city_filters(df, "city", q.city, fuzzy)]
-    if q.budget is not None and price_col in df:
-        df = df[df[price_col] <= int(q.budget)]
+        df = df[_apply_city_filters(df, "city", q.city, fuzzy, q.city_names)]
+    return rank_hotels(df, price_col, q.budget, q.sort, top_k), price_col
+
+
+def rank_hotels(df: pd.DataFrame, price_col: str, budget: Optional[int], sort: Optional[str], top_k: int) -> pd.DataFrame:
+    """Hotels within ``budget``, cheapest (then best rated) first, or best rated first for "best_rated"."""
+    if budget is not None and price_col in df:
+        df = df[df[price_col] <= int(budget)]
     if df.empty:
-        return df, price_col
+        return df
     sort_cols = [price_col] + (["rating"] if "rating" in df.columns else [])
     ascending = [True] + ([False] if "rating" in df.columns else [])
-    df = df.sort_values(by=sort_cols, ascending=ascending).head(top_k)
-    return df, price_col
+    if sort == "best_rated" and "rating" in df.columns:
+        sort_cols, ascending = sort_cols[::-1], ascending[::-1]
+    return df.sort_values(by=sort_cols, ascending=ascending).head(top_k)
 
 
+@traced()
+@_coalesced
 def retrieve_attractions(q: Query, fuzzy: bool, top_k: int = 5) -> pd.DataFrame:
+    """
+    Attractions in the city. With a theme, the best TF-IDF matches come first and carry a
+    ``theme_score`` column; without one (or when nothing matches it) a random sample is returned.
+    """
     df = load_attractions()
-    if q.city:
-        df = df[_apply_city_filters(df, "city", q.city, fuzzy)]
+    mask = _apply_city_filters(df, "city", q.city, fuzzy, q.city_names).to_numpy() if q.city else None
+    if q.theme:
+        positions, scores = attraction_theme_index().search(q.theme, top_k, mask)
+        if len(positions):
+            return df.iloc[positions].assign(theme_score=scores)
+    if mask is not None:
+        df = df[mask]
     if df.empty:
         return df
     return df.sample(n=min(top_k, len(df)))
-
-
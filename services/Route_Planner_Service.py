@@ -0,0 +1,213 @@
+import os
+import sys
+import warnings
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+warnings.filterwarnings("ignore")
+
+import heapq
+import itertools
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+DAY = 24 * 60
+OBJECTIVES = ("price", "duration")
+
+
+@dataclass(frozen=True)
+class Itinerary:
+    """One way through the network: trips taken in order, times in minutes from midnight of the first day."""
+    legs: Tuple[int, ...]  # row positions in the graph's frame
+    cities: Tuple[str, ...]
+    departures: Tuple[int, ...]
+    arrivals: Tuple[int, ...]
+    price: int
+
+    @property
+    def duration_mins(self) -> int:
+        return self.arrivals[-1] - self.departures[0]
+
+    @property
+    def layovers(self) -> Tuple[int, ...]:
+        return tuple(d - a for a, d in zip(self.arrivals, self.departures[1:]))
+
+
+def _all_pairs(weights: np.ndarray) -> np.ndarray:
+    # Floyd-Warshall, one vectorized relaxation per intermediate city
+    dist = weights.copy()
+    np.fill_diagonal(dist, 0)
+    for k in range(len(dist)):
+        np.minimum(dist, dist[:, k, None] + dist[None, k, :], out=dist)
+    return dist
+
+
+class RouteGraph:
+    """
+    Scheduled trips as a city graph, built once per dataset. Each trip is an edge that runs daily
+    at its departure time; a transfer is feasible when the next trip leaves at least
+    ``min_layover`` and at most ``max_layover`` minutes after the previous one arrives.
+
+    Outgoing trips are stored as adjacency lists keyed by city (one span per city, sorted by
+    departure). All-pairs tables over the cheapest/fastest trip between each pair give the
+    fewest legs between two cities (the connectivity table: unreachable pairs are rejected
+    before any search) and admissible A* bounds on the remaining price and ride time.
+    """
+
+    def __init__(self, df: pd.DataFrame, src_col: str, dst_col: str, min_layover: int = 30, max_layover: int = 12 * 60) -> None:
+        self.df = df
+        self.min_layover = min_layover
+        self.max_layover = max_layover
+        self.cities: List[str] = []
+        self.city_ids: Dict[str, int] = {}
+        self.adjacency: Dict[str, Tuple[int, int]] = {}
+        n_rows = len(df)
+        have = all(c in df for c in (src_col, dst_col, "departure_mins", "duration_mins"))
+        src = df[src_col].astype(str).to_numpy() if have else np.empty(0, dtype=object)
+        dst = df[dst_col].astype(str).to_numpy() if have else np.empty(0, dtype=object)
+        if have:
+            # trips without a parsed departure or duration can't be chained
+            valid = (df["departure_mins"].to_numpy() >= 0) & (df["duration_mins"].to_numpy() > 0)
+            valid &= df[src_col].notna().to_numpy() & df[dst_col].notna().to_numpy() & (src != dst)
+        else:
+            valid = np.zeros(n_rows, dtype=bool)
+        positions = np.flatnonzero(valid)
+        self.cities = sorted(set(src[positions]) | set(dst[positions]))
+        self.city_ids = {c: i for i, c in enumerate(self.cities)}
+        n = len(self.cities)
+        lookup = np.vectorize(self.city_ids.__getitem__, otypes=[np.int64])
+        s = lookup(src[positions]) if len(positions) else np.empty(0, dtype=np.int64)
+        d = lookup(dst[positions]) if len(positions) else np.empty(0, dtype=np.int64)
+        dep = df["departure_mins"].to_numpy()[positions].astype(np.int64) if have else np.empty(0, dtype=np.int64)
+        dur = df["duration_mins"].to_numpy()[positions].astype(np.int64) if have else np.empty(0, dtype=np.int64)
+        price = (df["price"].to_numpy()[positions].astype(np.int64) if "price" in df
+                 else np.zeros(len(positions), dtype=np.int64))
+
+        order = np.lexsort((dep, s))
+        self._pos, self._dst, self._dep, self._dur, self._price = (a[order] for a in (positions, d, dep, dur, price))
+        self._offsets = np.searchsorted(s[order], np.arange(n + 1))
+        for i, city in enumerate(self.cities):
+            self.adjacency[city] = (int(self._offsets[i]), int(self._offsets[i + 1]))
+
+        inf = np.inf
+        cheapest = np.full((n, n), inf)
+        fastest = np.full((n, n), inf)
+        np.minimum.at(cheapest, (s, d), price)
+        np.minimum.at(fastest, (s, d), dur)
+        self.hops = _all_pairs(np.where(np.isfinite(cheapest), 1.0, inf))
+        self.min_price = _all_pairs(cheapest)
+        self.min_duration = _all_pairs(fastest)
+
+    def resolve(self, names: Iterable[str]) -> List[int]:
+        return [self.city_ids[n] for n in names if n in self.city_ids]
+
+    def connected(self, source: str, destination: str, max_legs: Optional[int] = None) -> bool:
+        """Is there any chain of routes (ignoring timetables) of at most ``max_legs`` legs?"""
+        s, d = self.city_ids.get(source), self.city_ids.get(destination)
+        if s is None or d is None or s == d:
+            return False
+        hops = self.hops[s, d]
+        return bool(np.isfinite(hops) and (max_legs is None or hops <= max_legs))
+
+    def plan(self, sources: Iterable[str], destinations: Iterable[str], objective: str = "price", max_legs: int = 3,
+             top_k: int = 5, budget: Optional[int] = None, labels_per_path: int = 4) -> List[Itinerary]:
+        """
+        Best ``top_k`` itineraries of at most ``max_legs`` legs, one per sequence of cities,
+        ranked by total ``price`` or door-to-door ``duration`` (ride plus layovers).
+
+        A* over partial itineraries: each pop extends the cheapest partial itinerary with every
+        trip that leaves within the layover window. Partial itineraries are simple paths, and at
+        most ``labels_per_path`` of them are extended per city sequence (only ones that connect
+        onward count), which bounds the search while keeping alternatives whose arrival time
+        connects better downstream.
+        """
+        if objective not in OBJECTIVES:
+            raise ValueError(f"objective must be one of {OBJECTIVES}, got {objective!r}")
+        src = self.resolve(sources)
+        dst = set(self.resolve(destinations))
+        src = [c for c in src if c not in dst]
+        if not src or not dst:
+            return []
+        dst_ids = sorted(dst)
+        hops_to = self.hops[:, dst_ids].min(axis=1)
+        if hops_to[src].min() > max_legs:
+            return []
+        price_to = self.min_price[:, dst_ids].min(axis=1)
+        bound = price_to if objective == "price" else self.min_duration[:, dst_ids].min(axis=1)
+        limit = np.inf if budget is None else int(budget)
+        by_price = objective == "price"
+
+        heap: list = []
+        tie = itertools.count()
+
+        def push(path: tuple, legs: tuple, deps: tuple, arrs: tuple, price: int, edges: np.ndarray, dep_abs: np.ndarray) -> int:
+            remaining = max_legs - len(legs) - 1
+            nxt = self._dst[edges]
+            prices = price + self._price[edges]
+            arr_abs = dep_abs + self._dur[edges]
+            keep = (hops_to[nxt] <= remaining) & (prices + price_to[nxt] <= limit) & ~np.isin(nxt, path)
+            first = deps[0] if deps else None
+            for e, c, p, t0, t1 in zip(edges[keep].tolist(), nxt[keep].tolist(), prices[keep].tolist(),
+                                       dep_abs[keep].tolist(), arr_abs[keep].tolist()):
+                elapsed = t1 - (t0 if first is None else first)
+                g, tiebreak = (p, elapsed) if by_price else (elapsed, p)
+                heapq.heappush(heap, (g + bound[c], tiebreak, next(tie), c,
+                                      path + (c,), legs + (e,), deps + (t0,), arrs + (t1,), p))
+            return int(keep.sum())
+
+        for s in src:
+            start, end = self._offsets[s], self._offsets[s + 1]
+            edges = np.arange(start, end)
+            push((s,), (), (), (), 0, edges, self._dep[edges])
+
+        results: List[Itinerary] = []
+        found = set()
+        expanded: Dict[tuple, int] = {}
+        arrived: set = set()
+        window = self.max_layover - self.min_layover
+        while heap and len(results) < top_k:
+            _, _, _, city, path, legs, deps, arrs, price = heapq.heappop(heap)
+            if city in dst:
+                if path not in found:
+                    found.add(path)
+                    results.append(Itinerary(
+                        legs=tuple(int(self._pos[e]) for e in legs),
+                        cities=tuple(self.cities[c] for c in path),
+                        departures=deps, arrivals=arrs, price=price,
+                    ))
+                continue
+            # a later pop reaching the same city at the same time along the same path is dominated
+            if len(legs) >= max_legs or expanded.get(path, 0) >= labels_per_path or (path, arrs[-1]) in arrived:
+                continue
+            arrived.add((path, arrs[-1]))
+            start, end = self._offsets[city], self._offsets[city + 1]
+            ready = arrs[-1] + self.min_layover
+            # daily trips: wait until the next departure at or after ``ready``
+            wait = (self._dep[start:end] - ready) % DAY
+            edges = start + np.flatnonzero(wait <= window)
+            # only extensions that led somewhere use up the path's quota
+            if push(path, legs, deps, arrs, price, edges, ready + wait[edges - start]):
+                expanded[path] = expanded.get(path, 0) + 1
+        return results
+
+    def to_frame(self, itineraries: List[Itinerary]) -> pd.DataFrame:
+        """One row per leg: the trip's own columns plus option, leg, departure day and clock time, layover and totals."""
+        if not itineraries:
+            return self.df.iloc[0:0]
+        positions = [p for it in itineraries for p in it.legs]
+        out = self.df.iloc[positions].copy()
+        out["option"] = [i for i, it in enumerate(itineraries, start=1) for _ in it.legs]
+        out["leg"] = [n for it in itineraries for n in range(1, len(it.legs) + 1)]
+        out["day"] = [t // DAY + 1 for it in itineraries for t in it.departures]
+        out["departs"] = [f"{t % DAY // 60:02d}:{t % 60:02d}" for it in itineraries for t in it.departures]
+        out["layover_mins"] = [w for it in itineraries for w in (0,) + it.layovers]
+        out["total_price"] = [it.price for it in itineraries for _ in it.legs]
+        out["total_duration_mins"] = [it.duration_mins for it in itineraries for _ in it.legs]
+        return out
+
+
+def build_route_graph(df: pd.DataFrame, src_col: str, dst_col: str, min_layover: int = 30, max_layover: int = 12 * 60) -> RouteGraph:
+    return RouteGraph(df, src_col, dst_col, min_layover, max_layover)
@@ -0,0 +1,112 @@
+import os
+import sys
+import warnings
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+warnings.filterwarnings("ignore")
+
+import re
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+_TOKEN = re.compile(r"[a-z]+")
+
+# English function words plus the generic travel words every query carries ("places to visit in ...")
+_STOPWORDS = frozenset("""
+a about above after all also an and any are around as at be best by can could do does for from get go good
+have how i in into is it its me my near nearby of on or our places place show some suggest that the their
+there these things thing this to top trip us visit visiting want we what where which with would you your
+recommend recommendations attraction attractions tourist tourists see seeing spot spots day days plan
+itinerary city town
+""".split())
+
+
+def _stem(word: str) -> str:
+    """Tiny suffix stripper so "beaches"/"beach", "forts"/"fort" and "trekking"/"trek" share a term."""
+    if len(word) > 5 and word.endswith("ing"):
+        word = word[:-3]
+        if len(word) > 2 and word[-1] == word[-2]:
+            word = word[:-1]
+    elif len(word) > 4 and word.endswith("ies"):
+        word = word[:-3] + "y"
+    elif len(word) > 4 and word.endswith(("ches", "shes", "sses", "xes")):
+        word = word[:-2]
+    elif len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        word = word[:-1]
+    return word
+
+
+def tokenize(text: str) -> List[str]:
+    return [_stem(t) for t in _TOKEN.findall(str(text).lower()) if t not in _STOPWORDS]
+
+
+class ThemeIndex:
+    """
+    TF-IDF vectors (sublinear tf, smoothed idf, L2-normalised rows) over weighted text fields of
+    each row. A query is scored against every row with one matrix-vector product.
+    """
+
+    def __init__(self, docs: Sequence[List[str]]) -> None:
+        vocab: Dict[str, int] = {}
+        rows, cols, counts = [], [], []
+        for i, tokens in enumerate(docs):
+            if not tokens:
+                continue
+            terms, tf = np.unique([vocab.setdefault(t, len(vocab)) for t in tokens], return_counts=True)
+            rows.extend([i] * len(terms))
+            cols.extend(terms.tolist())
+            counts.extend(tf.tolist())
+        self.vocab = vocab
+        n_docs, n_terms = len(docs), len(vocab)
+        matrix = np.zeros((n_docs, n_terms), dtype=np.float32)
+        if counts:
+            matrix[rows, cols] = 1.0 + np.log(np.asarray(counts, dtype=np.float32))
+        df = np.count_nonzero(matrix, axis=0)
+        self.idf = (np.log((1.0 + n_docs) / (1.0 + df)) + 1.0).astype(np.float32)
+        matrix *= self.idf
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        self.matrix = matrix / np.where(norms > 0, norms, 1.0)
+
+    def query_vector(self, text: str) -> Optional[np.ndarray]:
+        """Normalised TF-IDF vector of the query, or None when no query term is in the vocabulary."""
+        ids = [self.vocab[t] for t in tokenize(text) if t in self.vocab]
+        if not ids:
+            return None
+        terms, tf = np.unique(ids, return_counts=True)
+        vec = np.zeros(len(self.vocab), dtype=np.float32)
+        vec[terms] = (1.0 + np.log(tf)) * self.idf[terms]
+        return vec / np.linalg.norm(vec)
+
+    def search(self, text: str, top_k: int, mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Row positions and cosine scores of the best ``top_k`` matches (score > 0), best first."""
+        vec = self.query_vector(text)
+        if vec is None:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        scores = self.matrix @ vec
+        if mask is not None:
+            scores = np.where(mask, scores, 0.0)
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > top_k:
+            candidates = candidates[np.argpartition(-scores[candidates], top_k - 1)[:top_k]]
+        # stable sort so equal scores keep dataset order
+        best = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return best, scores[best]
+
+
+# Field weights: a row's category says most about its theme, its name next
+THEME_FIELDS = {"category": 3, "attraction": 2, "activities": 1, "description": 1, "state": 1}
+
+
+def build_theme_index(df: pd.DataFrame, fields: Dict[str, int] = THEME_FIELDS) -> ThemeIndex:
+    present = [(c, w) for c, w in fields.items() if c in df.columns]
+    columns = [df[c].astype(str).fillna("").to_numpy() for c, _ in present]
+    docs = []
+    for values in zip(*columns) if columns else [() for _ in range(len(df))]:
+        tokens: List[str] = []
+        for (_, weight), value in zip(present, values):
+            tokens.extend(tokenize(value) * weight)
+        docs.append(tokens)
+    return ThemeIndex(docs)
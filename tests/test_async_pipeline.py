@@ -0,0 +1,52 @@
+import os
+import sys
+import warnings
+warnings.filterwarnings("ignore")
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import asyncio
+import time
+
+import services.Query_Extraction_service as extraction
+import services.Query_Response_Service as responses
+
+
+class _SlowAsyncClient:
+    """Answers after a fixed delay without holding a thread."""
+
+    def __init__(self, api_key=None, model_name=None):
+        pass
+
+    async def agenerate(self, prompt, **kwargs):
+        await asyncio.sleep(0.2)
+        return "ok"
+
+    async def aextract_json(self, prompt, **kwargs):
+        await asyncio.sleep(0.2)
+        return {"intent": "hotel", "city": "Goa", "budget": 9000}
+
+
+def test_concurrent_conversations_overlap_on_io(monkeypatch):
+    monkeypatch.setattr(responses, "get_client", _SlowAsyncClient)
+    monkeypatch.setattr(extraction, "get_client", _SlowAsyncClient)
+
+    async def one_turn(msg):
+        routed = await responses.aroute_query(msg, "test")
+        return await responses.ahandle_hotel_query(msg, "test", True, params=routed.params)
+
+    async def main():
+        return await asyncio.gather(*(one_turn(f"somewhere nice to sleep {i}") for i in range(20)))
+
+    start = time.perf_counter()
+    replies = asyncio.run(main())
+    elapsed = time.perf_counter() - start
+    assert replies == ["ok"] * 20
+    # Twenty turns of two 0.2s calls each finish in about one turn's time
+    assert elapsed < 2.0
+
+
+def test_fast_path_skips_async_extraction(monkeypatch):
+    monkeypatch.setattr(responses, "get_client", _SlowAsyncClient)
+    routed = asyncio.run(responses.aroute_query("buses from Agra to Delhi under 2000", "test"))
+    assert routed.intent == "bus" and routed.params.source == "Agra"
@@ -0,0 +1,59 @@
+import os
+import sys
+import warnings
+warnings.filterwarnings("ignore")
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json
+import time
+
+import batch_runner
+import services.Query_Extraction_service as extraction
+import services.Query_Response_Service as responses
+from services.Gemini_Service import RateLimiter
+
+
+class _StubClient:
+    def __init__(self, api_key=None, model_name=None):
+        pass
+
+    def generate(self, prompt, **kwargs):
+        return "ok"
+
+    def extract_json(self, prompt, **kwargs):
+        return {}
+
+
+def test_rate_limiter_spaces_requests():
+    limiter = RateLimiter(rps=20, burst=1)
+    start = time.perf_counter()
+    for _ in range(5):
+        limiter.acquire()
+    # First token is free, the other four wait 1/20s each
+    assert time.perf_counter() - start >= 0.18
+
+
+def test_unlimited_rate_limiter_never_waits():
+    limiter = RateLimiter()
+    assert all(limiter._reserve() == 0.0 for _ in range(100))
+
+
+def test_batch_runner_writes_one_record_per_message(monkeypatch, tmp_path):
+    monkeypatch.setattr(responses, "get_client", _StubClient)
+    monkeypatch.setattr(extraction, "get_client", _StubClient)
+    src = tmp_path / "in.jsonl"
+    dst = tmp_path / "out.jsonl"
+    src.write_text("\n".join([
+        json.dumps({"id": "a", "message": "hello"}),
+        json.dumps("what is the weather"),
+        "",
+    ]))
+
+    assert batch_runner.main([str(src), str(dst), "--workers", "2"]) == 0
+    records = {r["id"]: r for r in map(json.loads, dst.read_text().splitlines())}
+    assert set(records) == {"a", 2}
+    assert (records["a"]["index"], records[2]["index"]) == (0, 1)
+    assert records["a"]["intent"] == "greeting" and records["a"]["response"] == "ok"
+    assert records[2]["error"] is None
+    assert "total" in records["a"]["timings_ms"]
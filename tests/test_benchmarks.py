@@ -0,0 +1,35 @@
+import os
+import sys
+import warnings
+warnings.filterwarnings("ignore")
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json
+
+import services.Query_Response_Service as responses
+from benchmarks.run_benchmarks import compare, run_suite, scaled_bus_frame
+from benchmarks.stub_gemini import stub_gemini
+from services.CSV_Service import load_bus
+
+
+def test_stub_replaces_gemini_for_the_whole_pipeline():
+    with stub_gemini(text_reply="canned") as stub:
+        reply = responses.handle_bus_query("cheap bus please", "stub", True)
+    assert reply == "canned"
+    assert stub.calls >= 1
+    assert responses.get_client.__module__ == "services.Gemini_Service"
+
+
+def test_scaled_bus_frame_multiplies_rows():
+    assert len(scaled_bus_frame(3)) == 3 * len(load_bus())
+
+
+def test_suite_results_are_json_and_comparable(tmp_path):
+    report = run_suite(repeat=1, scales=(1,), groups=("retrieve", "render", "handler"))
+    names = {r["name"] for r in report["results"]}
+    assert {"buses.route", "rows_to_bulleted_text", "bus.fast_path", "bus.llm"} <= names
+    path = tmp_path / "bench.json"
+    path.write_text(json.dumps(report))
+    baseline = json.loads(path.read_text())
+    assert compare(report, baseline, threshold=1.5) == []
@@ -0,0 +1,29 @@
+import os
+import sys
+import warnings
+warnings.filterwarnings("ignore")
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+
+from services.City_Index_Service import CityIndex, city_mask
+from services.Query_Extraction_service import fuzzy_city_match
+
+
+def test_resolve_exact_fuzzy_and_aliases():
+    index = CityIndex(["Agra", "Delhi", "New Delhi", "Mumbai", "Bengaluru", "Alappuzha (Alleppey)"])
+    assert index.resolve("agra", fuzzy=False) == ("Agra",)
+    assert index.resolve("Agraa", fuzzy=True) == ("Agra",)
+    assert index.resolve("Bombay", fuzzy=False) == ("Mumbai",)
+    assert index.resolve("Bangalore", fuzzy=True) == ("Bengaluru",)
+    assert set(index.resolve("New Delhi", fuzzy=False)) == {"Delhi", "New Delhi"}
+    assert index.resolve("Alleppey", fuzzy=False) == ("Alappuzha (Alleppey)",)
+    assert index.resolve("Shimla", fuzzy=True) == ()
+
+
+def test_mask_matches_row_wise_fuzzy_filter():
+    col = pd.Series(["Agra", "Delhi", "Agra", "Lucknow", "Kanpur", "Delhi"] * 50).astype("category")
+    for value in ("agra", "Dilli", "Luckno", "Kanpur"):
+        expected = col.astype(str).apply(lambda x: fuzzy_city_match(x, value)).to_numpy()
+        assert (city_mask(col, value, fuzzy=True) == expected).all()
@@ -0,0 +1,29 @@
+import os
+import sys
+import warnings
+warnings.filterwarnings("ignore")
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from concurrent.futures import ThreadPoolExecutor
+
+from services.Gemini_Service import client_registry_stats, get_client, shutdown_clients
+
+
+def test_clients_are_reused_per_key_and_model():
+    shutdown_clients()
+    before = client_registry_stats()
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        clients = list(pool.map(lambda _: get_client("test-key", "gemini-2.5-flash"), range(32)))
+    assert all(c is clients[0] for c in clients)
+    assert get_client("test-key", "gemini-2.5-pro") is not clients[0]
+    # The model object is built once and reused by every generate call
+    assert clients[0]._model("gemini-2.5-flash") is clients[0].model
+
+    stats = client_registry_stats()
+    assert stats["created"] - before["created"] == 2
+    assert stats["hits"] - before["hits"] == 31
+    assert stats["clients"] == 2
+
+    shutdown_clients()
+    assert client_registry_stats()["clients"] == 0
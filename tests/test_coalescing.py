@@ -0,0 +1,91 @@
+import os
+import sys
+import warnings
+warnings.filterwarnings("ignore")
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import services.Gemini_Service as gemini_service
+import services.Retrieval_Service as retrieval
+from services.Cache_Service import ResponseCache, SingleFlight
+
+
+def test_concurrent_callers_share_one_call_and_errors():
+    flight = SingleFlight("test")
+    release = threading.Event()
+    calls = []
+
+    def work():
+        calls.append(1)
+        release.wait(5)
+        return ["result"]
+
+    with ThreadPoolExecutor(8) as pool:
+        futures = [pool.submit(flight.do, "k", work) for _ in range(8)]
+        while flight.stats()["leaders"] + flight.stats()["followers"] < 8:
+            time.sleep(0.005)
+        release.set()
+        results = [f.result() for f in futures]
+    assert len(calls) == 1
+    assert sorted(shared for _, shared in results) == [False] + [True] * 7
+    assert all(value is results[0][0] for value, _ in results)
+    assert flight.stats()["coalesce_rate"] == pytest.approx(7 / 8) and flight.in_flight() == 0
+
+    # an error reaches the waiting callers too, and is not remembered afterwards
+    def boom():
+        calls.append(1)
+        raise ValueError("nope")
+
+    with pytest.raises(ValueError):
+        flight.do("k", boom)
+    assert flight.do("k", lambda: "again") == ("again", False)
+
+
+def test_cancelled_async_leader_hands_the_call_to_a_follower():
+    flight = SingleFlight("test")
+    calls = []
+
+    async def work(delay):
+        calls.append(delay)
+        await asyncio.sleep(delay)
+        return delay
+
+    async def main():
+        leader = asyncio.create_task(flight.ado("k", lambda: work(5)))
+        await asyncio.sleep(0.01)
+        follower = asyncio.create_task(flight.ado("k", lambda: work(0.01)))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        return await follower
+
+    assert asyncio.run(main()) == (0.01, False)
+    assert calls == [5, 0.01]
+
+
+def test_generate_and_retrieval_coalesce(monkeypatch):
+    monkeypatch.setattr(gemini_service, "get_response_cache", lambda: ResponseCache(max_entries=8, ttl_seconds=60))
+    client = gemini_service.GeminiClient("test-key", "gemini-2.5-flash")
+    calls = []
+
+    def slow_generate(prompt, temperature, max_output_tokens, *routing):
+        calls.append(prompt)
+        time.sleep(0.2)
+        return '{"intent": "bus"}'
+
+    monkeypatch.setattr(client, "_generate", slow_generate)
+    with ThreadPoolExecutor(6) as pool:
+        replies = list(pool.map(lambda _: client.extract_json("route me", cache=True), range(6)))
+    assert replies == [{"intent": "bus"}] * 6 and calls == ["route me"]
+
+    q = retrieval.Query(source="Agra", destination="Delhi", budget=2000)
+    with ThreadPoolExecutor(4) as pool:
+        frames = list(pool.map(lambda _: retrieval.retrieve_buses(q, fuzzy=True, top_k=3), range(4)))
+    assert all(df.equals(frames[0]) for df in frames)
+    assert retrieval.retrieve_buses(q, fuzzy=True, top_k=2).shape[0] == 2
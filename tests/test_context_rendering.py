@@ -0,0 +1,53 @@
+import os
+import sys
+import warnings
+warnings.filterwarnings("ignore")
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pandas as pd
+
+from services.CSV_Service import load_attractions, load_bus, load_hotels
+from services.Query_Extraction_service import format_currency
+from services.Query_Response_Service import _BUS_COLS, _rows_to_bulleted_text
+
+
+def _reference(df: pd.DataFrame, cols: list) -> str:
+    # The original row-by-row renderer
+    lines = []
+    for _, row in df.iterrows():
+        parts = []
+        for c in cols:
+            val = row.get(c, "")
+            if c == "price" and isinstance(val, (int, float)):
+                val = format_currency(int(val))
+            parts.append(f"{c}: {val}")
+        lines.append(" - " + "; ".join(parts))
+    return "\n".join(lines) if lines else ""
+
+
+def test_matches_row_renderer_on_every_dataset():
+    bus = load_bus().sample(n=200, random_state=0)
+    cols = [c for c in _BUS_COLS if c in bus.columns]
+    assert _rows_to_bulleted_text(bus, cols) == _reference(bus, cols)
+
+    attractions = load_attractions()
+    cols = [c for c in ["city", "category", "attraction", "description", "activities", "best_time"] if c in attractions.columns]
+    assert _rows_to_bulleted_text(attractions, cols) == _reference(attractions, cols)
+
+
+def test_labels_rename_without_copying():
+    hotels = load_hotels().head(10)
+    price_col = "price_per_night_inr" if "price_per_night_inr" in hotels.columns else "price_per_night"
+    before = list(hotels.columns)
+    text = _rows_to_bulleted_text(hotels, ["city", "hotel_name", price_col, "rating"], {price_col: "price_per_night"})
+    assert list(hotels.columns) == before
+    renamed = hotels.rename(columns={price_col: "price_per_night"})
+    assert text == _reference(renamed, ["city", "hotel_name", "price_per_night", "rating"])
+
+
+def test_missing_values_and_empty_frames():
+    df = pd.DataFrame({"city": pd.Categorical(["Goa", "Pune"]), "note": ["quiet", np.nan], "price": [1200, 45000]})
+    assert _rows_to_bulleted_text(df, ["city", "note", "price"]) == _reference(df, ["city", "note", "price"])
+    assert _rows_to_bulleted_text(df.iloc[0:0], ["city"]) == ""
@@ -0,0 +1,98 @@
+import os
+import sys
+import warnings
+warnings.filterwarnings("ignore")
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import hashlib
+
+import pandas as pd
+
+import services.CSV_Service as csv_service
+from services.City_Index_Service import column_city_index
+import services.Dataset_Service as dataset_service
+from services.Dataset_Service import DatasetManager, DatasetSpec, FileState
+
+
+def _manager(tmp_path, monkeypatch):
+    monkeypatch.setattr(csv_service, "SNAPSHOT_DIR", str(tmp_path / "snap"))
+    src = tmp_path / "hotels.csv"
+    src.write_text("City,Hotel_Name,Price_Per_Night_INR,Rating\nAgra,A,1200,4.1\nDelhi,B,900,3.9\n")
+    spec = DatasetSpec(
+        path=str(src),
+        load=lambda path: csv_service._load_with_snapshot(path, csv_service._parse_hotels, ("city",)),
+        parse=csv_service._parse_hotels,
+        city_cols=("city",),
+        store=csv_service._write_snapshot,
+    )
+    manager = DatasetManager({"hotels": spec})
+    builds = []
+
+    def cities():
+        return manager.derived("cities", lambda: builds.append(1) or set(manager.frame("hotels")["city"]), ("hotels",))
+
+    return manager, src, cities, builds
+
+
+def test_appended_rows_are_ingested_incrementally(tmp_path, monkeypatch):
+    manager, src, cities, builds = _manager(tmp_path, monkeypatch)
+    before = manager.frame("hotels")
+    assert cities() == {"Agra", "Delhi"}
+    with open(src, "a") as f:
+        f.write("Goa,C,3000,4.5\nAgra,D,700,3.2\n")
+
+    [report] = manager.refresh()
+    assert (report.mode, report.rows_before, report.rows_after, report.rows_added) == ("append", 2, 4, 2)
+    after = manager.frame("hotels")
+    assert list(after["hotel_name"]) == ["A", "B", "C", "D"]
+    assert after["price_per_night_inr"].dtype == before["price_per_night_inr"].dtype
+    # existing city codes are kept; the new city is appended and resolvable
+    assert list(after["city"].cat.categories) == ["Agra", "Delhi", "Goa"]
+    assert list(after["city"].cat.codes[:2]) == list(before["city"].cat.codes)
+    assert column_city_index(after["city"]).resolve("goa", fuzzy=False) == ("Goa",)
+    # the derived value was rebuilt once, before the swap; the old frame is untouched
+    assert cities() == {"Agra", "Delhi", "Goa"} and len(builds) == 2
+    assert len(before) == 2
+    # the appended frame was snapshotted for the next cold start
+    pd.testing.assert_frame_equal(csv_service._read_snapshot(str(src)), after)
+
+
+def test_rewrites_reload_and_touches_do_not(tmp_path, monkeypatch):
+    manager, src, cities, builds = _manager(tmp_path, monkeypatch)
+    manager.frame("hotels")
+    cities()
+    assert manager.refresh() == []
+
+    os.utime(src, ns=(0, 0))
+    assert manager.refresh() == [] and len(builds) == 1
+
+    src.write_text("City,Hotel_Name,Price_Per_Night_INR,Rating\nGoa,C,3000,4.5\n")
+    [report] = manager.refresh()
+    assert (report.mode, report.rows_before, report.rows_after) == ("full", 2, 1)
+    assert cities() == {"Goa"} and len(builds) == 2
+
+
+def test_pinned_requests_keep_their_generation(tmp_path, monkeypatch):
+    manager, src, cities, _ = _manager(tmp_path, monkeypatch)
+    manager.frame("hotels")
+    with manager.pinned():
+        with open(src, "a") as f:
+            f.write("Goa,C,3000,4.5\n")
+        manager.refresh()
+        assert len(manager.frame("hotels")) == 2 and cities() == {"Agra", "Delhi"}
+    assert len(manager.frame("hotels")) == 3 and "Goa" in cities()
+
+
+def test_file_state_hashes_in_blocks_with_the_prefix_digest(tmp_path, monkeypatch):
+    monkeypatch.setattr(dataset_service, "_HASH_BLOCK", 4)
+    data = b"city,name\nAgra,A\nDelhi,B\n"
+    path = tmp_path / "rows.csv"
+    path.write_bytes(data)
+    with open(path, "rb") as f:
+        state, prefix = FileState.read(f, 15)
+    assert state.digest == hashlib.blake2b(data).hexdigest() and state.size == len(data)
+    assert prefix == hashlib.blake2b(data[:15]).hexdigest()
+    assert state.header == b"city,name\n" and state.ends_with_newline
+    with open(path, "rb") as f:
+        assert FileState.read(f, len(data) + 1)[1] is None
@@ -0,0 +1,111 @@
+import os
+import sys
+import warnings
+warnings.filterwarnings("ignore")
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import services.Query_Response_Service as responses
+from config import TOP_K
+from services.CSV_Service import bus_route_index
+from services.Dialogue_Service import DialogueState, parse_refinement
+from services.Query_Extraction_service import HotelQuery, RouteQuery
+from services.Retrieval_Service import Query, retrieve_buses
+
+
+class _Client:
+    def __init__(self):
+        self.prompts = []
+
+    def generate(self, prompt, **kwargs):
+        self.prompts.append(prompt)
+        return "ok"
+
+    def count_tokens(self, prompt):
+        return None
+
+
+def _bus_state():
+    state = DialogueState()
+    state.remember("bus", RouteQuery("Agra", "Delhi", 2000), "cheapest", "buses from Agra to Delhi under 2000", 5, True)
+    return state
+
+
+def test_parse_refinement():
+    state = _bus_state()
+    assert parse_refinement("what about under 1500?", state).budget == 1500
+    assert parse_refinement("2k", state).budget == 2000
+    assert parse_refinement("and the return?", state).swap
+    assert parse_refinement("show me more", state).more
+    assert parse_refinement("fastest one?", state).sort == "fastest"
+    # new questions are not refinements
+    assert parse_refinement("buses from Delhi to Jaipur under 1500", state) is None
+    assert parse_refinement("what about Jaipur?", state) is None
+    assert parse_refinement("thanks!", state) is None
+    assert parse_refinement("under 1500", DialogueState()) is None
+    # counts and dates are not budgets or paging
+    assert parse_refinement("is there a bus for 3 of us", state) is None
+    assert parse_refinement("bus for 3 of us?", state) is None
+    assert parse_refinement("anything for the next day?", state) is None
+    assert parse_refinement("something for ₹900?", state).budget == 900
+    assert parse_refinement("next options please", state).more
+
+    hotels = DialogueState()
+    hotels.remember("hotel", HotelQuery("Goa", 5000), "cheapest", "hotels in Goa under 5000", 3, True)
+    ref = parse_refinement("best rated, and the way back?", hotels)
+    assert ref.sort == "best_rated" and not ref.swap
+
+
+def test_refined_turn_skips_routing_and_retrieval(monkeypatch):
+    client = _Client()
+    monkeypatch.setattr(responses, "get_client", lambda *a, **k: client)
+    state = DialogueState()
+    responses.handle_message("buses from Agra to Delhi under 2000", "key", state=state)
+    assert state.intent == "bus" and state.has_candidates
+
+    def _unexpected(*args, **kwargs):
+        raise AssertionError("refinements must not route, extract or retrieve")
+
+    monkeypatch.setattr(responses, "route_query", _unexpected)
+    monkeypatch.setattr(responses, "retrieve_buses", _unexpected)
+    trace = {}
+    responses.handle_message("what about under 300?", "key", trace=trace, state=state)
+    assert list(trace["timings"]) == ["refine", "generate"]
+    assert trace["params"]["budget"] == 300 and trace["rows"]
+    assert all(row["price"] <= 300 for row in trace["rows"])
+    assert len(client.prompts) == 2 and "(follow-up: what about under 300?)" in client.prompts[-1]
+
+
+def test_swap_and_more_page_through_candidates(monkeypatch):
+    monkeypatch.setattr(responses, "get_client", lambda *a, **k: _Client())
+    state = _bus_state()
+    first = {}
+    responses.handle_message("and the way back?", "key", trace=first, state=state)
+    assert (first["params"]["source"], first["params"]["destination"]) == ("Delhi", "Agra")
+    assert {row["source"] for row in first["rows"]} == {"Delhi"}
+
+    more = {}
+    responses.handle_message("show more", "key", trace=more, state=state)
+    seen = [(row["departure_time"], row["price"]) for row in first["rows"] + more["rows"]]
+    assert more["rows"] and len(set(seen)) == len(seen)
+    assert state.shown == len(first["rows"]) + len(more["rows"])
+
+
+def test_refinements_rank_the_whole_route(monkeypatch):
+    # Mumbai -> Pune has several hundred buses; every ordering and page must cover all of them
+    monkeypatch.setattr(responses, "get_client", lambda *a, **k: _Client())
+    state = DialogueState()
+    state.remember("bus", RouteQuery("Mumbai", "Pune", None), "cheapest", "buses from Mumbai to Pune", 5, True)
+    for follow_up, sort in (("fastest one?", "fastest"), ("earliest?", "earliest")):
+        trace = {}
+        responses.handle_message(follow_up, "key", trace=trace, state=state)
+        direct = retrieve_buses(Query(source="Mumbai", destination="Pune", sort=sort), fuzzy=True, top_k=TOP_K)
+        assert [r["price"] for r in trace["rows"]] == direct["price"].tolist()
+        assert [r["duration_mins"] for r in trace["rows"]] == direct["duration_mins"].tolist()
+        assert [r["departure_mins"] for r in trace["rows"]] == direct["departure_mins"].tolist()
+
+    more = {}
+    responses.handle_message("show more", "key", trace=more, state=state)
+    direct = retrieve_buses(Query(source="Mumbai", destination="Pune", sort="earliest"), fuzzy=True, top_k=2 * TOP_K)
+    assert [r["departure_mins"] for r in more["rows"]] == direct["departure_mins"].tolist()[TOP_K:]
+    assert len(bus_route_index().lookup(("Mumbai",), ("Pune",), None, 10_000)) > 200
@@ -0,0 +1,107 @@
+import os
+import sys
+import warnings
+warnings.filterwarnings("ignore")
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+from google.api_core.exceptions import NotFound
+
+import services.Gemini_Service as gemini_service
+from services.Gemini_Service import ConcurrencyLimiter, GeminiClient, LatencyTracker
+from services.Metrics_Service import metrics
+
+
+class _Model:
+    """Replies with its own name after the next queued delay (the last one repeats)."""
+
+    def __init__(self, name, delays=(0.0,), missing=False):
+        self.name = name
+        self.delays = list(delays)
+        self.missing = missing
+        self.calls = 0
+        self.cancelled = 0
+
+    def _delay(self):
+        self.calls += 1
+        if self.missing:
+            raise NotFound(self.name)
+        return self.delays.pop(0) if len(self.delays) > 1 else self.delays[0]
+
+    def generate_content(self, prompt, generation_config=None, stream=False):
+        time.sleep(self._delay())
+        return SimpleNamespace(text=self.name, usage_metadata=None)
+
+    async def generate_content_async(self, prompt, generation_config=None):
+        delay = self._delay()
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return SimpleNamespace(text=self.name, usage_metadata=None)
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(gemini_service, "latency_tracker", LatencyTracker())
+    monkeypatch.setattr(gemini_service, "concurrency_limiter", ConcurrencyLimiter(initial=8))
+    client = GeminiClient("test-key", "gemini-2.5-flash")
+    models = {}
+    monkeypatch.setattr(client, "_model", lambda name: models[name])
+    return client, models
+
+
+def _count(name, **labels):
+    key = tuple(sorted(labels.items()))
+    return metrics.snapshot()["counters"].get(name, {}).get(key, 0)
+
+
+def test_fallback_cascade_moves_down_the_ranked_models(client):
+    client, models = client
+    models.update(primary=_Model("primary", missing=True), backup=_Model("backup"))
+    before = _count("travel_llm_fallbacks_total", model="primary", reason="not_found")
+    assert client.generate("hi", models=["primary", "backup"]) == "backup"
+    assert _count("travel_llm_fallbacks_total", model="primary", reason="not_found") == before + 1
+    assert client._retry_models()[0] == "gemini-2.5-flash" and len(client._retry_models()) > 1
+
+
+def test_slow_call_is_hedged_to_the_same_model(client):
+    client, models = client
+    models["primary"] = _Model("primary", delays=(1.5, 0.0))
+    for _ in range(gemini_service.LLM_HEDGE_MIN_SAMPLES):
+        gemini_service.latency_tracker.record("primary", 100, 0.05)
+    wins = _count("travel_llm_hedge_wins_total", model="primary", role="hedge")
+    start = time.perf_counter()
+    assert client.generate("hi", max_output_tokens=100, models=["primary"]) == "primary"
+    assert time.perf_counter() - start < 1.0
+    assert models["primary"].calls == 2
+    assert _count("travel_llm_hedge_wins_total", model="primary", role="hedge") == wins + 1
+    # calls with another output cap have no history yet, so they are not hedged
+    assert gemini_service.GeminiClient._hedge_plan(["primary"], 200, None) == (None, "primary")
+
+
+def test_async_hedge_goes_to_a_faster_model_and_cancels_the_loser(client):
+    client, models = client
+    models.update(slow=_Model("slow", delays=(5.0,)), fast=_Model("fast"))
+    for _ in range(gemini_service.LLM_HEDGE_MIN_SAMPLES):
+        gemini_service.latency_tracker.record("slow", 100, 3.0)
+        gemini_service.latency_tracker.record("fast", 100, 0.2)
+    hedges = _count("travel_llm_hedges_total", model="slow", hedge_model="fast")
+
+    async def main():
+        start = time.perf_counter()
+        text = await client.agenerate("hi", max_output_tokens=100, models=["slow", "fast"], latency_budget=0.6)
+        await asyncio.sleep(0)  # let the cancelled loser unwind
+        return text, time.perf_counter() - start
+
+    text, elapsed = asyncio.run(main())
+    assert text == "fast" and elapsed < 1.0
+    assert models["slow"].cancelled == 1 and models["fast"].calls == 1
+    assert _count("travel_llm_hedges_total", model="slow", hedge_model="fast") == hedges + 1
+    assert gemini_service.concurrency_limiter.stats()["in_flight"] == 0
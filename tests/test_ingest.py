@@ -0,0 +1,52 @@
+import os
+import sys
+import warnings
+warnings.filterwarnings("ignore")
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import services.CSV_Service as csv_service
+from services.City_Index_Service import column_city_index
+
+_FLIGHTS = (
+    "date,Airline,ch_code,dep_time,From,time_taken,stop,To,price,Class\n"
+    "11-02-2022,SpiceJet,SG,18:55,Delhi,02h 10m,non-stop,Mumbai,\"5,953\",economy\n"
+    "11-02-2022,Vistara,UK,06:20,Delhi,02h 20m,non-stop,Mumbai,\"5,956\",economy\n"
+    "11-02-2022,Indigo,6E,04:25,Mumbai,1h 05m,non-stop,Goa,\"2,102\",economy\n"
+    "11-02-2022,Vistara,UK,09:30,Goa,30h 15m,1-stop,Delhi,\"25,612\",business\n"
+    "11-02-2022,AirAsia,I5,21:00,Chennai,02h 45m,non-stop,Delhi,\"7,425\",economy\n"
+)
+
+
+def _parse(tmp_path, monkeypatch, max_chunk_rows):
+    src = tmp_path / "flights.csv"
+    src.write_text(_FLIGHTS)
+    monkeypatch.setattr(csv_service, "_PROBE_ROWS", 2)
+    monkeypatch.setattr(csv_service, "INGEST_MAX_CHUNK_ROWS", max_chunk_rows)
+    return csv_service._parse_flights(str(src))
+
+
+def test_chunked_ingest_projects_and_narrows(tmp_path, monkeypatch):
+    whole = _parse(tmp_path, monkeypatch, 1000)
+    chunked = _parse(tmp_path, monkeypatch, 1)
+    pd.testing.assert_frame_equal(chunked, whole)
+
+    assert list(chunked.columns) == ["airline", "time_taken", "price", "class", "from", "to", "dep_time", "duration_mins", "departure_mins"]
+    assert chunked["price"].dtype == np.int32 and list(chunked["price"]) == [5953, 5956, 2102, 25612, 7425]
+    assert list(chunked["duration_mins"]) == [130, 140, 65, 1815, 165]
+    assert list(chunked["departure_mins"]) == [1135, 380, 265, 570, 1260]
+    # categories seen in later chunks are unioned, not turned back into strings
+    for c in ("airline", "class", "from", "to", "dep_time", "time_taken"):
+        assert isinstance(chunked[c].dtype, pd.CategoricalDtype), c
+    assert list(chunked["airline"].astype(str)) == ["SpiceJet", "Vistara", "Indigo", "Vistara", "AirAsia"]
+    assert column_city_index(chunked["from"]).resolve("chennai", fuzzy=False) == ("Chennai",)
+
+
+def test_ingest_stops_at_the_memory_budget(tmp_path, monkeypatch):
+    monkeypatch.setattr(csv_service, "INGEST_MEMORY_BUDGET_MB", 0)
+    with pytest.raises(MemoryError, match="INGEST_MEMORY_BUDGET_MB"):
+        _parse(tmp_path, monkeypatch, 1000)
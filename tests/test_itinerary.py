@@ -0,0 +1,38 @@
+import os
+import sys
+import warnings
+warnings.filterwarnings("ignore")
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import services.Query_Response_Service as responses
+from services.Query_Extraction_service import ItineraryQuery
+from services.Retrieval_Service import Query, resolve_city, retrieve_buses
+
+
+def test_cities_resolved_once_and_legs_timed(monkeypatch):
+    calls = []
+
+    def counting_resolve(value, fuzzy):
+        calls.append(value)
+        return resolve_city(value, fuzzy)
+
+    monkeypatch.setattr(responses, "resolve_city", counting_resolve)
+    trace = {}
+    it = ItineraryQuery(num_days=2, source="Agra", destination="Delhi", budget=20000)
+    prepared = responses._itinerary_prompt("plan 2 days from Agra to Delhi", it, True, trace)
+
+    assert sorted(calls) == ["Agra", "Delhi"]
+    assert "source: Agra; destination: Delhi" in prepared.prompt
+    assert "source: Delhi; destination: Agra" in prepared.prompt
+    for leg in ("outbound_bus", "outbound_flight", "hotels", "attractions", "return_bus", "return_flight"):
+        assert leg in trace["timings"]
+
+
+def test_pre_resolved_names_match_fuzzy_resolution():
+    names = resolve_city("delhi", True)
+    assert "Delhi" in names and "New Delhi" in names
+    by_names = retrieve_buses(Query(source="x", destination="x", budget=2000,
+                                    source_names=resolve_city("Agra", True), destination_names=names), fuzzy=True)
+    by_text = retrieve_buses(Query(source="Agra", destination="Delhi", budget=2000), fuzzy=True)
+    assert list(by_names.index) == list(by_text.index)
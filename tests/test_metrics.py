@@ -0,0 +1,107 @@
+import os
+import sys
+import warnings
+warnings.filterwarnings("ignore")
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json
+import time
+from types import SimpleNamespace
+
+import services.Query_Response_Service as responses
+from services.Gemini_Service import GeminiClient
+from services.Metrics_Service import MetricsRegistry, collect_spans, metrics, set_trace_sink, span_breakdown
+from services.Query_Extraction_service import ItineraryQuery, RouteQuery
+
+
+class _Model:
+    def generate_content(self, prompt, generation_config=None, stream=False):
+        usage = SimpleNamespace(prompt_token_count=12, candidates_token_count=3)
+        return SimpleNamespace(text="fine, thanks", usage_metadata=usage)
+
+
+def test_generate_span_records_sizes_and_tokens(monkeypatch):
+    client = GeminiClient("test-key", "gemini-2.5-flash")
+    monkeypatch.setattr(client, "_model", lambda name: _Model())
+    with collect_spans() as spans:
+        assert client.generate("how are you?") == "fine, thanks"
+    (s,) = spans
+    assert s.name == "gemini.generate"
+    assert s.attrs["prompt_chars"] == len("how are you?")
+    assert s.attrs["response_chars"] == len("fine, thanks")
+    assert (s.attrs["prompt_tokens"], s.attrs["response_tokens"]) == (12, 3)
+    assert 'travel_llm_tokens_total{kind="prompt",model="gemini-2.5-flash"}' in metrics.prometheus_text()
+
+
+def test_handler_spans_nest_across_itinerary_leg_threads(monkeypatch):
+    class _Client:
+        def generate(self, prompt, **kwargs):
+            return "ok"
+
+    monkeypatch.setattr(responses, "get_client", lambda api_key, model_name=None: _Client())
+    it = ItineraryQuery(num_days=2, source="Agra", destination="Delhi", budget=10000)
+    with collect_spans() as spans:
+        responses.handle_itinerary_query("trip", "test", True, params=it)
+    by_name = {s.name: s for s in spans}
+    root = by_name["handle_itinerary_query"]
+    assert root.parent_id is None
+    assert by_name["leg.outbound_bus"].trace_id == root.trace_id
+    assert by_name["retrieve_buses"].parent_id in {s.span_id for s in spans if s.name.startswith("leg.")}
+    rows = span_breakdown(spans)
+    assert rows[0][0] == "handle_itinerary_query"
+    assert any(name.startswith("    ") for name, _ in rows)
+
+
+def test_trace_sink_writes_one_json_line_per_span(monkeypatch, tmp_path):
+    class _Client:
+        def generate(self, prompt, **kwargs):
+            return "ok"
+
+    monkeypatch.setattr(responses, "get_client", lambda api_key, model_name=None: _Client())
+    path = tmp_path / "spans.jsonl"
+    set_trace_sink(str(path))
+    try:
+        q = RouteQuery(source="Agra", destination="Delhi", budget=2000)
+        responses.handle_bus_query("buses", "test", True, params=q)
+    finally:
+        set_trace_sink(None)
+    names = [json.loads(line)["name"] for line in path.read_text().splitlines()]
+    assert names[-1] == "handle_bus_query"
+    assert {"stage.extract", "stage.retrieve", "retrieve_buses", "stage.generate"} <= set(names)
+
+
+def test_streamed_reply_keeps_generate_span_open_until_consumed(monkeypatch):
+    class _Client:
+        def generate_stream(self, prompt, **kwargs):
+            yield from ("Two ", "buses ", "found.")
+
+        def count_tokens(self, prompt):
+            return None
+
+    monkeypatch.setattr(responses, "get_client", lambda api_key, model_name=None: _Client())
+    trace = {}
+    with collect_spans() as spans:
+        reply = responses.handle_message("buses from Agra to Delhi under 2000", "test", stream=True, trace=trace)
+        assert not any(s.name in {"handle_message", "stage.generate"} for s in spans)
+        chunks = []
+        for chunk in reply:
+            time.sleep(0.05)
+            chunks.append(chunk)
+    assert "".join(chunks) == "Two buses found."
+    by_name = {s.name: s for s in spans}
+    generate, root = by_name["stage.generate"], by_name["handle_message"]
+    assert generate.duration_ms >= 150 and root.duration_ms >= generate.duration_ms
+    assert trace["timings"]["generate"] >= 150
+    assert by_name["handle_bus_query"].parent_id == root.span_id and generate.parent_id == by_name["handle_bus_query"].span_id
+
+
+def test_prometheus_histogram_is_cumulative():
+    registry = MetricsRegistry(buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        registry.observe("latency_seconds", value, span="x")
+    text = registry.prometheus_text()
+    assert 'latency_seconds_bucket{span="x",le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{span="x",le="1"} 2' in text
+    assert 'latency_seconds_bucket{span="x",le="+Inf"} 3' in text
+    assert 'latency_seconds_count{span="x"} 3' in text
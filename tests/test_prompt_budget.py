@@ -0,0 +1,77 @@
+import os
+import sys
+import warnings
+warnings.filterwarnings("ignore")
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+
+import services.Query_Response_Service as responses
+from config import MAX_OUTPUT_TOKENS
+from services.CSV_Service import load_bus
+from services.Metrics_Service import metrics
+from services.Prompt_Service import estimate_tokens, set_token_stats
+from services.Query_Extraction_service import RouteQuery
+
+
+def test_table_states_shared_columns_and_header_once():
+    df = pd.DataFrame({
+        "source": ["Agra", "Agra", "Agra"],
+        "destination": ["Delhi", "Delhi", "Delhi"],
+        "bus_type": ["AC Seater", "Sleeper", "AC Seater"],
+        "price": [500, 900, 500],
+    })
+    text = responses._rows_to_table(df, ["source", "destination", "bus_type", "price", "rating"])
+    assert text.split("\n") == [
+        "(all rows) source: Agra; destination: Delhi",
+        "bus_type | price",
+        "AC Seater | ₹500",
+        "Sleeper | ₹900",
+    ]
+    # a single row keeps every column in the table
+    assert responses._rows_to_table(df.head(1), ["source", "price"]) == "source | price\nAgra | ₹500"
+    assert responses._rows_to_table(df.iloc[0:0], ["source"]) == ""
+
+
+def test_table_is_smaller_than_bulleted_rows():
+    bus = load_bus().head(5)
+    cols = [c for c in responses._BUS_COLS if c in bus.columns]
+    verbose, compact = responses._rows_to_bulleted_text(bus, cols), responses._rows_to_table(bus, cols)
+    assert estimate_tokens(compact) < 0.8 * estimate_tokens(verbose)
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("bus to Goa") == 3
+    assert estimate_tokens("₹1,200") == 6
+    assert estimate_tokens("Thiruvananthapuram") == 3
+
+
+def test_replies_use_per_intent_output_caps(monkeypatch):
+    calls = []
+
+    class _Client:
+        def generate(self, prompt, **kwargs):
+            calls.append(kwargs)
+            return "ok"
+
+        def count_tokens(self, prompt):
+            return None
+
+    monkeypatch.setattr(responses, "get_client", lambda *a, **k: _Client())
+    responses.handle_greeting("hello", "key")
+    responses.handle_bus_query("buses from Agra to Delhi", "key", True, params=RouteQuery("Agra", "Delhi", None))
+    assert [c["max_output_tokens"] for c in calls] == [MAX_OUTPUT_TOKENS["greeting"], MAX_OUTPUT_TOKENS["bus"]]
+
+
+def test_token_stats_record_both_renderings():
+    set_token_stats(True)
+    try:
+        before = metrics.snapshot()["counters"].get("travel_prompt_context_tokens_total", {})
+        responses._bus_prompt("buses from Agra to Delhi", RouteQuery("Agra", "Delhi", None), True)
+        after = metrics.snapshot()["counters"]["travel_prompt_context_tokens_total"]
+    finally:
+        set_token_stats(False)
+    grown = {dict(k)["form"]: v - before.get(k, 0.0) for k, v in after.items()}
+    assert grown["verbose"] > grown["compact"] > 0
@@ -0,0 +1,102 @@
+import os
+import sys
+import warnings
+warnings.filterwarnings("ignore")
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+from google.api_core.exceptions import InvalidArgument, ResourceExhausted, ServiceUnavailable
+
+import services.Gemini_Service as gemini_service
+from services.Gemini_Service import ConcurrencyLimiter, GeminiClient, RateLimiter
+from services.Metrics_Service import metrics
+
+
+def test_quotas_per_minute_become_buckets():
+    limiter = RateLimiter(rpm=120, tpm=600)
+    assert limiter.rps == 2 and limiter.tps == 10
+    assert limiter._reserve(500) == 0.0
+    # the second request fits the request bucket but not the 100 tokens left
+    assert limiter._reserve(150) == pytest.approx(5.0, abs=0.05)
+    limiter.charge(100)
+    assert limiter._reserve(0) > 0  # request bucket (burst 2) is now empty too
+    assert RateLimiter(rps=5, rpm=60).rps == 1
+
+
+def test_aimd_limit_halves_on_throttling_and_grows_back():
+    limiter = ConcurrencyLimiter(initial=4, min_limit=1, max_limit=6, latency_target=1.0)
+    for _ in range(4):
+        limiter.acquire()
+    waiter = threading.Thread(target=limiter.acquire)
+    waiter.start()
+    while limiter.stats()["queued"] == 0:
+        time.sleep(0.005)
+    assert metrics.snapshot()["gauges"]["travel_llm_queue_depth"][()] == 1
+
+    # one cut per round trip: the second failure was sent before the first cut
+    limiter.release(0.2, ok=False)
+    limiter.release(0.2, ok=False)
+    assert limiter.stats()["limit"] == 2
+    waiter.join(1)
+    assert waiter.is_alive()  # two calls still hold the two slots
+    limiter.release(0.2)
+    waiter.join(1)
+    assert not waiter.is_alive() and limiter.stats() == {"limit": 2, "in_flight": 2, "queued": 0}
+
+    # slow calls count as overload; healthy calls at full utilisation grow the limit back
+    limiter = ConcurrencyLimiter(initial=2, min_limit=1, max_limit=6, latency_target=1.0)
+    limiter.acquire()
+    limiter.release(1.5)
+    assert limiter.stats()["limit"] == 1
+    for _ in range(4):
+        n = limiter.stats()["limit"]
+        for _ in range(n):
+            limiter.acquire()
+        for _ in range(n):
+            limiter.release(0.1)
+    assert limiter.stats()["limit"] == 3
+    # a lone caller never uses enough of the limit to raise it
+    for _ in range(10):
+        limiter.acquire()
+        limiter.release(0.1)
+    assert limiter.stats()["limit"] == 3
+
+
+class _FlakyModel:
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def generate_content(self, prompt, generation_config=None, stream=False):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return SimpleNamespace(text="ok", usage_metadata=None)
+
+
+def test_generate_retries_throttling_with_backoff(monkeypatch):
+    monkeypatch.setattr(gemini_service, "backoff_delay", lambda attempt: 0.0)
+    monkeypatch.setattr(gemini_service, "concurrency_limiter", ConcurrencyLimiter(initial=4))
+    client = GeminiClient("test-key", "gemini-2.5-flash")
+    model = _FlakyModel([ResourceExhausted("quota"), ServiceUnavailable("busy")])
+    monkeypatch.setattr(client, "_model", lambda name: model)
+    before = metrics.snapshot()["counters"].get("travel_llm_retries_total", {})
+    assert client.generate("retry me") == "ok" and model.calls == 3
+    after = metrics.snapshot()["counters"]["travel_llm_retries_total"]
+    key = (("error", "ResourceExhausted"), ("model", "gemini-2.5-flash"))
+    assert after[key] == before.get(key, 0) + 1
+    assert gemini_service.concurrency_limiter.stats()["in_flight"] == 0
+
+    model = _FlakyModel([InvalidArgument("bad")] + [ResourceExhausted("quota")] * 10)
+    with pytest.raises(InvalidArgument):
+        client.generate("not retried")
+    assert model.calls == 1
+    with pytest.raises(ResourceExhausted):
+        client.generate("gives up", models=["gemini-2.5-flash"])
+    assert model.calls == 2 + gemini_service.LLM_MAX_RETRIES
+    assert gemini_service.concurrency_limiter.stats()["in_flight"] == 0
@@ -0,0 +1,56 @@
+import os
+import sys
+import warnings
+warnings.filterwarnings("ignore")
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import time
+
+import services.Gemini_Service as gemini_service
+from services.Cache_Service import ResponseCache, make_cache_key
+
+
+def test_lru_eviction_and_ttl():
+    cache = ResponseCache(max_entries=2, ttl_seconds=0.05)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    assert cache.get("a") == "1"
+    cache.set("c", "3")  # evicts b, the least recently used
+    assert cache.get("b") is None
+    time.sleep(0.06)
+    assert cache.get("a") is None
+    stats = cache.stats()
+    assert stats["evictions"] == 1 and stats["expirations"] >= 1 and stats["memory_hits"] == 1
+
+
+def test_sqlite_tier_is_shared_between_instances(tmp_path):
+    db = str(tmp_path / "llm_cache.sqlite")
+    writer = ResponseCache(max_entries=4, ttl_seconds=60, db_path=db)
+    writer.set("k", "shared")
+    reader = ResponseCache(max_entries=4, ttl_seconds=60, db_path=db)
+    assert reader.get("k") == "shared"
+    assert reader.get("k") == "shared"
+    assert reader.stats()["disk_hits"] == 1 and reader.stats()["memory_hits"] == 1
+
+
+def test_sqlite_size_eviction(tmp_path):
+    cache = ResponseCache(max_entries=1, ttl_seconds=60, db_path=str(tmp_path / "c.sqlite"), max_db_entries=10)
+    for i in range(15):
+        cache.set(f"k{i}", str(i))
+    assert cache.stats()["evictions"] > 0
+    assert cache._conn().execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0] <= 10
+
+
+def test_generate_uses_cache_only_when_asked(monkeypatch):
+    cache = ResponseCache(max_entries=8, ttl_seconds=60)
+    monkeypatch.setattr(gemini_service, "get_response_cache", lambda: cache)
+    calls = []
+    client = gemini_service.GeminiClient("test-key", "gemini-2.5-flash")
+    monkeypatch.setattr(client, "_generate", lambda p, t, m, *routing: calls.append(p) or '{"intent": "bus"}')
+
+    assert client.extract_json("route me", cache=True) == {"intent": "bus"}
+    assert client.extract_json("route me", cache=True) == {"intent": "bus"}
+    client.generate("route me", temperature=0.0, max_output_tokens=2000)
+    assert len(calls) == 2
+    assert make_cache_key("gemini-2.5-flash", "route me", 0.0, 2000) != make_cache_key("gemini-2.5-pro", "route me", 0.0, 2000)
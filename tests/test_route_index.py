@@ -0,0 +1,84 @@
+import os
+import sys
+import warnings
+warnings.filterwarnings("ignore")
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pandas as pd
+
+from services.CSV_Service import RouteIndex, _duration_minutes, build_bus_route_index, load_bus
+from services.Query_Extraction_service import detect_sort_mode, parse_time_to_minutes
+from services.Retrieval_Service import Query, retrieve_buses
+
+
+def _frame():
+    return pd.DataFrame({
+        "source": ["Agra", "Agra", "Agra", "Delhi", "Agra", "Agra"],
+        "destination": ["Delhi", "Delhi", "Delhi", "Agra", "Delhi", "Jaipur"],
+        "price": [900, 500, 500, 300, 1500, 100],
+        "rating": [4.0, 3.0, 4.5, 5.0, 5.0, 5.0],
+    })
+
+
+def test_partition_is_ranked_and_budget_cut():
+    df = _frame()
+    index = RouteIndex(df, "source", "destination",
+                       {"cheapest": [(df["price"].to_numpy(), True), (df["rating"].to_numpy(), False)]})
+    out = index.lookup(["Agra"], ["Delhi"], budget=1000, top_k=5)
+    assert list(out.index) == [2, 1, 0]
+    assert list(index.lookup(["Agra"], ["Delhi"], budget=None, top_k=2).index) == [2, 1]
+    assert index.lookup(["Agra"], ["Delhi"], budget=100, top_k=5).empty
+    assert index.lookup(["Jaipur"], ["Agra"], budget=None, top_k=5).empty
+
+
+def test_multiple_partitions_are_merged():
+    df = _frame()
+    index = RouteIndex(df, "source", "destination", {"cheapest": [(df["price"].to_numpy(), True)]})
+    out = index.lookup(["Agra"], ["Delhi", "Jaipur"], budget=None, top_k=3)
+    assert list(out["price"]) == [100, 500, 500]
+
+
+def test_retrieve_buses_matches_full_scan():
+    df = load_bus()
+    q = Query(source="Agra", destination="Delhi", budget=2000)
+    full = df[(df["source"] == "Agra") & (df["destination"] == "Delhi") & (df["price"] <= 2000)]
+    expected = full.sort_values(["price", "rating"], ascending=[True, False], kind="mergesort").head(5)
+    got = retrieve_buses(q, fuzzy=True, top_k=5)
+    assert np.array_equal(got.index, expected.index)
+
+
+def test_other_modes_rank_within_route_and_filter_budget():
+    df = _frame().assign(duration_mins=[300, 0, 200, 60, 90, 30], departure_mins=[600, 120, -1, 60, 900, 30])
+    index = build_bus_route_index(df)
+    # unparsed duration (0) and departure (-1) rank last
+    assert list(index.lookup(["Agra"], ["Delhi"], budget=None, top_k=5, sort="fastest").index) == [4, 2, 0, 1]
+    assert list(index.lookup(["Agra"], ["Delhi"], budget=1000, top_k=5, sort="fastest").index) == [2, 0, 1]
+    assert list(index.lookup(["Agra"], ["Delhi"], budget=None, top_k=2, sort="best_rated").index) == [4, 2]
+    assert list(index.lookup(["Agra"], ["Delhi"], budget=1000, top_k=5, sort="earliest").index) == [1, 0, 2]
+    # unknown modes fall back to cheapest
+    assert list(index.lookup(["Agra"], ["Delhi"], budget=1000, top_k=5, sort="scenic").index) == [2, 1, 0]
+
+
+def test_single_endpoint_select_uses_global_ranking():
+    df = _frame().assign(duration_mins=[300, 0, 200, 60, 90, 30])
+    index = build_bus_route_index(df)
+    mask = (df["source"] == "Agra").to_numpy()
+    assert list(index.select(mask, budget=1000, top_k=3, sort="fastest").index) == [5, 2, 0]
+    assert list(index.select(mask, budget=None, top_k=2).index) == [5, 2]
+
+
+def test_durations_parsed_at_load_match_row_parser():
+    df = load_bus()
+    expected = df["travel_duration"].map(parse_time_to_minutes)
+    assert (df["duration_mins"] == expected).all()
+    assert (_duration_minutes(pd.Series(["2h 05m", "45m", "n/a"])) == [125, 45, 0]).all()
+
+
+def test_sort_mode_from_wording():
+    assert detect_sort_mode("fastest bus from Agra to Delhi") == "fastest"
+    assert detect_sort_mode("top rated buses to Goa") == "best_rated"
+    assert detect_sort_mode("earliest flight to Goa under 5000") == "earliest"
+    assert detect_sort_mode("first class flights to Goa") == "cheapest"
+    assert detect_sort_mode("cheap but quick bus") == "cheapest"
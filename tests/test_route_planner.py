@@ -0,0 +1,110 @@
+import os
+import sys
+import warnings
+warnings.filterwarnings("ignore")
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+import pytest
+
+from services.CSV_Service import bus_route_graph
+from services.Query_Extraction_service import RouteQuery
+from services.Query_Response_Service import _bus_prompt
+from services.Retrieval_Service import Query, retrieve_bus_connections
+from services.Route_Planner_Service import build_route_graph
+
+
+def _frame():
+    # A -> B -> C with two onward B -> C departures; D is only reachable from itself
+    return pd.DataFrame({
+        "source": ["A", "B", "B", "A", "B", "D"],
+        "destination": ["B", "C", "C", "B", "C", "A"],
+        "departure_mins": [8 * 60, 9 * 60 + 15, 10 * 60, 6 * 60, 2 * 60, 0],
+        "duration_mins": [60, 60, 60, 180, 60, 60],
+        "price": [100, 100, 300, 50, 120, 10],
+    })
+
+
+def test_transfer_respects_min_layover():
+    graph = build_route_graph(_frame(), "source", "destination", min_layover=30, max_layover=12 * 60)
+    best = graph.plan(["A"], ["C"], "price", max_legs=2, top_k=1)[0]
+    # 09:15 leaves only 15 minutes after the 09:00 arrival; 02:00 tomorrow is too long a wait
+    assert best.cities == ("A", "B", "C")
+    assert best.legs == (3, 2) and best.price == 350 and best.layovers == (60,)
+
+    relaxed = build_route_graph(_frame(), "source", "destination", min_layover=10, max_layover=12 * 60)
+    assert relaxed.plan(["A"], ["C"], "price", max_legs=2, top_k=1)[0].legs == (3, 1)
+
+
+def test_overnight_transfer_and_objectives():
+    graph = build_route_graph(_frame(), "source", "destination", min_layover=30, max_layover=20 * 60)
+    cheapest = graph.plan(["A"], ["C"], "price", top_k=1)[0]
+    # the 06:00 bus (09:00 arrival) then the 02:00 departure the next day
+    assert cheapest.legs == (3, 4) and cheapest.price == 170
+    assert cheapest.departures == (6 * 60, 26 * 60)
+    fastest = graph.plan(["A"], ["C"], "duration", top_k=1)[0]
+    assert fastest.legs == (0, 2) and fastest.duration_mins == 180
+
+    frame = graph.to_frame([cheapest, fastest])
+    assert list(frame["option"]) == [1, 1, 2, 2]
+    assert list(frame["day"]) == [1, 2, 1, 1]
+    assert list(frame["departs"]) == ["06:00", "02:00", "08:00", "10:00"]
+    assert list(frame["layover_mins"]) == [0, 17 * 60, 0, 60]
+    assert list(frame["total_price"]) == [170, 170, 400, 400]
+
+
+def test_connectivity_table_rejects_unreachable_pairs():
+    graph = build_route_graph(_frame(), "source", "destination")
+    assert graph.connected("D", "C") and not graph.connected("C", "D")
+    assert not graph.connected("A", "C", max_legs=1)
+    assert graph.plan(["C"], ["D"]) == []
+    assert graph.plan(["A"], ["C"], max_legs=1) == []
+    assert graph.plan(["A"], ["Nowhere"]) == []
+    assert graph.plan(["A"], ["C"], budget=150) == []
+
+
+def test_real_network_itineraries_are_feasible():
+    graph = bus_route_graph()
+    df = graph.df
+    itineraries = graph.plan(["Agra"], ["Jaipur"], "price", max_legs=3, top_k=5)
+    assert itineraries and itineraries[0].cities == ("Agra", "Delhi", "Jaipur")
+    prices = [it.price for it in itineraries]
+    assert prices == sorted(prices)
+    assert len({it.cities for it in itineraries}) == len(itineraries)
+    for it in itineraries:
+        rows = df.iloc[list(it.legs)]
+        assert list(rows["source"].astype(str)) == list(it.cities[:-1])
+        assert list(rows["destination"].astype(str)) == list(it.cities[1:])
+        assert it.price == int(rows["price"].sum())
+        assert all(graph.min_layover <= w <= graph.max_layover for w in it.layovers)
+        assert [d % 1440 for d in it.departures] == list(rows["departure_mins"])
+
+
+def test_bus_prompt_offers_connections_when_no_direct_bus():
+    q = Query(source="Agra", destination="Jaipur")
+    assert not retrieve_bus_connections(q, fuzzy=True).empty
+    trace = {}
+    prepared = _bus_prompt("fastest bus from Agra to Jaipur", RouteQuery("Agra", "Jaipur", None), True, trace)
+    assert prepared.prompt is not None and "no direct bus" in prepared.prompt
+    assert trace["sort"] == "fastest" and trace["rows"][0]["option"] == 1
+
+    unreachable = _bus_prompt("bus from Thiruvananthapuram to Agra", RouteQuery("Thiruvananthapuram", "Agra", None), True)
+    assert unreachable.prompt is None and "couldn’t find buses" in unreachable.text
+
+
+def test_over_budget_direct_route_quotes_the_cheapest_fare(monkeypatch):
+    import services.Query_Response_Service as qrs
+
+    cheapest = int(qrs.retrieve_buses(Query(source="Agra", destination="Delhi"), fuzzy=True, top_k=1)["price"].iloc[0])
+    monkeypatch.setattr(qrs, "retrieve_bus_connections", lambda *a, **k: pytest.fail("planned connections for a served route"))
+    trace = {}
+    prepared = _bus_prompt("bus from Agra to Delhi under 1", RouteQuery("Agra", "Delhi", 1), True, trace)
+    assert prepared.prompt is None and f"₹{cheapest}" in prepared.text and "within ₹1" in prepared.text
+    assert trace["rows"] == []
+
+
+def test_over_budget_fare_needs_both_endpoints():
+    # with one endpoint missing there is no route to quote a fare for
+    prepared = _bus_prompt("buses to Delhi under 100", RouteQuery(None, "Delhi", 100), True)
+    assert prepared.prompt is None and "None" not in prepared.text and "cheapest direct" not in prepared.text
@@ -0,0 +1,54 @@
+import os
+import sys
+import warnings
+warnings.filterwarnings("ignore")
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import services.Query_Extraction_service as extraction
+from services.Query_Extraction_service import HotelQuery, ItineraryQuery, RouteQuery
+from services.Query_Response_Service import route_query
+
+
+class _CannedClient:
+    reply: dict = {}
+
+    def __init__(self, api_key, model_name=None):
+        pass
+
+    def extract_json(self, prompt, temperature=0.0, max_output_tokens=None, cache=False):
+        return dict(self.reply)
+
+
+def _route(monkeypatch, reply, user_query):
+    _CannedClient.reply = reply
+    monkeypatch.setattr(extraction, "get_client", _CannedClient)
+    return route_query(user_query, api_key="test")
+
+
+def test_route_bus(monkeypatch):
+    routed = _route(
+        monkeypatch,
+        {"intent": "bus", "source": "Agra", "destination": "Delhi", "city": None, "budget": "2000", "num_days": None},
+        "buses from Agra to Delhi under 2000",
+    )
+    assert routed.intent == "bus"
+    assert routed.params == RouteQuery(source="Agra", destination="Delhi", budget=2000)
+
+
+def test_route_hotel_and_itinerary(monkeypatch):
+    routed = _route(monkeypatch, {"intent": "hotel", "city": "Hyderabad", "budget": 8000}, "hotels in Hyderabad under 8000")
+    assert routed.params == HotelQuery(city="Hyderabad", budget=8000)
+
+    routed = _route(
+        monkeypatch,
+        {"intent": "itinerary", "source": "Mumbai", "destination": "Hyderabad", "budget": None, "num_days": None},
+        "plan a 4 day itinerary from Mumbai to Hyderabad",
+    )
+    assert routed.params == ItineraryQuery(num_days=4, source="Mumbai", destination="Hyderabad", budget=10000)
+
+
+def test_route_falls_back_to_local_intent(monkeypatch):
+    routed = _route(monkeypatch, {}, "any flights to Goa?")
+    assert routed.intent == "flight"
+    assert routed.params is None
@@ -0,0 +1,97 @@
+import os
+import sys
+import warnings
+warnings.filterwarnings("ignore")
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import http.client
+import json
+import threading
+
+import pytest
+
+import server
+import services.Query_Extraction_service as extraction
+import services.Query_Response_Service as responses
+from benchmarks.load_test import _free_port, _request, start_server
+
+
+class _StubClient:
+    def __init__(self, api_key=None, model_name=None):
+        pass
+
+    def generate(self, prompt, **kwargs):
+        return "ok"
+
+    def extract_json(self, prompt, **kwargs):
+        return {}
+
+
+@pytest.fixture
+def conn(monkeypatch):
+    monkeypatch.setattr(responses, "get_client", _StubClient)
+    monkeypatch.setattr(extraction, "get_client", _StubClient)
+    httpd = server.ApiServer(("127.0.0.1", 0), server.ApiHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    c = http.client.HTTPConnection("127.0.0.1", httpd.server_address[1], timeout=30)
+    yield c
+    c.close()
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_chat_and_retrieve(conn):
+    status, body = _request(conn, "POST", "/chat", {"message": "buses from Agra to Delhi under 2000"})
+    assert status == 200 and body["reply"] == "ok" and body["intent"] == "bus"
+    assert body["params"]["budget"] == 2000 and all(r["price"] <= 2000 for r in body["rows"])
+
+    status, body = _request(conn, "POST", "/retrieve/bus", {"source": "Agra", "destination": "Delhi", "sort": "earliest", "top_k": 3})
+    assert status == 200 and len(body["rows"]) == 3
+    departures = [r["departure_mins"] for r in body["rows"]]
+    assert departures == sorted(departures)
+
+    status, body = _request(conn, "POST", "/retrieve/hotel", {"city": "Goa", "budget": 3000})
+    assert status == 200 and body["price_col"] and all(r["city"] == "Goa" for r in body["rows"])
+
+
+def test_bad_requests_keep_the_connection_usable(conn):
+    assert _request(conn, "POST", "/retrieve/trains", {})[0] == 404
+    assert _request(conn, "POST", "/retrieve/bus", {"from": "Agra"})[0] == 400
+    assert _request(conn, "POST", "/chat", {"message": ""})[0] == 400
+    assert _request(conn, "POST", "/nowhere", {"message": "hi"})[0] == 404
+    conn.request("POST", "/chat", body=b"not json", headers={"Content-Type": "application/json"})
+    resp = conn.getresponse()
+    assert resp.status == 400 and "invalid JSON" in json.loads(resp.read())["error"]
+    status, body = _request(conn, "GET", "/healthz", None)
+    assert status == 200 and body["pid"] == os.getpid()
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="pre-fork workers need os.fork")
+def test_retrieve_rejects_malformed_fields(conn):
+    for body, field in [
+        ({"source": "Agra", "destination": "Delhi", "budget": "abc"}, "budget"),
+        ({"source": "Agra", "destination": "Delhi", "top_k": "x"}, "top_k"),
+        ({"source": "Agra", "destination": "Delhi", "top_k": 0}, "top_k"),
+        ({"source": "Agra", "destination": "Delhi", "sort": "priciest"}, "sort"),
+        ({"source": 5, "destination": "Delhi"}, "source"),
+    ]:
+        status, reply = _request(conn, "POST", "/retrieve/bus", body)
+        assert status == 400 and field in reply["error"]
+    status, reply = _request(conn, "POST", "/retrieve/bus", {"source": "Agra", "destination": "Delhi", "budget": "2000", "top_k": "2"})
+    assert status == 200 and len(reply["rows"]) == 2 and all(r["price"] <= 2000 for r in reply["rows"])
+
+
+def test_prefork_workers_serve_and_stop():
+    port = _free_port()
+    proc = start_server(port, workers=2, latency_ms=0)
+    try:
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        status, body = _request(conn, "POST", "/chat", {"message": "hotels in Goa under 3000"})
+        assert status == 200 and body["intent"] == "hotel" and body["rows"]
+        assert _request(conn, "GET", "/healthz", None)[1]["pid"] != proc.pid
+        conn.close()
+    finally:
+        proc.terminate()
+        assert proc.wait(timeout=30) == 0
@@ -0,0 +1,28 @@
+import os
+import sys
+import warnings
+warnings.filterwarnings("ignore")
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+
+import services.CSV_Service as csv_service
+
+
+def test_snapshot_round_trip_and_invalidation(tmp_path, monkeypatch):
+    monkeypatch.setattr(csv_service, "SNAPSHOT_DIR", str(tmp_path / "snap"))
+    src = tmp_path / "hotels.csv"
+    src.write_text("City,Hotel_Name,Price_Per_Night_INR,Rating\nAgra,A,1200,4.1\nDelhi,B,900,3.9\n")
+
+    parsed = csv_service._load_with_snapshot(str(src), csv_service._parse_hotels, ("city",))
+    snap = csv_service._read_snapshot(str(src))
+    pd.testing.assert_frame_equal(parsed, snap)
+    assert isinstance(snap["city"].dtype, pd.CategoricalDtype)
+
+    # Appending to the source changes its size/mtime, so the stale snapshot is ignored
+    with open(src, "a") as f:
+        f.write("Goa,C,3000,4.5\n")
+    assert csv_service._read_snapshot(str(src)) is None
+    reloaded = csv_service._load_with_snapshot(str(src), csv_service._parse_hotels, ("city",))
+    assert len(reloaded) == 3
@@ -0,0 +1,50 @@
+import os
+import sys
+import warnings
+warnings.filterwarnings("ignore")
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from types import SimpleNamespace
+
+import services.Query_Response_Service as responses
+from services.Gemini_Service import GeminiClient, ttft_stats
+from services.Query_Extraction_service import RouteQuery
+
+
+class _Blocked:
+    @property
+    def text(self):
+        raise ValueError("blocked")
+
+    candidates = []
+
+
+class _StreamingModel:
+    def generate_content(self, prompt, generation_config=None, stream=False):
+        assert stream
+        return iter([_Blocked(), SimpleNamespace(text="Hello"), SimpleNamespace(text=""), SimpleNamespace(text=" there")])
+
+
+def test_generate_stream_skips_blocked_chunks_and_records_ttft(monkeypatch):
+    client = GeminiClient("test-key", "gemini-2.5-flash")
+    monkeypatch.setattr(client, "_model", lambda name: _StreamingModel())
+    before = ttft_stats().get("count", 0)
+    assert list(client.generate_stream("hi")) == ["Hello", " there"]
+    assert ttft_stats()["count"] == before + 1
+
+
+def test_handlers_return_iterators_when_streaming(monkeypatch):
+    class _Client:
+        def generate_stream(self, prompt, **kwargs):
+            yield from ["Buses ", "found"]
+
+    monkeypatch.setattr(responses, "get_client", lambda api_key, model_name=None: _Client())
+    q = RouteQuery(source="Agra", destination="Delhi", budget=2000)
+    out = responses.handle_bus_query("buses from Agra to Delhi", "test", True, params=q, stream=True)
+    assert "".join(out) == "Buses found"
+
+    # Fallback messages are streamed as a single chunk without calling the model
+    nowhere = RouteQuery(source="Agra", destination="Atlantis", budget=2000)
+    out = responses.handle_bus_query("buses from Agra to Atlantis", "test", True, params=nowhere, stream=True)
+    assert list(out) == ["Sorry, I couldn’t find buses for Agra → Atlantis within ₹2000."]
@@ -0,0 +1,50 @@
+import os
+import sys
+import warnings
+warnings.filterwarnings("ignore")
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pandas as pd
+
+from services.Retrieval_Service import Query, retrieve_attractions
+from services.Theme_Index_Service import build_theme_index, tokenize
+
+
+def _frame():
+    return pd.DataFrame({
+        "city": ["Goa", "Goa", "Agra", "Manali"],
+        "category": ["Beach", "Church", "Monument", "Adventure"],
+        "attraction": ["Baga Beach", "Basilica of Bom Jesus", "Agra Fort", "Solang Valley"],
+        "description": ["Lively beach with shacks", "Baroque church", "Mughal red sandstone fort", "Snow slopes"],
+        "activities": ["Swimming; Water sports", "Heritage walk", "Fort tour", "Trekking; Paragliding"],
+    })
+
+
+def test_tokenize_stems_and_drops_travel_stopwords():
+    assert tokenize("Best beaches to visit") == ["beach"]
+    assert tokenize("trekking and forts") == ["trek", "fort"]
+
+
+def test_search_ranks_by_theme_and_respects_mask():
+    index = build_theme_index(_frame())
+    positions, scores = index.search("beaches", top_k=3)
+    assert list(positions) == [0]
+    assert scores[0] > 0
+    assert list(index.search("trek", top_k=3)[0]) == [3]
+    goa = np.array([True, True, False, False])
+    assert list(index.search("heritage fort", top_k=3, mask=goa)[0]) == [1]
+    assert len(index.search("museums", top_k=3)[0]) == 0
+
+
+def test_retrieve_attractions_by_theme_within_city():
+    out = retrieve_attractions(Query(city="Mumbai", theme="beaches"), fuzzy=True, top_k=5)
+    assert not out.empty
+    assert (out["city"] == "Mumbai").all()
+    assert out["category"].str.contains("Beach").all()
+    assert out["theme_score"].is_monotonic_decreasing
+
+    # No usable theme: the old random sample from the city
+    out = retrieve_attractions(Query(city="Mumbai", theme="places to visit"), fuzzy=True, top_k=3)
+    assert "theme_score" not in out.columns and len(out) == 3